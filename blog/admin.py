@@ -1,18 +1,73 @@
 from django.contrib import admin
-from django.utils import timezone
-from datetime import timedelta
-from django.db.models import Sum
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList
+from django.http import Http404, HttpResponseBadRequest
 from django.shortcuts import render
+from django.urls import path
 from django.contrib.auth import get_user_model
 from django.db import models
 from django.core.exceptions import PermissionDenied
-from .models import Category, Announcement, AnnouncementImage, Payment, Plan, Favorite, Comment, AnalyticsDummy,News,Chat,Message,Banner,GalleryImage,OtherAnnouncement
+from .models import Category, Announcement, AnnouncementImage, Payment, Plan, Favorite, Comment, AnalyticsDummy,News,Chat,ChatParticipant,Message,Banner,GalleryImage,OtherAnnouncement
 from mptt.admin import DraggableMPTTAdmin
+from . import analytics, exports
+from .cache import response_cache_stats
 
 User = get_user_model()
 
 admin.site.register(Banner)
 
+class ExportChangeList(ChangeList):
+    def get_results(self, request):
+        # Exports stream the whole filtered queryset; skip the page and the counts.
+        self.result_count = self.full_result_count = None
+        self.result_list = []
+        self.can_show_all = False
+        self.multi_page = False
+
+class ExportAdminMixin:
+    """
+    CSV / JSON Lines export of the changelist. export/<format>/ takes the same
+    filter, search and ordering parameters as the changelist; the actions
+    export the selected rows.
+    """
+    change_list_template = 'admin/blog/export_change_list.html'
+    export_columns = ()
+    actions = ['export_csv', 'export_jsonl']
+
+    def get_urls(self):
+        name = f'{self.opts.app_label}_{self.opts.model_name}_export'
+        return [
+            path('export/<str:fmt>/', self.admin_site.admin_view(self.export_view), name=name),
+        ] + super().get_urls()
+
+    def get_changelist(self, request, **kwargs):
+        if getattr(request, 'is_export', False):
+            return ExportChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def export(self, queryset, fmt):
+        return exports.export_response(queryset, self.export_columns, fmt, self.opts.model_name)
+
+    def export_view(self, request, fmt):
+        if fmt not in exports.FORMATS:
+            raise Http404
+        if not self.has_view_permission(request):
+            raise PermissionDenied
+        request.is_export = True
+        try:
+            changelist = self.get_changelist_instance(request)
+        except IncorrectLookupParameters:
+            return HttpResponseBadRequest('Неверные параметры фильтра.')
+        return self.export(changelist.queryset, fmt)
+
+    @admin.action(description='Экспорт выбранных в CSV', permissions=['view'])
+    def export_csv(self, request, queryset):
+        return self.export(queryset, 'csv')
+
+    @admin.action(description='Экспорт выбранных в JSONL', permissions=['view'])
+    def export_jsonl(self, request, queryset):
+        return self.export(queryset, 'jsonl')
+
 class AnnouncementImageInline(admin.TabularInline):
     model = AnnouncementImage
     extra = 1
@@ -29,8 +84,9 @@ class CategoryAdmin(DraggableMPTTAdmin):
     list_display_links = ('indented_title',)
 
 @admin.register(Announcement)
-class AnnouncementAdmin(admin.ModelAdmin):
+class AnnouncementAdmin(ExportAdminMixin, admin.ModelAdmin):
     inlines = [AnnouncementImageInline]
+    export_columns = exports.ANNOUNCEMENT_COLUMNS
     list_display = ('id', 'title', 'user', 'category', 'plan', 'priority', 'created_at')
     list_filter = ('plan', 'category', 'created_at')
     search_fields = ('title', 'description', 'user__username')
@@ -40,9 +96,10 @@ class GalleryImageAdmin(admin.ModelAdmin):
     list_display = ('id', 'image', 'created_at')
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'announcement', 'plan', 'amount', 'paid', 'created_at')
-    list_filter = ('plan', 'paid', 'created_at')
+class PaymentAdmin(ExportAdminMixin, admin.ModelAdmin):
+    export_columns = exports.PAYMENT_COLUMNS
+    list_display = ('id', 'user', 'announcement', 'plan', 'amount', 'status', 'paid', 'created_at')
+    list_filter = ('plan', 'status', 'paid', 'created_at')
     search_fields = ('user__username', 'announcement__title', 'payment_id')
 
 @admin.register(Favorite)
@@ -72,41 +129,32 @@ class AnalyticsAdminView(admin.ModelAdmin):
         return False
 
     def changelist_view(self, request, extra_context=None):
-        today = timezone.now()
+        # Figures come from the DailyStats rollup (see rollup_daily_stats),
+        # never from the raw tables.
         extra_context = extra_context or {}
+        extra_context.update(analytics.period_stats())
 
-        periods = {
-            'daily': today - timedelta(days=1),
-            'weekly': today - timedelta(weeks=1),
-            'monthly': today - timedelta(days=30),
-            'yearly': today - timedelta(days=365),
-        }
-
-        stats = {}
-
-        for period_name, period_start in periods.items():
-            stats[f'{period_name}_users'] = User.objects.filter(date_joined__gte=period_start).count()
-            stats[f'{period_name}_announcements'] = Announcement.objects.filter(created_at__gte=period_start).count()
-            stats[f'{period_name}_payments'] = Payment.objects.filter(
-                created_at__gte=period_start, paid=True
-            ).aggregate(total=Sum('amount'))['total'] or 0
-
-        extra_context.update(stats)
-
-        extra_context.update({
-            'total_users': User.objects.count(),
-            'total_announcements': Announcement.objects.count(),
-            'total_payments': Payment.objects.aggregate(total=Sum('amount'))['total'] or 0
-        })
+        series = analytics.time_series(days=30)
+        for metric in ('new_users', 'new_announcements', 'paid_amount'):
+            peak = max(day[metric] for day in series) or 1
+            for day in series:
+                day[f'{metric}_pct'] = round(day[metric] * 100 / peak)
+        extra_context['series'] = series
+        extra_context['response_cache'] = response_cache_stats()
 
         return super().changelist_view(request, extra_context=extra_context)
     
+class ChatParticipantInline(admin.TabularInline):
+    model = ChatParticipant
+    extra = 1
+    readonly_fields = ('unread_count', 'last_activity_at')
+
 @admin.register(Chat)
 class ChatAdmin(admin.ModelAdmin):
+    inlines = [ChatParticipantInline]
     list_display = ('id', 'announcement', 'created_at')
     list_filter = ('created_at',)
     search_fields = ('id', 'participants__username')
-    filter_horizontal = ('participants',) 
     date_hierarchy = 'created_at'
     ordering = ('-created_at',)
 
@@ -0,0 +1,129 @@
+"""
+Daily rollups behind the admin analytics dashboard.
+
+rollup() aggregates the raw tables per calendar day into DailyStats. The
+dashboard only reads DailyStats: all period figures come from one
+conditional-aggregation query and the charts from one range query.
+"""
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Count, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import Announcement, DailyStats, Payment
+
+User = get_user_model()
+
+PERIODS = {
+    'daily': 1,
+    'weekly': 7,
+    'monthly': 30,
+    'yearly': 365,
+}
+
+
+def get_lookback():
+    """
+    Payments are rolled up by creation day but may be paid later, up to the
+    age reconcile_payments still polls them at, so every run recomputes that
+    many trailing days.
+    """
+    return getattr(settings, 'PAYMENT_RECONCILE_MAX_AGE_DAYS', 7)
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def _per_day(queryset, field, start, **aggregates):
+    rows = (
+        queryset.filter(**{f'{field}__gte': _start_of_day(start)})
+        .annotate(day=TruncDate(field))
+        .values('day')
+        .annotate(**aggregates)
+    )
+    return {row.pop('day'): row for row in rows}
+
+
+def _first_day():
+    candidates = [
+        User.objects.aggregate(first=Min('date_joined'))['first'],
+        Announcement.objects.aggregate(first=Min('created_at'))['first'],
+        Payment.objects.aggregate(first=Min('created_at'))['first'],
+    ]
+    candidates = [timezone.localdate(value) for value in candidates if value is not None]
+    return min(candidates) if candidates else timezone.localdate()
+
+
+def rollup(start=None, lookback=None):
+    """Recompute DailyStats from ``start`` (default: last rolled-up day minus ``lookback``) through today."""
+    today = timezone.localdate()
+    if start is None:
+        latest = DailyStats.objects.order_by('-date').values_list('date', flat=True).first()
+        lookback = get_lookback() if lookback is None else lookback
+        start = _first_day() if latest is None else latest - timedelta(days=lookback)
+
+    users = _per_day(User.objects.all(), 'date_joined', start, new_users=Count('id'))
+    announcements = _per_day(Announcement.objects.all(), 'created_at', start, new_announcements=Count('id'))
+    payments = _per_day(
+        Payment.objects.all(), 'created_at', start,
+        payments_amount=Sum('amount'),
+        paid_amount=Sum('amount', filter=Q(paid=True)),
+    )
+
+    rows = []
+    day = start
+    while day <= today:
+        rows.append(DailyStats(
+            date=day,
+            new_users=users.get(day, {}).get('new_users', 0),
+            new_announcements=announcements.get(day, {}).get('new_announcements', 0),
+            payments_amount=payments.get(day, {}).get('payments_amount') or 0,
+            paid_amount=payments.get(day, {}).get('paid_amount') or 0,
+        ))
+        day += timedelta(days=1)
+    DailyStats.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['date'],
+        update_fields=['new_users', 'new_announcements', 'payments_amount', 'paid_amount', 'updated_at'],
+        batch_size=500,
+    )
+    return len(rows)
+
+
+def _sum(field, condition=None):
+    return Coalesce(Sum(field, filter=condition), Value(0), output_field=DailyStats._meta.get_field(field))
+
+
+def period_stats(today=None):
+    """Dashboard figures for every period plus all-time totals, in one query."""
+    today = today or timezone.localdate()
+    aggregates = {
+        'total_users': _sum('new_users'),
+        'total_announcements': _sum('new_announcements'),
+        'total_payments': _sum('payments_amount'),
+    }
+    for name, days in PERIODS.items():
+        in_period = Q(date__gt=today - timedelta(days=days))
+        aggregates[f'{name}_users'] = _sum('new_users', in_period)
+        aggregates[f'{name}_ann'] = _sum('new_announcements', in_period)
+        aggregates[f'{name}_pay'] = _sum('paid_amount', in_period)
+    return DailyStats.objects.aggregate(**aggregates)
+
+
+def time_series(days=30, today=None):
+    """One entry per day, oldest first, with zero rows for days not rolled up yet."""
+    today = today or timezone.localdate()
+    first = today - timedelta(days=days - 1)
+    stored = {
+        row['date']: row
+        for row in DailyStats.objects.filter(date__gte=first, date__lte=today).values(
+            'date', 'new_users', 'new_announcements', 'paid_amount'
+        )
+    }
+    empty = {'new_users': 0, 'new_announcements': 0, 'paid_amount': 0}
+    return [{**empty, **stored.get(first + timedelta(days=i), {}), 'date': first + timedelta(days=i)} for i in range(days)]
@@ -0,0 +1,107 @@
+import hashlib
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+CATEGORY_TREE_NAMESPACE = 'category-tree'
+
+# Views wrapped with cache_response(), for response_cache_stats().
+CACHED_VIEWS = set()
+
+
+def _version_key(namespace):
+    return f'cache-version:{namespace}'
+
+
+def get_version(namespace):
+    """
+    Current version of a cache namespace. Entries are stored under keys that
+    embed the version, so bumping it invalidates every worker at once without
+    having to find and delete the old keys.
+    """
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so an evicted counter never restarts at a
+        # version whose entries may still be cached.
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    key = _version_key(namespace)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        version = time.time_ns()
+        cache.set(key, version, timeout=None)
+        return version
+
+
+def versioned_key(namespace, *parts):
+    return ':'.join([namespace, str(get_version(namespace)), *map(str, parts)])
+
+
+def model_namespace(model):
+    return f'model:{model._meta.label_lower}'
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def response_cache_stats():
+    """{view name: {"hits": n, "misses": n}}, counted in the shared cache across workers."""
+    keys = {(name, outcome): f'response-cache:{outcome}:{name}' for name in CACHED_VIEWS for outcome in ('hits', 'misses')}
+    counts = cache.get_many(keys.values())
+    return {
+        name: {outcome: counts.get(keys[name, outcome], 0) for outcome in ('hits', 'misses')}
+        for name in sorted(CACHED_VIEWS)
+    }
+
+
+def cache_response(*models, params=(), timeout=None):
+    """
+    Cache a GET handler's response data under the versions of ``models``;
+    the post_save/post_delete signals in blog.signals bump them, so an edit
+    invalidates every worker at once. The key includes the scheme, host and
+    path, since serializers may build absolute media URLs from the request,
+    but only the query ``params`` the handler reads: any other query string
+    shares the entry instead of adding one per distinct URL.
+    """
+    namespaces = [model_namespace(model) for model in models]
+
+    def decorator(handler):
+        name = handler.__qualname__.split('.')[0]
+        CACHED_VIEWS.add(name)
+
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            query = urlencode(sorted(
+                (param, value) for param in params for value in request.GET.getlist(param)
+            ))
+            url = hashlib.md5(f'{request.build_absolute_uri(request.path)}?{query}'.encode()).hexdigest()
+            key = ':'.join(['response', name, *[str(get_version(namespace)) for namespace in namespaces], url])
+            data = cache.get(key)
+            if data is not None:
+                _count(f'response-cache:hits:{name}')
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+            _count(f'response-cache:misses:{name}')
+            response = handler(self, request, *args, **kwargs)
+            if response.status_code == 200:
+                cache.set(key, response.data, timeout or getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60 * 60))
+            response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,98 @@
+"""
+Conditional GET (ETag / Last-Modified) for DRF views.
+
+Validators come from one aggregate query over the rows a response is built
+from, never from the serialized body, so a matching If-None-Match or
+If-Modified-Since is answered with 304 before anything is loaded or
+serialized.
+"""
+import hashlib
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+from users.models import User
+from .cache import get_version, model_namespace
+from .favorites import favorite_ids
+from .models import Announcement, Category
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def embedded_versions():
+    """Cache versions of the categories and users embedded in announcements."""
+    return [get_version(model_namespace(model)) for model in (Category, User)]
+
+
+class ConditionalGetMixin:
+    """
+    Views define get_validators(request) -> (etag, last_modified datetime), or
+    (None, None) to skip conditional handling (e.g. the object doesn't exist).
+    """
+
+    def get_validators(self, request):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        response = None
+        if etag is not None or timestamp is not None:
+            response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            if etag is not None:
+                response['ETag'] = etag
+            if timestamp is not None:
+                response['Last-Modified'] = http_date(timestamp)
+            # is_favorited depends on who is asking.
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+
+class AnnouncementDetailConditionalMixin(ConditionalGetMixin):
+    """
+    An ETag from the announcement row, its images and the cache versions of
+    the embedded category and user. No Last-Modified, for the same reason as
+    the list: counters move through F() updates without touching updated_at.
+    """
+
+    def get_validators(self, request):
+        row = (
+            Announcement.objects.filter(pk=self.kwargs['pk'])
+            .annotate(images_count=Count('images'), last_image=Max('images__id'))
+            .values(
+                'id', 'updated_at', 'views_count', 'favorites_count', 'rating_sum', 'comments_count',
+                'images_count', 'last_image',
+            )
+            .first()
+        )
+        if row is None:
+            return None, None
+        favorited = row['id'] in favorite_ids(request)
+        return make_etag('detail', *row.values(), *embedded_versions(), favorited), None
+
+
+class AnnouncementListConditionalMixin(ConditionalGetMixin):
+    """
+    An ETag from a count/sum fingerprint of the filtered queryset plus the
+    cache versions of the embedded categories and users. The query string
+    (filters, cursor, page size) is part of the URL, so each page has its own
+    cache entry on the client. The user's favorite ids are mixed in for
+    is_favorited; the serializer reuses them.
+
+    No Last-Modified: max(updated_at) doesn't move when a row is deleted or a
+    counter is bumped with F(), so If-Modified-Since would serve stale pages.
+    """
+
+    def get_validators(self, request):
+        fingerprint = self.filter_queryset(self.get_queryset()).order_by().aggregate(
+            last_updated=Max('updated_at'), count=Count('id'), views=Sum('views_count'),
+            favorites=Sum('favorites_count'), ratings=Sum('rating_sum'), comments=Sum('comments_count'),
+        )
+        favorited = ','.join(map(str, sorted(favorite_ids(request))))
+        return make_etag('list', *fingerprint.values(), *embedded_versions(), favorited), None
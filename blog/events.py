@@ -0,0 +1,84 @@
+"""
+Real-time chat events for signed-in users.
+
+These are async views and must be served by the ASGI application
+(config.asgi). Under WSGI every open stream would hold a whole worker.
+EventSource cannot send headers, so the token may also be passed as
+?token=.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+
+from users.authentication import get_token
+from .pubsub import get_broker, user_channel
+
+KEEPALIVE_INTERVAL = 25
+POLL_TIMEOUT = 25
+RETRY_MS = 3000
+
+
+async def authenticate(request):
+    header = request.headers.get('Authorization', '')
+    parts = header.split()
+    key = parts[1] if len(parts) == 2 and parts[0] == 'Token' else request.GET.get('token')
+    if not key:
+        return None
+    token = await sync_to_async(get_token)(key)
+    return token.user if token is not None else None
+
+
+def format_event(message):
+    data = json.dumps(message, ensure_ascii=False)
+    return f'event: {message["type"]}\ndata: {data}\n\n'
+
+
+async def event_stream(user_id):
+    subscription = await get_broker().subscribe(user_channel(user_id))
+    try:
+        yield f'retry: {RETRY_MS}\n\n'
+        while True:
+            message = await subscription.get(timeout=KEEPALIVE_INTERVAL)
+            if message is None:
+                # Comment line: keeps proxies from closing an idle stream.
+                yield ': keepalive\n\n'
+            else:
+                yield format_event(message)
+    finally:
+        subscription.close()
+
+
+@require_GET
+async def chat_events(request):
+    """Server-sent events stream with the user's new chat messages."""
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+    response = StreamingHttpResponse(event_stream(user.id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+async def chat_events_poll(request):
+    """
+    Long-poll fallback: waits up to POLL_TIMEOUT seconds for the next events.
+    Anything sent between two polls is not replayed, so clients catch up with
+    the messages endpoint's ``after`` cursor.
+    """
+    user = await authenticate(request)
+    if user is None:
+        return JsonResponse({"detail": "Учетные данные не были предоставлены."}, status=401)
+    subscription = await get_broker().subscribe(user_channel(user.id))
+    try:
+        events = []
+        message = await subscription.get(timeout=POLL_TIMEOUT)
+        while message is not None:
+            events.append(message)
+            message = await subscription.get(timeout=0)
+    finally:
+        subscription.close()
+    return JsonResponse({"events": events})
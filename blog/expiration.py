@@ -0,0 +1,35 @@
+"""
+Archiving of listings past their expiration_date.
+
+Each chunk is a single UPDATE ... WHERE id IN (SELECT ... LIMIT n) that runs
+in its own transaction, so row locks are held briefly and a long backlog
+never turns into one huge statement. The subquery rechecks status and
+expiration_date, so a listing republished or extended meanwhile is left
+alone. updated_at is bumped, which invalidates conditional GETs and lets
+build_recommendations --incremental drop the archived listings.
+"""
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Announcement
+
+
+def get_batch_size():
+    return getattr(settings, 'EXPIRATION_BATCH_SIZE', 1000)
+
+
+def expired(now=None):
+    return Announcement.objects.filter(status='published', expiration_date__lte=now or timezone.now())
+
+
+def archive_expired(batch_size=None, now=None):
+    """Archive published listings whose expiration_date has passed. Returns the count."""
+    batch_size = batch_size or get_batch_size()
+    now = now or timezone.now()
+    chunk = expired(now).order_by('expiration_date', 'id').values('pk')[:batch_size]
+    total = 0
+    while True:
+        count = Announcement.objects.filter(pk__in=chunk).update(status='archived', updated_at=timezone.now())
+        total += count
+        if count < batch_size:
+            return total
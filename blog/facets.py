@@ -0,0 +1,125 @@
+"""
+Facet counts for the announcement board sidebar.
+
+All facets of one filter state come from a single statement: a UNION ALL of
+one GROUP BY per facet over the filtered queryset, each branch returning
+(facet, value, count). Category counts are per assigned category and are
+rolled up to every ancestor in Python, so a parent counts its whole subtree.
+Results are cached per normalized query string for FACETS_CACHE_TIMEOUT
+seconds; they are allowed to lag writes by that much.
+"""
+import hashlib
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, CharField, Count, IntegerField, Value, When
+from django.db.models.functions import Cast
+
+from .cache import CATEGORY_TREE_NAMESPACE, versioned_key
+from .models import Category
+
+# Parameters that don't change which rows are counted.
+IGNORED_PARAMS = {'cursor', 'page_size', 'ordering', 'format'}
+
+
+def get_price_buckets():
+    # Upper bounds; the last bucket is open-ended.
+    return getattr(settings, 'FACETS_PRICE_BUCKETS', (1000, 5000, 10000, 50000, 100000))
+
+
+def get_timeout():
+    return getattr(settings, 'FACETS_CACHE_TIMEOUT', 60)
+
+
+def cache_key(params):
+    items = sorted(
+        (name, value) for name in params if name not in IGNORED_PARAMS
+        for value in params.getlist(name) if value != ''
+    )
+    return 'facets:' + hashlib.md5(urlencode(items).encode()).hexdigest()
+
+
+def price_bucket(bounds):
+    return Case(
+        *(When(price__lt=bound, then=Value(i)) for i, bound in enumerate(bounds)),
+        default=Value(len(bounds)), output_field=IntegerField(),
+    )
+
+
+def _branch(queryset, facet, expression):
+    return (
+        queryset.annotate(facet=Value(facet, output_field=CharField()), value=Cast(expression, CharField()))
+        .values('facet', 'value').annotate(count=Count('id'))
+    )
+
+
+def grouped_counts(queryset, bounds):
+    """{facet: Counter(value -> count)} for the rows of ``queryset``, in one query."""
+    queryset = queryset.prefetch_related(None).select_related(None).order_by()
+    branches = [
+        _branch(queryset, 'category', 'category_id'),
+        _branch(queryset, 'condition', 'condition'),
+        _branch(queryset, 'city', 'city'),
+        _branch(queryset, 'plan', 'plan_id'),
+        _branch(queryset, 'price', price_bucket(bounds)),
+    ]
+    counts = {}
+    for row in branches[0].union(*branches[1:], all=True):
+        counts.setdefault(row['facet'], Counter())[row['value']] = row['count']
+    return counts
+
+
+def category_parents():
+    key = versioned_key(CATEGORY_TREE_NAMESPACE, 'parents')
+    parents = cache.get(key)
+    if parents is None:
+        parents = dict(Category.objects.values_list('id', 'parent_id'))
+        cache.set(key, parents, 60 * 60)
+    return parents
+
+
+def subtree_counts(counts):
+    parents = category_parents()
+    totals = Counter()
+    for category_id, count in counts.items():
+        category_id = int(category_id)
+        while category_id is not None:
+            totals[category_id] += count
+            category_id = parents.get(category_id)
+    return totals
+
+
+def _ranked(counts, name):
+    # Most frequent first; rows without a value can't be filtered on, so they are left out.
+    counts = [(value, count) for value, count in counts.items() if value is not None]
+    return [{name: value, 'count': count} for value, count in sorted(counts, key=lambda item: (-item[1], item[0]))]
+
+
+def facet_counts(queryset):
+    bounds = get_price_buckets()
+    counts = grouped_counts(queryset, bounds)
+    categories = counts.get('category', Counter())
+    plans = counts.get('plan', Counter())
+    edges = (0, *bounds, None)
+    return {
+        'count': sum(plans.values()),
+        'category': _ranked(subtree_counts({pk: n for pk, n in categories.items() if pk is not None}), 'id'),
+        'condition': _ranked(counts.get('condition', Counter()), 'value'),
+        'city': _ranked(counts.get('city', Counter()), 'value'),
+        'plan': _ranked({int(pk): n for pk, n in plans.items() if pk is not None}, 'id'),
+        'price': [
+            {'min': edges[i], 'max': edges[i + 1], 'count': counts.get('price', Counter())[str(i)]}
+            for i in range(len(edges) - 1)
+        ],
+    }
+
+
+def cached_facet_counts(queryset, params):
+    key = cache_key(params)
+    data = cache.get(key)
+    if data is None:
+        data = facet_counts(queryset)
+        cache.set(key, data, get_timeout())
+    return data
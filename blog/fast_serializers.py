@@ -0,0 +1,219 @@
+"""
+Read-only fast paths for the hot list endpoints.
+
+Each *_rows() narrows a queryset to the .values() columns its serializer
+needs, and serialize_*() turns those rows into the same dicts, in the same
+key order, as the matching DRF serializer (AnnouncementSerializer,
+CategorySerializer, CommentSerializer, MessageSerializer). Together with
+ORJSONRenderer the response bytes are identical; the tests compare them.
+Used when FAST_READ_SERIALIZERS is on.
+"""
+import decimal
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework.renderers import JSONRenderer
+
+from .favorites import favorite_ids
+from .models import Announcement, AnnouncementImage, Category, rating_average
+from .renderers import ORJSONRenderer
+
+ANNOUNCEMENT_FIELDS = (
+    'id', 'title', 'description', 'category_id', 'condition', 'location', 'latitude', 'longitude', 'status', 'plan_id',
+    'price', 'priority', 'views_count', 'favorites_count', 'rating_sum', 'rating_count', 'comments_count', 'created_at', 'updated_at', 'user__username',
+    'category__name', 'category__image', 'category__image_variants',
+)
+CATEGORY_FIELDS = ('id', 'name', 'image', 'image_variants')
+COMMENT_FIELDS = ('id', 'announcement_id', 'announcement__title', 'user__username', 'text', 'rating', 'created_at')
+MESSAGE_FIELDS = ('id', 'sender__username', 'text', 'created_at')
+
+PRICE_PLACES = Announcement._meta.get_field('price').decimal_places
+PRICE_DIGITS = Announcement._meta.get_field('price').max_digits
+
+
+def enabled():
+    return getattr(settings, 'FAST_READ_SERIALIZERS', False)
+
+
+class FastReadMixin:
+    """Renders JSON with ORJSONRenderer while FAST_READ_SERIALIZERS is on."""
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        if not enabled():
+            return renderers
+        return [ORJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+
+
+def format_datetime(value):
+    # Same as serializers.DateTimeField with the default ISO 8601 format.
+    if value is None:
+        return None
+    if settings.USE_TZ:
+        current = timezone.get_current_timezone()
+        value = value.astimezone(current) if timezone.is_aware(value) else timezone.make_aware(value, current)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def format_decimal(value, places=PRICE_PLACES, max_digits=PRICE_DIGITS):
+    # Same as serializers.DecimalField with COERCE_DECIMAL_TO_STRING.
+    if value is None:
+        return None
+    if not isinstance(value, decimal.Decimal):
+        value = decimal.Decimal(str(value).strip())
+    context = decimal.getcontext().copy()
+    context.prec = max_digits
+    return '{:f}'.format(value.quantize(decimal.Decimal('.1') ** places, context=context))
+
+
+class MediaUrls:
+    """
+    storage.url(name), made absolute like FileField does when there is a
+    request. For FileSystemStorage the urljoin() and build_absolute_uri() work
+    is hoisted out of the per-name call; names it can't prove equivalent for
+    take the regular path.
+    """
+    def __init__(self, storage, request=None):
+        self.storage = storage
+        self.request = request
+        base = getattr(storage, 'base_url', None) if isinstance(storage, FileSystemStorage) else None
+        self.base = base if base and base.endswith('/') and base.isascii() and '/.' not in base else None
+        self.host = request.build_absolute_uri('/')[:-1] if request is not None else None
+
+    def __call__(self, name):
+        if not name:
+            return None
+        path = filepath_to_uri(name).lstrip('/')
+        if self.base is None or ':' in path or '/.' in '/' + path:
+            url = self.storage.url(name)
+        else:
+            url = self.base + path
+        if self.request is None:
+            return url
+        if self.host is not None and url.startswith('/') and not url.startswith('//'):
+            return self.host + url
+        return self.request.build_absolute_uri(url)
+
+    def variants(self, variants):
+        # Same as serializers.image_variant_urls().
+        return {
+            key: {width: self(name) for width, name in names.items()}
+            for key, names in (variants or {}).items() if key != 'source'
+        }
+
+
+def announcement_rows(queryset):
+    return queryset.prefetch_related(None).values(*ANNOUNCEMENT_FIELDS)
+
+
+def serialize_announcements(rows, request=None):
+    rows = list(rows)
+    images = {row['id']: [] for row in rows}
+    image_urls = MediaUrls(AnnouncementImage._meta.get_field('image').storage, request)
+    variant_urls = MediaUrls(default_storage, request)
+    for image in (
+        AnnouncementImage.objects.filter(announcement_id__in=images)
+        .order_by('id').values('id', 'announcement_id', 'image', 'image_variants')
+    ):
+        images[image['announcement_id']].append({
+            'id': image['id'],
+            'image': image_urls(image['image']),
+            'image_variants': variant_urls.variants(image['image_variants']),
+        })
+
+    # AnnouncementSerializer.get_category() never builds absolute URLs.
+    category_urls = MediaUrls(Category._meta.get_field('image').storage)
+    category_variant_urls = MediaUrls(default_storage)
+    favorited = favorite_ids(request)
+    data = []
+    for row in rows:
+        category = None
+        if row['category_id'] is not None:
+            category = {
+                'id': row['category_id'],
+                'name': row['category__name'],
+                'image': category_urls(row['category__image']),
+                'image_variants': category_variant_urls.variants(row['category__image_variants']),
+            }
+        data.append({
+            'id': row['id'],
+            'title': row['title'],
+            'description': row['description'],
+            'category': category,
+            'condition': row['condition'],
+            'location': row['location'],
+            'latitude': row['latitude'],
+            'longitude': row['longitude'],
+            'status': row['status'],
+            'plan': row['plan_id'],
+            'price': format_decimal(row['price']),
+            'priority': row['priority'],
+            'views_count': row['views_count'],
+            'favorites_count': row['favorites_count'],
+            'rating': rating_average(row['rating_sum'], row['rating_count']),
+            'comments_count': row['comments_count'],
+            'created_at': format_datetime(row['created_at']),
+            'updated_at': format_datetime(row['updated_at']),
+            'images': images[row['id']],
+            'user': row['user__username'],
+            'is_favorited': row['id'] in favorited,
+        })
+    return data
+
+
+def category_rows(queryset):
+    return queryset.values(*CATEGORY_FIELDS)
+
+
+def serialize_categories(rows, request=None):
+    image_urls = MediaUrls(Category._meta.get_field('image').storage, request)
+    variant_urls = MediaUrls(default_storage, request)
+    return [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'image': image_urls(row['image']),
+            'image_variants': variant_urls.variants(row['image_variants']),
+        }
+        for row in rows
+    ]
+
+
+def comment_rows(queryset):
+    return queryset.values(*COMMENT_FIELDS)
+
+
+def serialize_comments(rows):
+    return [
+        {
+            'id': row['id'],
+            'announcement': row['announcement_id'],
+            'announcement_title': row['announcement__title'],
+            'user_name': row['user__username'],
+            'text': row['text'],
+            'rating': row['rating'],
+            'created_at': format_datetime(row['created_at']),
+        }
+        for row in rows
+    ]
+
+
+def message_rows(queryset):
+    return queryset.values(*MESSAGE_FIELDS)
+
+
+def serialize_messages(rows):
+    return [
+        {
+            'id': row['id'],
+            'sender': row['sender__username'],
+            'text': row['text'],
+            'created_at': format_datetime(row['created_at']),
+        }
+        for row in rows
+    ]
@@ -0,0 +1,18 @@
+from .models import Favorite
+
+
+def favorite_ids(request):
+    """
+    Ids of the announcements the requesting user has favorited, loaded with
+    one query and kept on the request, so every serializer and the
+    conditional GET validators share it.
+    """
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    ids = getattr(request, '_favorite_ids', None)
+    if ids is None:
+        ids = request._favorite_ids = frozenset(
+            Favorite.objects.filter(user=user).values_list('announcement_id', flat=True)
+        )
+    return ids
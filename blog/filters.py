@@ -0,0 +1,53 @@
+from django import forms
+from django_filters import rest_framework as filters
+
+from . import geo
+from .models import Announcement, Category
+
+
+class NumberCSVFilter(filters.BaseCSVFilter, filters.NumberFilter):
+    pass
+
+
+class AnnouncementFilterForm(forms.Form):
+    def clean(self):
+        data = super().clean()
+        near = [data.get(name) for name in ('lat', 'lon', 'radius')]
+        if None in near and any(value is not None for value in near):
+            raise forms.ValidationError('Для поиска рядом укажите lat, lon и radius.')
+        bbox = data.get('bbox')
+        if bbox is not None:
+            if len(bbox) != 4 or None in bbox:
+                raise forms.ValidationError('bbox: south,west,north,east.')
+            south, west, north, east = bbox
+            if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+                raise forms.ValidationError('Неверные границы bbox.')
+        return data
+
+
+class AnnouncementFilter(filters.FilterSet):
+    # Matches the chosen category and all of its descendants.
+    category = filters.ModelChoiceFilter(queryset=Category.objects.all(), method='filter_category')
+    # Within radius km of (lat, lon), or inside bbox=south,west,north,east.
+    lat = filters.NumberFilter(method='filter_near', min_value=-90, max_value=90)
+    lon = filters.NumberFilter(method='filter_near', min_value=-180, max_value=180)
+    radius = filters.NumberFilter(method='filter_near', min_value=0, max_value=20000)
+    bbox = NumberCSVFilter(method='filter_bbox')
+
+    class Meta:
+        model = Announcement
+        fields = ['category', 'condition', 'status', 'plan']
+        form = AnnouncementFilterForm
+
+    def filter_category(self, queryset, name, value):
+        return queryset.in_category(value)
+
+    def filter_near(self, queryset, name, value):
+        # lat and lon are applied together with radius.
+        if name != 'radius':
+            return queryset
+        data = self.form.cleaned_data
+        return geo.within_radius(queryset, float(data['lat']), float(data['lon']), float(value))
+
+    def filter_bbox(self, queryset, name, value):
+        return geo.within_box(queryset, *map(float, value))
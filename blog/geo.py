@@ -0,0 +1,175 @@
+"""
+Geohash-based location search without PostGIS.
+
+Announcements with coordinates store a geohash, whose string prefixes are
+nested cells, so the cells covering a search box turn into a few indexed
+range scans on the geohash column (merged where neighbouring cells are
+adjacent in geohash order). The rows found that way are then cut down to the
+exact box, or to the radius with a haversine expression that both SQLite
+(through Django's registered math functions) and PostgreSQL evaluate.
+Boxes crossing the antimeridian are not supported.
+
+Coordinates can be taken from the bundled data/cities.csv instead of a
+geocoding service: city_coordinates() looks a free-text city up by its name
+or one of its aliases.
+"""
+import csv
+import math
+from functools import lru_cache
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F, FloatField, Q, Value
+from django.db.models.functions import ASin, Cos, Least, Power, Radians, Sin, Sqrt
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = 111.32
+CITIES_FILE = Path(__file__).resolve().parent / 'data' / 'cities.csv'
+
+
+def get_precision():
+    return getattr(settings, 'GEOHASH_PRECISION', 9)
+
+
+def get_max_cells():
+    return getattr(settings, 'GEOHASH_MAX_CELLS', 16)
+
+
+def encode(latitude, longitude, precision=None):
+    precision = precision or get_precision()
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars, bits, index, even = [], 0, 0, True
+    while len(chars) < precision:
+        bounds, value = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (bounds[0] + bounds[1]) / 2
+        if value >= middle:
+            index = index * 2 + 1
+            bounds[0] = middle
+        else:
+            index *= 2
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[index])
+            bits = index = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """(height, width) in degrees of a cell with ``precision`` characters."""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+
+def _steps(low, high, origin, size, limit):
+    first = int((low - origin) // size)
+    last = min(int((high - origin) // size), int(limit // size) - 1)
+    return range(first, last + 1)
+
+
+def covering_cells(south, west, north, east, max_cells=None):
+    """
+    The finest geohash cells, at most ``max_cells`` of them, that cover the
+    box; None when even one-character cells would take more.
+    """
+    max_cells = max_cells or get_max_cells()
+    for precision in range(get_precision(), 0, -1):
+        height, width = cell_size(precision)
+        rows = _steps(south, north, -90.0, height, 180.0)
+        columns = _steps(west, east, -180.0, width, 360.0)
+        if len(rows) * len(columns) <= max_cells:
+            return sorted({
+                encode(-90.0 + (row + 0.5) * height, -180.0 + (column + 0.5) * width, precision)
+                for row in rows for column in columns
+            })
+    return None
+
+
+def next_prefix(prefix):
+    """The smallest string above every geohash starting with ``prefix``, or None."""
+    stripped = prefix.rstrip(BASE32[-1])
+    if not stripped:
+        return None
+    return stripped[:-1] + BASE32[BASE32.index(stripped[-1]) + 1]
+
+
+def prefix_ranges(cells):
+    ranges = []
+    for cell in cells:
+        upper = next_prefix(cell)
+        if ranges and ranges[-1][1] == cell:
+            ranges[-1][1] = upper
+        else:
+            ranges.append([cell, upper])
+    return ranges
+
+
+def geohash_filter(south, west, north, east):
+    cells = covering_cells(south, west, north, east)
+    if cells is None:
+        return Q(geohash__gt='')
+    condition = Q()
+    for lower, upper in prefix_ranges(cells):
+        condition |= Q(geohash__gte=lower, geohash__lt=upper) if upper else Q(geohash__gte=lower)
+    return condition
+
+
+def radius_box(latitude, longitude, radius_km):
+    """(south, west, north, east) around the circle."""
+    dlat = radius_km / KM_PER_DEGREE
+    cos_lat = math.cos(math.radians(latitude))
+    dlon = 180.0 if cos_lat < 1e-6 else min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    return (
+        max(latitude - dlat, -90.0), max(longitude - dlon, -180.0),
+        min(latitude + dlat, 90.0), min(longitude + dlon, 180.0),
+    )
+
+
+def distance_km(latitude, longitude):
+    """Haversine distance from the point to each row, in kilometres."""
+    a = Power(Sin(Radians(F('latitude') - latitude) / 2), 2) + (
+        Value(math.cos(math.radians(latitude)), output_field=FloatField())
+        * Cos(Radians(F('latitude')))
+        * Power(Sin(Radians(F('longitude') - longitude) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Least(Sqrt(a), Value(1.0, output_field=FloatField())))
+
+
+def within_box(queryset, south, west, north, east):
+    return queryset.filter(
+        geohash_filter(south, west, north, east),
+        latitude__range=(south, north), longitude__range=(west, east),
+    )
+
+
+def within_radius(queryset, latitude, longitude, radius_km):
+    queryset = within_box(queryset, *radius_box(latitude, longitude, radius_km))
+    return queryset.alias(distance=distance_km(latitude, longitude)).filter(distance__lte=radius_km)
+
+
+def normalize_city(name):
+    name = ' '.join(name.lower().replace('ё', 'е').split())
+    for prefix in ('город ', 'г. ', 'г.'):
+        if name.startswith(prefix):
+            return name[len(prefix):].strip()
+    return name
+
+
+@lru_cache(maxsize=None)
+def city_table():
+    table = {}
+    with open(CITIES_FILE, encoding='utf-8', newline='') as handle:
+        for row in csv.DictReader(handle):
+            point = (float(row['latitude']), float(row['longitude']))
+            for name in [row['name'], *filter(None, row['aliases'].split('|'))]:
+                table[normalize_city(name)] = point
+    return table
+
+
+def city_coordinates(name):
+    """(latitude, longitude) of a bundled city, or None."""
+    if not name:
+        return None
+    return city_table().get(normalize_city(name))
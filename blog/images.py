@@ -0,0 +1,125 @@
+"""
+Resized WebP/JPEG derivatives of uploaded images.
+
+render_variants() is pure image work and runs in a process pool, off the
+request path. The parent process stores the result in the model's
+``image_variants`` JSON field: {"source": <original name>, "webp": {width: name},
+"jpeg": {width: name}}. ``source`` shows which upload the variants belong to,
+so a replaced image is picked up again.
+"""
+import logging
+import multiprocessing
+import os
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import bump_version, model_namespace
+
+WIDTHS = (320, 640, 1280)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+def get_executor(max_workers=None):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=max_workers or getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+            )
+        return _executor
+
+
+def derivative_name(name, width, extension):
+    directory, filename = posixpath.split(name)
+    stem = os.path.splitext(filename)[0]
+    return posixpath.join(directory, 'derivatives', f'{stem}_{width}.{extension}')
+
+
+def render_variants(name):
+    """Write the derivatives of the stored image ``name`` and return their names."""
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image.load()
+    # Apply the EXIF orientation to the pixels; the EXIF block itself is not
+    # copied into the derivatives.
+    image = ImageOps.exif_transpose(image)
+    widths = [width for width in WIDTHS if width <= image.width] or [image.width]
+
+    variants = {'source': name}
+    for key, (pil_format, extension, options) in FORMATS.items():
+        variants[key] = {}
+        for width in widths:
+            resized = image.copy()
+            resized.thumbnail((width, width * 10), Image.LANCZOS)
+            if pil_format == 'JPEG' or resized.mode not in ('RGB', 'RGBA'):
+                resized = resized.convert('RGB')
+            buffer = BytesIO()
+            resized.save(buffer, format=pil_format, **options)
+            target = derivative_name(name, width, extension)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            variants[key][str(width)] = default_storage.save(target, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def needs_variants(instance):
+    image = instance.image
+    return bool(image) and (instance.image_variants or {}).get('source') != image.name
+
+
+def store_variants(model_label, pk, variants):
+    model = apps.get_model(model_label)
+    # Skip the write if the image was replaced while we were rendering.
+    updated = model.objects.filter(pk=pk, image=variants['source']).update(image_variants=variants)
+    if updated:
+        bump_version(model_namespace(model))
+    if updated and model_label == 'blog.AnnouncementImage':
+        # New variant URLs change the announcement's representation and ETag.
+        apps.get_model('blog.Announcement').objects.filter(
+            pk__in=model.objects.filter(pk=pk).values('announcement_id')
+        ).update(updated_at=timezone.now())
+
+
+def _on_rendered(model_label, pk, future):
+    try:
+        error = future.exception()
+        if error is not None:
+            logger.error('Could not render image variants for %s %s: %s', model_label, pk, error)
+            return
+        store_variants(model_label, pk, future.result())
+    finally:
+        # Runs in the executor's management thread, which owns its own connection.
+        connections.close_all()
+
+
+def schedule(instance):
+    """Render the derivatives of ``instance.image`` in the background."""
+    future = get_executor().submit(render_variants, instance.image.name)
+    future.add_done_callback(partial(_on_rendered, instance._meta.label, instance.pk))
+    return future
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog import expiration
+
+
+class Command(BaseCommand):
+    help = 'Archive published announcements whose expiration date has passed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None, help='Announcements archived per UPDATE.')
+
+    def handle(self, *args, **options):
+        count = expiration.archive_expired(batch_size=options['batch_size'])
+        self.stdout.write(f'{count} announcements archived')
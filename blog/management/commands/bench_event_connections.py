@@ -0,0 +1,133 @@
+import asyncio
+import os
+import resource
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from blog.pubsub import get_broker, user_channel
+from users.authentication import get_token
+from users.models import Token, User
+from users.tokens import make_digest
+
+
+def rss_kib():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux and bytes on macOS.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+
+
+class Connection:
+    """One SSE client talking to the ASGI application in-process."""
+
+    def __init__(self, app, path, key, index):
+        self.app = app
+        self.scope = {
+            'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+            'method': 'GET', 'scheme': 'http', 'path': path, 'raw_path': path.encode(),
+            'root_path': '', 'query_string': f'token={key}'.encode(),
+            'headers': [(b'host', b'localhost')],
+            'client': ('127.0.0.1', 10000 + index), 'server': ('localhost', 80),
+        }
+        self.opened = asyncio.Event()
+        self.closed = asyncio.Event()
+        self.received = asyncio.Event()
+        self.requested = False
+        self.status = None
+        self.received_at = None
+
+    async def receive(self):
+        if not self.requested:
+            self.requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.status = message['status']
+        elif message['type'] == 'http.response.body':
+            body = message.get('body', b'')
+            if body.startswith(b'retry:'):
+                self.opened.set()
+            elif body.startswith(b'event: message') and self.received_at is None:
+                self.received_at = time.perf_counter()
+                self.received.set()
+            if not message.get('more_body', False):
+                self.opened.set()
+
+    def run(self):
+        return asyncio.ensure_future(self.app(self.scope, self.receive, self.send))
+
+
+class Command(BaseCommand):
+    help = 'Open idle chat event streams against the ASGI application and report memory and fan-out latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000)
+        parser.add_argument('--user', help='Username to connect as (default: first user).')
+
+    async def bench(self, key, user_id, count):
+        from config.asgi import application
+
+        path = reverse('chat-events')
+        before = rss_kib()
+        started = time.perf_counter()
+        connections = [Connection(application, path, key, i) for i in range(count)]
+        tasks = [connection.run() for connection in connections]
+        await asyncio.gather(*(connection.opened.wait() for connection in connections))
+        opened_in = time.perf_counter() - started
+        failed = [connection.status for connection in connections if connection.status != 200]
+        if failed:
+            raise CommandError(f'{len(failed)} streams failed, first status {failed[0]}')
+        after = rss_kib()
+
+        broker = get_broker()
+        idle = broker.subscriber_count()
+        sent_at = time.perf_counter()
+        broker.publish(user_channel(user_id), {'type': 'message', 'chat': 0, 'message': {'text': 'bench'}})
+        await asyncio.wait_for(asyncio.gather(*(connection.received.wait() for connection in connections)), 60)
+        latencies = sorted(connection.received_at - sent_at for connection in connections)
+
+        for connection in connections:
+            connection.closed.set()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return {
+            'opened_in': opened_in,
+            'rss_before': before,
+            'rss_after': after,
+            'subscribers': idle,
+            'left_open': broker.subscriber_count(),
+            'p50': latencies[len(latencies) // 2],
+            'p99': latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        }
+
+    def handle(self, *args, **options):
+        count = options['connections']
+        users = User.objects.order_by('pk')
+        user = users.filter(username=options['user']).first() if options['user'] else users.first()
+        if user is None:
+            raise CommandError('No user to connect as.')
+
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        self.stdout.write(f'Open file limit: {soft} (a real server needs one socket per stream)')
+
+        key = Token.issue(user)
+        try:
+            get_token(key)  # Warm the token cache so the streams don't hit the database.
+            result = asyncio.run(self.bench(key, user.pk, count))
+        finally:
+            Token.objects.filter(digest=make_digest(key)).delete()
+
+        per_connection = (result['rss_after'] - result['rss_before']) / count
+        self.stdout.write(
+            f"{count} idle streams opened in {result['opened_in']:.2f}s, "
+            f"{result['subscribers']} subscribed, {result['left_open']} left after disconnect\n"
+            f"RSS {result['rss_before']} KiB -> {result['rss_after']} KiB "
+            f"({per_connection:.1f} KiB per connection)\n"
+            f"Fan-out of one message: p50 {result['p50'] * 1000:.1f} ms, p99 {result['p99'] * 1000:.1f} ms"
+        )
@@ -0,0 +1,112 @@
+import random
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import QueryDict
+
+from blog import facets
+from blog.models import Announcement, Category, Plan
+from users.models import User
+
+CONDITIONS = ('новое', 'б/у', 'на запчасти')
+CITIES = ('Москва', 'Санкт-Петербург', 'Казань', 'Новосибирск', 'Екатеринбург', 'Самара', 'Омск', 'Уфа')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare one COUNT per facet value with the single grouped facets query on seeded '
+        'announcements (rolled back afterwards).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--chunk', type=int, default=10_000, help='Rows per INSERT while seeding.')
+        parser.add_argument('--repeat', type=int, default=3)
+
+    def seed(self, rows, chunk):
+        rng = random.Random(0)
+        user = User.objects.create(username='bench', email='bench-facets@example.com', password='x')
+        categories = []
+        for i in range(5):
+            root = Category.objects.create(name=f'Бенчмарк {i}')
+            categories.append(root)
+            categories.extend(Category.objects.create(name=f'Бенчмарк {i}.{j}', parent=root) for j in range(4))
+        plans = [None] + [Plan.objects.get_or_create(name=name)[0] for name in ('basic', 'standard', 'top')]
+        for start in range(0, rows, chunk):
+            Announcement.objects.bulk_create(
+                Announcement(
+                    user=user, category=rng.choice(categories), condition=rng.choice(CONDITIONS),
+                    city=rng.choice(CITIES), plan=rng.choice(plans), price=rng.randrange(0, 200_000),
+                    title='Бенчмарк', slug=f'bench-facets-{i}', description='', status='published',
+                )
+                for i in range(start, min(start + chunk, rows))
+            )
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return user, categories, plans[1:]
+
+    def naive(self, queryset, categories, plans):
+        counts = {
+            'category': {c.pk: queryset.in_category(c).count() for c in categories},
+            'condition': {value: queryset.filter(condition=value).count() for value in CONDITIONS},
+            'city': {value: queryset.filter(city=value).count() for value in CITIES},
+            'plan': {plan.pk: queryset.filter(plan=plan).count() for plan in plans},
+        }
+        bounds = facets.get_price_buckets()
+        edges = (0, *bounds)
+        counts['price'] = [queryset.filter(price__gte=low, price__lt=high).count() for low, high in zip(edges, bounds)]
+        counts['price'].append(queryset.filter(price__gte=bounds[-1]).count())
+        return counts
+
+    def measure(self, run, repeat):
+        best = None
+        for _ in range(repeat):
+            with transaction.atomic():
+                started = time.perf_counter()
+                result = run()
+                elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                started = time.perf_counter()
+                user, categories, plans = self.seed(options['rows'], options['chunk'])
+                seeded = time.perf_counter() - started
+                queryset = Announcement.objects.filter(user=user)
+                queries = len(categories) + len(CONDITIONS) + len(CITIES) + len(plans) + len(facets.get_price_buckets()) + 1
+
+                naive_time, naive = self.measure(lambda: self.naive(queryset, categories, plans), options['repeat'])
+                grouped_time, grouped = self.measure(lambda: facets.facet_counts(queryset), options['repeat'])
+                cache.clear()
+                params = QueryDict('bench=1')
+                facets.cached_facet_counts(queryset, params)
+                cached_time, _ = self.measure(lambda: facets.cached_facet_counts(queryset, params), options['repeat'])
+                cache.clear()
+                raise Rollback
+        except Rollback:
+            pass
+
+        by_id = {row['id']: row['count'] for row in grouped['category']}
+        if (
+            by_id != {pk: n for pk, n in naive['category'].items() if n}
+            or {row['value']: row['count'] for row in grouped['condition']} != naive['condition']
+            or {row['value']: row['count'] for row in grouped['city']} != naive['city']
+            or {row['id']: row['count'] for row in grouped['plan']} != naive['plan']
+            or [row['count'] for row in grouped['price']] != naive['price']
+        ):
+            raise CommandError('Grouped facet counts differ from the per-value COUNTs.')
+        self.stdout.write(
+            f"{options['rows']} announcements seeded in {seeded:.1f} s, counts identical\n"
+            f"one COUNT per facet value ({queries} queries): {naive_time * 1000:9.1f} ms\n"
+            f"single grouped query:                  {grouped_time * 1000:9.1f} ms ({naive_time / grouped_time:.1f}x)\n"
+            f"cached:                                {cached_time * 1000:9.3f} ms"
+        )
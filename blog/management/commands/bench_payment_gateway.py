@@ -0,0 +1,96 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from blog import payments
+
+
+class SlowGateway:
+    """Fake gateway that takes ``delay`` seconds per call."""
+
+    def __init__(self, delay):
+        self.delay = delay
+
+    def create(self, payload, idempotence_key):
+        time.sleep(self.delay)
+        return {'id': idempotence_key, 'status': 'pending', 'confirmation_url': ''}
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate sync request workers serving a mix of cheap requests and payment creations '
+        'against a fake gateway, calling it inline and through payments.call_gateway(). Runs a '
+        'healthy gateway (faster than the timeout) and a degraded one (slower than the timeout).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Simulated request workers.')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per mode.')
+        parser.add_argument('--gateway-delay', type=float, default=0.3, help='Seconds the healthy gateway takes.')
+        parser.add_argument('--degraded-delay', type=float, default=3, help='Seconds the degraded gateway takes.')
+        parser.add_argument('--timeout', type=float, default=1, help='PAYMENT_GATEWAY_TIMEOUT for the guarded mode.')
+        parser.add_argument('--payment-every', type=int, default=10, help='Every Nth request creates a payment.')
+        parser.add_argument('--request-time', type=float, default=0.005, help='Seconds a cheap request takes.')
+
+    def run(self, create, options):
+        counts = {'requests': 0, 'payments': 0, 'failed': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def worker():
+            n = 0
+            while time.monotonic() < deadline:
+                n += 1
+                outcome = 'requests'
+                if n % options['payment_every'] == 0:
+                    try:
+                        create()
+                        outcome = 'payments'
+                    except payments.GatewayUnavailable:
+                        outcome = 'failed'
+                else:
+                    time.sleep(options['request_time'])
+                with lock:
+                    counts[outcome] += 1
+
+        threads = [threading.Thread(target=worker) for _ in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return counts
+
+    def compare(self, delay, options):
+        gateway = SlowGateway(delay)
+        payload = {}
+
+        def inline():
+            gateway.create(payload, 'bench')
+
+        def guarded():
+            payments.call_gateway('create', payload, 'bench', gateway=gateway)
+
+        results = {'inline': self.run(inline, options)}
+        payments.breaker.reset()
+        with override_settings(PAYMENT_GATEWAY_TIMEOUT=options['timeout']):
+            results['guarded'] = self.run(guarded, options)
+        payments.breaker.reset()
+        return results
+
+    def handle(self, *args, **options):
+        duration = options['duration']
+        self.stdout.write(
+            f"{options['workers']} workers, {duration:g}s per mode, timeout {options['timeout']:g}s"
+        )
+        for scenario, delay in (('healthy', options['gateway_delay']), ('degraded', options['degraded_delay'])):
+            if delay >= options['timeout'] and scenario == 'healthy':
+                self.stderr.write(f'--gateway-delay {delay:g} is not below --timeout; every guarded call will time out.')
+            self.stdout.write(f"{scenario} gateway ({delay:g}s per call):")
+            for mode, counts in self.compare(delay, options).items():
+                self.stdout.write(
+                    f"  {mode:>8}: {counts['requests'] / duration:8.1f} other req/s, "
+                    f"{counts['payments'] / duration:6.2f} payments created/s, "
+                    f"{counts['failed'] / duration:6.2f} payments failed fast/s"
+                )
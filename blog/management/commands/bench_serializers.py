@@ -0,0 +1,89 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from blog import fast_serializers
+from blog.models import Announcement, AnnouncementImage, Category
+from blog.renderers import ORJSONRenderer
+from blog.serializers import AnnouncementSerializer
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare AnnouncementSerializer + JSONRenderer with the .values() fast path + ORJSONRenderer '
+        'on seeded rows (rolled back afterwards).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000)
+        parser.add_argument('--images', type=int, default=3, help='Images per announcement.')
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def seed(self, rows, images):
+        user = User.objects.create(username='bench', email='bench-serializers@example.com', password='x')
+        category = Category.objects.create(
+            name='Бенчмарк', image='blog/category/bench.png',
+            image_variants={'source': 'blog/category/bench.png', 'webp': {'320': 'blog/category/derivatives/bench_320.webp'}},
+        )
+        announcements = Announcement.objects.bulk_create(
+            Announcement(
+                user=user, category=category, title=f'Велосипед {i}', slug=f'bench-serializers-{i}',
+                description='Горный велосипед в хорошем состоянии ' * 5, status='published', price=1000 + i,
+            )
+            for i in range(rows)
+        )
+        AnnouncementImage.objects.bulk_create(
+            AnnouncementImage(
+                announcement=announcement, image=f'announcements/bench-{announcement.pk}-{j}.png',
+                image_variants={'source': 'x', 'webp': {'320': f'announcements/derivatives/bench-{announcement.pk}-{j}_320.webp'}},
+            )
+            for announcement in announcements for j in range(images)
+        )
+        return [announcement.pk for announcement in announcements]
+
+    def measure(self, render, repeat):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            content = render()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/blog/announcements/'))
+        try:
+            with transaction.atomic():
+                ids = self.seed(options['rows'], options['images'])
+                queryset = Announcement.objects.filter(pk__in=ids).order_by('-priority', '-created_at', '-id')
+
+                def drf():
+                    data = AnnouncementSerializer(queryset.with_related(), many=True, context={'request': request}).data
+                    return JSONRenderer().render(data)
+
+                def fast():
+                    data = fast_serializers.serialize_announcements(fast_serializers.announcement_rows(queryset), request)
+                    return ORJSONRenderer().render(data)
+
+                drf_time, drf_content = self.measure(drf, options['repeat'])
+                fast_time, fast_content = self.measure(fast, options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+
+        if drf_content != fast_content:
+            raise CommandError('Fast path output differs from AnnouncementSerializer.')
+        self.stdout.write(
+            f"{options['rows']} announcements x {options['images']} images, {len(drf_content)} bytes, identical output\n"
+            f"AnnouncementSerializer + JSONRenderer: {drf_time * 1000:8.1f} ms\n"
+            f"fast path + ORJSONRenderer:            {fast_time * 1000:8.1f} ms ({drf_time / fast_time:.1f}x)"
+        )
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from blog import recommendations
+from blog.models import Announcement, AnnouncementRecommendation
+
+
+class Command(BaseCommand):
+    help = 'Precompute similar announcements for the recommendations endpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Only process announcements changed since the previous run.',
+        )
+        parser.add_argument('--ids', nargs='+', type=int, help='Only process these announcements.')
+
+    def handle(self, *args, **options):
+        if options['ids']:
+            count = recommendations.update(options['ids'])
+        elif options['incremental']:
+            last_run = AnnouncementRecommendation.objects.aggregate(last=Max('computed_at'))['last']
+            if last_run is None:
+                count = recommendations.rebuild()
+            else:
+                changed = Announcement.objects.filter(updated_at__gt=last_run).values_list('pk', flat=True)
+                count = recommendations.update(list(changed))
+        else:
+            count = recommendations.rebuild()
+        self.stdout.write(f'{count} announcements processed')
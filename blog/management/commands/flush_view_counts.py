@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from blog import view_counter
+
+
+class Command(BaseCommand):
+    help = 'Write buffered announcement views to the database.'
+
+    def handle(self, *args, **options):
+        count = view_counter.flush()
+        self.stdout.write(f'{count} views flushed')
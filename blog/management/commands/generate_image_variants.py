@@ -0,0 +1,43 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+
+from django.core.management.base import BaseCommand
+
+from blog import images
+from blog.models import AnnouncementImage, Banner, Category, GalleryImage
+
+MODELS = (AnnouncementImage, Banner, GalleryImage, Category)
+
+
+class Command(BaseCommand):
+    help = 'Render resized WebP/JPEG variants for existing images in parallel.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Number of worker processes.')
+        parser.add_argument('--force', action='store_true', help='Re-render images that already have variants.')
+
+    def handle(self, *args, **options):
+        jobs = []
+        for model in MODELS:
+            for instance in model.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'image_variants'):
+                if options['force'] or images.needs_variants(instance):
+                    jobs.append((model._meta.label, instance.pk, instance.image.name))
+        if not jobs:
+            self.stdout.write('Nothing to do')
+            return
+
+        done = failed = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=images._init_worker,
+        ) as executor:
+            futures = [(job, executor.submit(images.render_variants, job[2])) for job in jobs]
+            for (label, pk, name), future in futures:
+                try:
+                    images.store_variants(label, pk, future.result())
+                    done += 1
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f'{label} {pk} ({name}): {error}')
+        self.stdout.write(f'{done} images processed, {failed} failed')
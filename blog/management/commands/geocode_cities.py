@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from blog import geo
+from blog.models import Announcement
+
+
+class Command(BaseCommand):
+    help = 'Fill missing announcement coordinates and geohashes from the bundled city table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        missing = Announcement.objects.filter(Q(latitude__isnull=True) | Q(longitude__isnull=True))
+        located, unknown = 0, []
+        # One UPDATE per distinct spelling of a city.
+        for city in missing.exclude(city__isnull=True).exclude(city='').values_list('city', flat=True).distinct():
+            point = geo.city_coordinates(city)
+            if point is None:
+                unknown.append(city)
+                continue
+            located += missing.filter(city=city).update(
+                latitude=point[0], longitude=point[1], geohash=geo.encode(*point),
+            )
+
+        # Coordinates written without save(), e.g. by a bulk import.
+        hashed = 0
+        stale = Announcement.objects.filter(geohash='', latitude__isnull=False, longitude__isnull=False)
+        while True:
+            batch = list(stale.only('id', 'latitude', 'longitude')[:options['batch_size']])
+            if not batch:
+                break
+            for announcement in batch:
+                announcement.geohash = geo.encode(announcement.latitude, announcement.longitude)
+            hashed += Announcement.objects.bulk_update(batch, ['geohash'])
+
+        self.stdout.write(f'{located} announcements located by city, {hashed} geohashes filled')
+        if unknown:
+            self.stdout.write(f'Unknown cities: {", ".join(sorted(unknown))}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from blog.search import SEARCH_FIELDS, get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for announcements.'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        for model in SEARCH_FIELDS:
+            count = backend.rebuild(model)
+            self.stdout.write(f'{model._meta.label}: {count} indexed')
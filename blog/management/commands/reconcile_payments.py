@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from blog import payments
+
+
+class Command(BaseCommand):
+    help = 'Ask YooKassa about pending payments the webhook has not resolved.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent gateway requests.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--min-age', type=int, default=None, help='Skip payments younger than this many seconds.')
+
+    def handle(self, *args, **options):
+        min_age = timedelta(seconds=options['min_age']) if options['min_age'] is not None else None
+        checked, changed, failed = payments.reconcile(
+            workers=options['workers'], batch_size=options['batch_size'], min_age=min_age,
+        )
+        self.stdout.write(f'{checked} payments checked, {changed} updated, {failed} failed')
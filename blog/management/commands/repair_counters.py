@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from blog import ratings
+
+
+class Command(BaseCommand):
+    help = 'Recount the denormalized comment, rating and favorite counters of announcements and sellers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows recounted per UPDATE.')
+
+    def handle(self, *args, **options):
+        announcements, profiles = ratings.repair(batch_size=options['batch_size'])
+        self.stdout.write(f'{announcements} announcements and {profiles} profiles recounted')
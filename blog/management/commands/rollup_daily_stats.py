@@ -0,0 +1,19 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from blog import analytics
+
+
+class Command(BaseCommand):
+    help = 'Update the daily statistics used by the admin analytics dashboard.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=date.fromisoformat,
+            help='Recompute from this date (YYYY-MM-DD) instead of continuing from the last run.',
+        )
+
+    def handle(self, *args, **options):
+        count = analytics.rollup(start=options['since'])
+        self.stdout.write(f'{count} days rolled up')
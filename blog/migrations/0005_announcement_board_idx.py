@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_alter_otherannouncement_options'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['-priority', '-created_at', '-id'], name='announcement_board_idx'),
+        ),
+    ]
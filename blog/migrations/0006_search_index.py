@@ -0,0 +1,63 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:50
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_TABLES = ['blog_announcement', 'blog_otherannouncement']
+
+
+def normalized(column):
+    return f"replace(replace(coalesce({column}, ''), 'ё', 'е'), 'Ё', 'Е')"
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(
+                f"UPDATE {table} SET search_vector = "
+                f"setweight(to_tsvector('russian', {normalized('title')}), 'A') || "
+                f"setweight(to_tsvector('russian', {normalized('description')}), 'B')"
+            )
+            schema_editor.execute(
+                f'CREATE INDEX {table}_search_gin ON {table} USING gin (search_vector)'
+            )
+        elif vendor == 'sqlite':
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {table}_fts USING fts5("
+                f"title, body, tokenize='unicode61 remove_diacritics 2')"
+            )
+            schema_editor.execute(
+                f"INSERT INTO {table}_fts (rowid, title, body) "
+                f"SELECT id, {normalized('title')}, {normalized('description')} FROM {table}"
+            )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for table in SEARCH_TABLES:
+        if vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS {table}_search_gin')
+        elif vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS {table}_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0005_announcement_board_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='otherannouncement',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
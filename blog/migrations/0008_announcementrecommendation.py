@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0007_category_subtree_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnnouncementRecommendation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField()),
+                ('computed_at', models.DateTimeField(auto_now=True)),
+                ('announcement', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommendations', to='blog.announcement')),
+                ('recommended', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recommended_for', to='blog.announcement')),
+            ],
+            options={
+                'verbose_name': 'Рекомендация',
+                'verbose_name_plural': 'Рекомендации',
+                'indexes': [models.Index(fields=['announcement', '-score'], name='recommendation_lookup_idx')],
+                'unique_together': {('announcement', 'recommended')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.6 on 2026-10-18 19:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0008_announcementrecommendation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('new_users', models.PositiveIntegerField(default=0)),
+                ('new_announcements', models.PositiveIntegerField(default=0)),
+                ('payments_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('paid_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Дневная статистика',
+                'verbose_name_plural': 'Дневная статистика',
+                'ordering': ['-date'],
+            },
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def set_last_activity(apps, schema_editor):
+    Chat = apps.get_model('blog', 'Chat')
+    ChatParticipant = apps.get_model('blog', 'ChatParticipant')
+    last_activity = (
+        Chat.objects.filter(pk=OuterRef('chat_id'))
+        .annotate(last=Coalesce(Max('messages__created_at'), 'created_at'))
+        .values('last')[:1]
+    )
+    ChatParticipant.objects.update(last_activity_at=Subquery(last_activity))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_image_variants'),
+        ('users', '0002_token_digest'),
+    ]
+
+    operations = [
+        # Chat.participants gets an explicit through model that keeps the
+        # existing blog_chat_participants table and its rows.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='ChatParticipant',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='blog.chat')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_memberships', to='users.user')),
+                    ],
+                    options={
+                        'verbose_name': 'Участник чата',
+                        'verbose_name_plural': 'Участники чата',
+                        'db_table': 'blog_chat_participants',
+                        'unique_together': {('chat', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='chat',
+                    name='participants',
+                    field=models.ManyToManyField(related_name='chats', through='blog.ChatParticipant', to='users.user'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='chatparticipant',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(set_last_activity, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatparticipant',
+            index=models.Index(fields=['user', '-last_activity_at', '-id'], name='chat_inbox_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_chat_inbox'),
+        ('users', '0002_token_digest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['chat', 'created_at', 'id'], name='message_history_idx'),
+        ),
+    ]
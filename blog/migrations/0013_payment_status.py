@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:08
+
+from django.db import migrations, models
+
+
+def mark_paid(apps, schema_editor):
+    Payment = apps.get_model('blog', 'Payment')
+    Payment.objects.filter(paid=True).update(status='succeeded')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_message_history_idx'),
+        ('users', '0002_token_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('waiting_for_capture', 'Waiting for capture'), ('succeeded', 'Succeeded'), ('canceled', 'Canceled')], default='pending', max_length=30),
+        ),
+        migrations.RunPython(mark_paid, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_id',
+            field=models.CharField(blank=True, db_index=True, max_length=100, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['paid', 'created_at'], name='payment_pending_idx'),
+        ),
+    ]
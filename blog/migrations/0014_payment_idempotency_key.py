@@ -0,0 +1,23 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0013_payment_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='confirmation_url',
+            field=models.URLField(blank=True, editable=False, max_length=500),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='idempotency_key',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
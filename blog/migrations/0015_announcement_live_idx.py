@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0014_payment_idempotency_key'),
+        ('users', '0002_token_digest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('status', 'published')), fields=['-priority', '-created_at', '-id'], name='announcement_live_board_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(condition=models.Q(('status', 'published')), fields=['expiration_date', 'id'], name='announcement_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0015_announcement_live_idx'),
+        ('users', '0002_token_digest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['status', '-priority', '-created_at', '-id'], name='announcement_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['category', '-priority', '-created_at', '-id'], name='announcement_category_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['plan', '-priority', '-created_at', '-id'], name='announcement_plan_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['condition', '-priority', '-created_at', '-id'], name='announcement_condition_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['created_at', 'id'], name='announcement_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['price', 'id'], name='announcement_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-created_at'], name='favorite_user_idx'),
+        ),
+    ]
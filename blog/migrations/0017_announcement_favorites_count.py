@@ -0,0 +1,31 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:29
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_favorites(apps, schema_editor):
+    Announcement = apps.get_model('blog', 'Announcement')
+    Favorite = apps.get_model('blog', 'Favorite')
+    counts = (
+        Favorite.objects.filter(announcement=OuterRef('pk')).order_by()
+        .values('announcement').annotate(count=Count('id')).values('count')
+    )
+    Announcement.objects.update(favorites_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0016_announcement_filter_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_favorites, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    Announcement = apps.get_model('blog', 'Announcement')
+    Comment = apps.get_model('blog', 'Comment')
+    comments = Comment.objects.filter(announcement=OuterRef('pk')).order_by().values('announcement')
+    count = Coalesce(Subquery(comments.annotate(value=Count('id')).values('value')), 0)
+    Announcement.objects.update(
+        rating_sum=Coalesce(Subquery(comments.annotate(value=Sum('rating')).values('value')), 0),
+        rating_count=count,
+        comments_count=count,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0017_announcement_favorites_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
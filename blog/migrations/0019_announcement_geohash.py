@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:50
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0018_comment_aggregates'),
+        ('users', '0003_profile_comment_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='announcement',
+            name='geohash',
+            field=models.CharField(blank=True, default='', editable=False, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-90), django.core.validators.MaxValueValidator(90)]),
+        ),
+        migrations.AddField(
+            model_name='announcement',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(-180), django.core.validators.MaxValueValidator(180)]),
+        ),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=models.Index(fields=['geohash'], name='announcement_geohash_idx'),
+        ),
+    ]
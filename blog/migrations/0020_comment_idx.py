@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0019_announcement_geohash'),
+        ('users', '0003_profile_comment_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['announcement', '-created_at'], name='comment_announcement_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['-created_at'], name='comment_created_idx'),
+        ),
+    ]
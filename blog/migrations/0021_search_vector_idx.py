@@ -0,0 +1,41 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:27
+
+import blog.models
+from django.db import migrations
+
+# 0006 created these with raw SQL, so the migration state never knew about
+# them; they are replaced by the SearchVectorIndex declared on the models.
+RAW_INDEXES = ['blog_announcement_search_gin', 'blog_otherannouncement_search_gin']
+
+
+def drop_raw_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name in RAW_INDEXES:
+            schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def create_raw_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for name in RAW_INDEXES:
+            table = name.removesuffix('_search_gin')
+            schema_editor.execute(f'CREATE INDEX {name} ON {table} USING gin (search_vector)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0020_comment_idx'),
+        ('users', '0003_profile_comment_aggregates'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_raw_indexes, create_raw_indexes),
+        migrations.AddIndex(
+            model_name='announcement',
+            index=blog.models.SearchVectorIndex(fields=['search_vector'], name='announcement_search_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otherannouncement',
+            index=blog.models.SearchVectorIndex(fields=['search_vector'], name='otherannouncement_search_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 21:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0021_search_vector_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='announcement',
+            name='announcement_live_board_idx',
+        ),
+        migrations.AlterField(
+            model_name='announcement',
+            name='category',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='announcements', to='blog.category'),
+        ),
+        migrations.AlterField(
+            model_name='announcement',
+            name='plan',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, to='blog.plan'),
+        ),
+    ]
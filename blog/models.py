@@ -1,8 +1,14 @@
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
-from users.models import User
+from users.models import User, rating_average
+from django.utils import timezone
 from django.utils.text import slugify
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from mptt.models import MPTTModel, TreeForeignKey
 
+from . import geo
+
 PLAN_CHOICES = [
     ('basic', 'Basic'),
     ('standard', 'Standard'),
@@ -21,8 +27,16 @@ STATUS_CHOICES = (
     ('archived', 'Archived')
 )
 
+PAYMENT_STATUS_CHOICES = (
+    ('pending', 'Pending'),
+    ('waiting_for_capture', 'Waiting for capture'),
+    ('succeeded', 'Succeeded'),
+    ('canceled', 'Canceled'),
+)
+
 class Banner(models.Model):
     image = models.ImageField(upload_to='banners/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     alt_text = models.CharField(max_length=255, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -49,9 +63,26 @@ class AnalyticsDummy(models.Model):
     def __str__(self):
         return "Analytics Data"
 
+class DailyStats(models.Model):
+    date = models.DateField(unique=True)
+    new_users = models.PositiveIntegerField(default=0)
+    new_announcements = models.PositiveIntegerField(default=0)
+    payments_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    paid_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Дневная статистика'
+        verbose_name_plural = 'Дневная статистика'
+        ordering = ['-date']
+
+    def __str__(self):
+        return str(self.date)
+
 class Category(MPTTModel):
     name = models.CharField(max_length=255)
     image = models.ImageField(upload_to='blog/category/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     parent = TreeForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
 
@@ -61,41 +92,129 @@ class Category(MPTTModel):
     class Meta:
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
+        indexes = [
+            models.Index(fields=['tree_id', 'lft', 'rght'], name='category_subtree_idx'),
+        ]
 
     def __str__(self):
         return self.name
 
+class SearchVectorIndex(GinIndex):
+    """
+    GIN index over search_vector. Only PostgreSQL searches that column (see
+    blog.search); other backends get a plain index so the DDL stays valid.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(self, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+class SearchVectorDeferredManager(models.Manager):
+    """search_vector is only used inside SQL (blog.search); rows never load it."""
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+class AnnouncementQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('user', 'category').prefetch_related('images')
+
+    def in_category(self, category):
+        # Nested set range: one join on (tree_id, lft, rght), no recursion.
+        return self.filter(
+            category__tree_id=category.tree_id,
+            category__lft__gte=category.lft,
+            category__rght__lte=category.rght,
+        )
+
+
 class Announcement(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='announcements')
-    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='announcements')
+    category = models.ForeignKey(
+        Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='announcements', db_index=False,
+    )
     title = models.CharField(max_length=255)
     slug = models.SlugField(max_length=255, unique=True, blank=True)
     description = models.TextField()
     condition = models.CharField(max_length=50, blank=True, null=True)
     location = models.CharField(max_length=255, blank=True, null=True)
     city = models.CharField(max_length=100, blank=True, null=True)
+    # Filled from the bundled city table when left empty (see blog.geo).
+    latitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-90), MaxValueValidator(90)])
+    longitude = models.FloatField(blank=True, null=True, validators=[MinValueValidator(-180), MaxValueValidator(180)])
+    geohash = models.CharField(max_length=12, blank=True, default='', editable=False)
     phone = models.CharField(max_length=20, blank=True, null=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
-    plan = models.ForeignKey(Plan, on_delete=models.SET_NULL, null=True, blank=True)
+    plan = models.ForeignKey(Plan, on_delete=models.SET_NULL, null=True, blank=True, db_index=False)
     priority = models.IntegerField(default=1)
     price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     is_negotiable = models.BooleanField(default=False)
     views_count = models.PositiveIntegerField(default=0)
+    # Kept in step by FavoriteListCreateView / FavoriteDeleteView.
+    favorites_count = models.PositiveIntegerField(default=0, editable=False)
+    # Comment aggregates, kept in step by the Comment signals.
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
     expiration_date = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchVectorDeferredManager.from_queryset(AnnouncementQuerySet)()
 
     class Meta:
         verbose_name = 'Объявление'
         verbose_name_plural = 'Объявления'
         ordering = ['-priority', '-created_at']
+        indexes = [
+            models.Index(fields=['-priority', '-created_at', '-id'], name='announcement_board_idx'),
+            # Live listings only: the expiration sweep. The board filtered on
+            # status='published' is served by announcement_status_idx below.
+            models.Index(
+                fields=['expiration_date', 'id'], name='announcement_expiry_idx',
+                condition=models.Q(status='published'),
+            ),
+            # The board filtered on one of filterset_fields, in board order. The
+            # category and plan ones also serve the foreign keys, which therefore
+            # have no index of their own.
+            models.Index(fields=['status', '-priority', '-created_at', '-id'], name='announcement_status_idx'),
+            models.Index(fields=['category', '-priority', '-created_at', '-id'], name='announcement_category_idx'),
+            models.Index(fields=['plan', '-priority', '-created_at', '-id'], name='announcement_plan_idx'),
+            models.Index(fields=['condition', '-priority', '-created_at', '-id'], name='announcement_condition_idx'),
+            # ?ordering=(-)created_at / (-)price; the paginator appends id.
+            models.Index(fields=['created_at', 'id'], name='announcement_created_idx'),
+            models.Index(fields=['price', 'id'], name='announcement_price_idx'),
+            models.Index(fields=['geohash'], name='announcement_geohash_idx'),
+            SearchVectorIndex(fields=['search_vector'], name='announcement_search_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.title)
         if self.plan:
             self.priority = PLAN_PRIORITY.get(self.plan.name, 1)
+        loaded = getattr(self, '_loaded_location', None)
+        if loaded and self.city != loaded[0] and (self.latitude, self.longitude) == loaded[1:]:
+            # The city was edited without new coordinates; the old ones belong to the old city.
+            self.latitude = self.longitude = None
+        if self.latitude is None or self.longitude is None:
+            self.latitude, self.longitude = geo.city_coordinates(self.city) or (None, None)
+        self.geohash = geo.encode(self.latitude, self.longitude) if self.latitude is not None else ''
         super().save(*args, **kwargs)
+        self._loaded_location = (self.city, self.latitude, self.longitude)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if {'city', 'latitude', 'longitude'} <= set(field_names):
+            instance._loaded_location = (instance.city, instance.latitude, instance.longitude)
+        return instance
+
+    @property
+    def rating(self):
+        return rating_average(self.rating_sum, self.rating_count)
 
     def get_position_label(self):
         if self.plan and self.plan.name == 'top':
@@ -107,9 +226,27 @@ class Announcement(models.Model):
     def __str__(self):
         return self.title
 
+class AnnouncementRecommendation(models.Model):
+    announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='recommended_for')
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        unique_together = ('announcement', 'recommended')
+        indexes = [
+            models.Index(fields=['announcement', '-score'], name='recommendation_lookup_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.announcement_id} -> {self.recommended_id} ({self.score:.3f})"
+
 class AnnouncementImage(models.Model):
     announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='announcements/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image of {self.announcement.title}"
@@ -120,6 +257,7 @@ class AnnouncementImage(models.Model):
 
 class GalleryImage(models.Model):
     image  = models.ImageField(upload_to='gallery/')
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -130,7 +268,10 @@ class Payment(models.Model):
     announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE)
     plan = models.ForeignKey(Plan, on_delete=models.SET_NULL, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    payment_id = models.CharField(max_length=100, null=True, blank=True)
+    payment_id = models.CharField(max_length=100, null=True, blank=True, db_index=True)
+    status = models.CharField(max_length=30, choices=PAYMENT_STATUS_CHOICES, default='pending')
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False)
+    confirmation_url = models.URLField(max_length=500, blank=True, editable=False)
     paid = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -140,6 +281,9 @@ class Payment(models.Model):
     class Meta:
         verbose_name = 'Платеж'
         verbose_name_plural = 'Платежи'
+        indexes = [
+            models.Index(fields=['paid', 'created_at'], name='payment_pending_idx'),
+        ]
 
 class Favorite(models.Model):
     user = models.ForeignKey('users.User', on_delete=models.CASCADE)
@@ -150,6 +294,9 @@ class Favorite(models.Model):
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
         unique_together = ('user', 'announcement')
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='favorite_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} favorite -> {self.announcement.title}"
@@ -161,12 +308,28 @@ class Comment(models.Model):
     rating = models.PositiveIntegerField(default=5)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # The post_save counters recount the announcement a comment was moved away from.
+        self._loaded_announcement_id = self.announcement_id
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'announcement_id' in field_names:
+            instance._loaded_announcement_id = instance.announcement_id
+        return instance
+
     def __str__(self):
         return f"Comment by {self.user.username} on {self.announcement.title}"
 
     class Meta:
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
+        indexes = [
+            models.Index(fields=['announcement', '-created_at'], name='comment_announcement_idx'),
+            models.Index(fields=['-created_at'], name='comment_created_idx'),
+        ]
 
 class News(models.Model):
     title = models.CharField(max_length=255)
@@ -183,7 +346,7 @@ class News(models.Model):
 
 class Chat(models.Model):
     announcement = models.ForeignKey(Announcement, on_delete=models.CASCADE, related_name='chats', null=True, blank=True)
-    participants = models.ManyToManyField(User, related_name='chats')
+    participants = models.ManyToManyField(User, related_name='chats', through='ChatParticipant')
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -195,6 +358,24 @@ class Chat(models.Model):
         verbose_name = 'Чат'
         verbose_name_plural = 'Чаты'
 
+class ChatParticipant(models.Model):
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_memberships')
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = 'blog_chat_participants'
+        unique_together = ('chat', 'user')
+        verbose_name = 'Участник чата'
+        verbose_name_plural = 'Участники чата'
+        indexes = [
+            models.Index(fields=['user', '-last_activity_at', '-id'], name='chat_inbox_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in chat {self.chat_id}"
+
 class Message(models.Model):
     chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -205,6 +386,9 @@ class Message(models.Model):
         ordering = ['created_at']
         verbose_name = 'Сообщение'
         verbose_name_plural = 'Сообщения'
+        indexes = [
+            models.Index(fields=['chat', 'created_at', 'id'], name='message_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.text[:20]}"
@@ -217,6 +401,9 @@ class OtherAnnouncement(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2,null=True, blank=True)
     phone = models.CharField(max_length=30)
     created_at = models.DateTimeField(auto_now_add=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = SearchVectorDeferredManager()
 
     def __str__(self):
         return self.title
@@ -224,4 +411,7 @@ class OtherAnnouncement(models.Model):
     class Meta:
         verbose_name = 'Другое объявление'
         verbose_name_plural = 'Другие объявления'
+        indexes = [
+            SearchVectorIndex(fields=['search_vector'], name='otherannouncement_search_idx'),
+        ]
 
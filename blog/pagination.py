@@ -0,0 +1,218 @@
+import base64
+import json
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset (seek) pagination over a composite ordering.
+
+    Unlike DRF's CursorPagination the cursor stores the full sort key of the
+    last row, so every page is a single indexed range scan no matter how deep
+    the client has scrolled. The primary key is always appended as the final
+    tiebreaker, which keeps the order total and stable.
+    """
+    ordering = ('-id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.model = queryset.model
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            queryset = queryset.filter(self.build_keyset_filter(cursor))
+
+        rows = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        # Honour an ordering applied by OrderingFilter, otherwise fall back to
+        # the paginator default.
+        ordering = [
+            field for field in (queryset.query.order_by or self.ordering)
+            if isinstance(field, str)
+        ] or list(self.ordering)
+        names = [field.lstrip('-') for field in ordering]
+        if 'id' not in names and 'pk' not in names:
+            ordering.append('-id' if ordering[-1].startswith('-') else 'id')
+        return tuple('id' if f == 'pk' else '-id' if f == '-pk' else f for f in ordering)
+
+    def build_keyset_filter(self, values, ordering=None):
+        """
+        Expand (a, b, c) > (x, y, z) into the OR-of-ANDs form every backend
+        can serve from a composite index. The redundant ``a >= x`` in front
+        gives the planner a range to seek to on the leading column; without
+        it the OR is often read as a filter over the whole index.
+        """
+        ordering = ordering or self.ordering
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        if len(values) > 1:
+            first = ordering[0]
+            bound = 'lte' if first.startswith('-') else 'gte'
+            condition = Q(**{f'{first.lstrip("-")}__{bound}': values[0]}) & condition
+        return condition
+
+    def encode_cursor(self, instance):
+        if isinstance(instance, dict):
+            # A .values() row (see blog.fast_serializers).
+            instance = SimpleNamespace(**instance)
+        values = []
+        for field in self.ordering:
+            model_field = self.model._meta.get_field(field.lstrip('-'))
+            values.append(model_field.value_to_string(instance))
+        payload = json.dumps({'o': self.ordering, 'v': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, request, param=None):
+        encoded = request.query_params.get(param or self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if tuple(payload['o']) != self.ordering or len(payload['v']) != len(self.ordering):
+                raise ValueError
+            return [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, payload['v'])
+            ]
+        except (TypeError, KeyError, ValueError, ValidationError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AnnouncementPagination(KeysetPagination):
+    ordering = ('-priority', '-created_at', '-id')
+
+
+class InboxPagination(KeysetPagination):
+    ordering = ('-last_activity_at', '-id')
+
+
+class MessageHistoryPagination(KeysetPagination):
+    """
+    Chat history in chronological order, read in both directions.
+
+    Without a cursor the newest page is returned. ``before`` pages back into
+    older messages; ``after`` returns only messages newer than the cursor,
+    which is how clients fetch deltas.
+    """
+    ordering = ('created_at', 'id')
+    before_query_param = 'before'
+    after_query_param = 'after'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+        reverse = tuple(f'-{field}' for field in self.ordering)
+
+        after = self.decode_cursor(request, self.after_query_param)
+        before = self.decode_cursor(request, self.before_query_param)
+        if after is not None:
+            rows = list(
+                queryset.filter(self.build_keyset_filter(after))
+                .order_by(*self.ordering)[:self.page_size + 1]
+            )
+            self.page = rows[:self.page_size]
+            self.has_older = True
+            self.has_newer = len(rows) > self.page_size
+        else:
+            if before is not None:
+                queryset = queryset.filter(self.build_keyset_filter(before, reverse))
+            rows = list(queryset.order_by(*reverse)[:self.page_size + 1])
+            self.page = rows[:self.page_size][::-1]
+            self.has_older = len(rows) > self.page_size
+            self.has_newer = before is not None
+        return self.page
+
+    def link(self, param, instance):
+        url = self.request.build_absolute_uri()
+        for name in (self.before_query_param, self.after_query_param):
+            url = remove_query_param(url, name)
+        return replace_query_param(url, param, self.encode_cursor(instance))
+
+    def get_older_link(self):
+        if not self.page or not self.has_older:
+            return None
+        return self.link(self.before_query_param, self.page[0])
+
+    def get_newer_link(self):
+        # Always offered when there is a page, so clients can poll for deltas.
+        if not self.page:
+            if self.request.query_params.get(self.after_query_param):
+                return self.request.build_absolute_uri()
+            return None
+        return self.link(self.after_query_param, self.page[-1])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('older', self.get_older_link()),
+            ('newer', self.get_newer_link()),
+            ('has_newer', self.has_newer),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'older': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'newer': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'has_newer': {'type': 'boolean'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,305 @@
+"""
+YooKassa payment state.
+
+The gateway tells us about status changes through the webhook; apply_status()
+records them. It is idempotent: the plan is applied by whichever caller flips
+``paid`` first, so webhook retries, the reconcile job and a duplicate
+notification can all race safely. reconcile() polls the gateway only for
+pending payments the webhook has not resolved, a bounded number at a time.
+
+start_payment() creates payments at the gateway through call_gateway(): a
+small thread pool, a strict timeout and a circuit breaker, so a slow gateway
+costs a request worker at most PAYMENT_GATEWAY_TIMEOUT seconds and an
+unavailable one costs nothing. Each payment keeps the idempotence key it was
+created with, so a retried request reuses it instead of charging again.
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Payment
+
+logger = logging.getLogger(__name__)
+
+FINAL_STATUSES = ('succeeded', 'canceled')
+
+
+class GatewayUnavailable(Exception):
+    pass
+
+
+class IdempotencyKeyReused(Exception):
+    pass
+
+
+class YooKassaGateway:
+    def __init__(self, **options):
+        from yookassa import Configuration
+        Configuration.configure(settings.YOOKASSA_SHOP_ID, settings.YOOKASSA_SECRET_KEY, **options)
+
+    def create(self, payload, idempotence_key):
+        """Create a payment; returns {"id", "status", "confirmation_url"}."""
+        from yookassa import Payment as YooPayment
+        payment = YooPayment.create(payload, idempotence_key)
+        return {
+            'id': payment.id,
+            'status': payment.status,
+            'confirmation_url': payment.confirmation.confirmation_url,
+        }
+
+    def find(self, payment_id):
+        """Current gateway status of ``payment_id``."""
+        from yookassa import Payment as YooPayment
+        return YooPayment.find_one(payment_id).status
+
+
+def get_gateway():
+    backend = import_string(getattr(settings, 'PAYMENT_GATEWAY', 'blog.payments.YooKassaGateway'))
+    return backend(**getattr(settings, 'PAYMENT_GATEWAY_OPTIONS', {}))
+
+
+class CircuitBreaker:
+    """
+    Opens after ``threshold`` consecutive failures and rejects calls for
+    ``reset_timeout`` seconds; then one trial call decides whether it closes.
+    The state is per process.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    @property
+    def threshold(self):
+        return getattr(settings, 'PAYMENT_BREAKER_THRESHOLD', 5)
+
+    @property
+    def reset_timeout(self):
+        return getattr(settings, 'PAYMENT_BREAKER_RESET_TIMEOUT', 30)
+
+    def reset(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.trial = True
+                return True
+            return False
+
+    def success(self):
+        self.reset()
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+breaker = CircuitBreaker()
+
+_executor = None
+_slots = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _slots
+    with _executor_lock:
+        if _executor is None:
+            workers = getattr(settings, 'PAYMENT_GATEWAY_WORKERS', 8)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payment-gateway')
+            _slots = threading.BoundedSemaphore(workers)
+        return _executor, _slots
+
+
+def call_gateway(method, *args, gateway=None):
+    """
+    Run ``gateway.<method>(*args)`` on the gateway pool and wait at most
+    PAYMENT_GATEWAY_TIMEOUT seconds. Raises GatewayUnavailable when the breaker
+    is open, every pool thread is still busy, or the call fails or times out.
+    """
+    executor, slots = get_executor()
+    # Don't queue behind calls that are already stuck.
+    if not slots.acquire(blocking=False):
+        raise GatewayUnavailable('too many gateway calls in progress')
+    if not breaker.allow():
+        slots.release()
+        raise GatewayUnavailable('circuit open')
+    future = executor.submit(getattr(gateway or get_gateway(), method), *args)
+    future.add_done_callback(lambda future: slots.release())
+    try:
+        result = future.result(timeout=getattr(settings, 'PAYMENT_GATEWAY_TIMEOUT', 5))
+    except Exception as error:
+        breaker.failure()
+        raise GatewayUnavailable(str(error) or type(error).__name__) from error
+    breaker.success()
+    return result
+
+
+def payment_payload(user, announcement, plan):
+    return {
+        "amount": {
+            "value": str(plan.amount),
+            "currency": "RUB"
+        },
+        "confirmation": {
+            "type": "redirect",
+            "return_url": getattr(settings, 'PAYMENT_RETURN_URL', "https://your-site.com/payment/success/")
+        },
+        "capture": True,
+        "description": f"Оплата за объявление '{announcement.title}' по тарифу {plan.name}",
+        "receipt": {
+            "customer": {
+                "email": user.email
+            },
+            "items": [
+                {
+                    "description": f"Оплата за тариф {plan.name}",
+                    "quantity": "1",
+                    "amount": {
+                        "value": str(plan.amount),
+                        "currency": "RUB"
+                    },
+                    "vat_code": 1,
+                    "payment_mode": "full_payment",
+                    "payment_subject": "service"
+                }
+            ]
+        }
+    }
+
+
+def _reusable(user, announcement, plan):
+    window = timedelta(seconds=getattr(settings, 'PAYMENT_REUSE_WINDOW', 3600))
+    return (
+        Payment.objects.filter(
+            user=user, announcement=announcement, plan=plan, paid=False, status='pending',
+            created_at__gte=timezone.now() - window,
+        )
+        .order_by('-created_at')
+        .first()
+    )
+
+
+def start_payment(user, announcement, plan, key=None):
+    """
+    Pending gateway payment for ``announcement`` and ``plan``. A client
+    ``key`` (the Idempotency-Key header) or, without one, a recent pending
+    payment for the same announcement and plan is reused; the gateway is only
+    called while the payment has no gateway id, always with the stored key.
+    """
+    if key:
+        idempotency_key = hashlib.sha256(f'{user.pk}:{key}'.encode()).hexdigest()
+        payment, _ = Payment.objects.get_or_create(
+            idempotency_key=idempotency_key,
+            defaults={'user': user, 'announcement': announcement, 'plan': plan, 'amount': plan.amount},
+        )
+        if (payment.announcement_id, payment.plan_id) != (announcement.pk, plan.pk):
+            raise IdempotencyKeyReused(key)
+    else:
+        payment = _reusable(user, announcement, plan) or Payment.objects.create(
+            user=user, announcement=announcement, plan=plan, amount=plan.amount,
+            idempotency_key=uuid.uuid4().hex,
+        )
+    if payment.payment_id:
+        return payment
+
+    result = call_gateway('create', payment_payload(user, announcement, plan), payment.idempotency_key)
+    payment.payment_id = result['id']
+    payment.status = result['status']
+    payment.confirmation_url = result['confirmation_url'] or ''
+    Payment.objects.filter(pk=payment.pk).update(
+        payment_id=payment.payment_id, status=payment.status, confirmation_url=payment.confirmation_url,
+    )
+    return payment
+
+
+def apply_plan(payment):
+    announcement = payment.announcement
+    announcement.plan = payment.plan
+    announcement.priority = payment.plan.priority
+    announcement.save(update_fields=['plan', 'priority', 'updated_at'])
+
+
+def apply_status(payment_id, status):
+    """
+    Record the gateway ``status`` of a payment. Returns the payment, or None if
+    we don't know it. A final status is never overwritten.
+    """
+    with transaction.atomic():
+        payment = Payment.objects.select_related('announcement', 'plan').filter(payment_id=payment_id).first()
+        if payment is None:
+            return None
+        if status == 'succeeded':
+            # The conditional UPDATE is the idempotency guard: only one caller
+            # sees a row change and goes on to apply the plan.
+            updated = (
+                Payment.objects.filter(pk=payment.pk, paid=False).exclude(status__in=FINAL_STATUSES)
+                .update(paid=True, status=status)
+            )
+            if updated:
+                payment.paid, payment.status = True, status
+                if payment.plan is not None:
+                    apply_plan(payment)
+        elif Payment.objects.filter(pk=payment.pk).exclude(status__in=FINAL_STATUSES).update(status=status):
+            payment.status = status
+    return payment
+
+
+def pending(min_age=None, max_age=None):
+    """Unresolved gateway payments created between ``max_age`` and ``min_age`` ago."""
+    now = timezone.now()
+    min_age = timedelta(seconds=getattr(settings, 'PAYMENT_RECONCILE_MIN_AGE', 300)) if min_age is None else min_age
+    max_age = timedelta(days=getattr(settings, 'PAYMENT_RECONCILE_MAX_AGE_DAYS', 7)) if max_age is None else max_age
+    return (
+        Payment.objects.filter(paid=False, created_at__lte=now - min_age, created_at__gte=now - max_age)
+        .exclude(status__in=FINAL_STATUSES)
+        .exclude(payment_id__isnull=True)
+        .exclude(payment_id='')
+    )
+
+
+def _find(gateway, payment_id):
+    try:
+        return payment_id, gateway.find(payment_id), None
+    except Exception as error:
+        return payment_id, None, error
+
+
+def reconcile(workers=4, batch_size=100, min_age=None, max_age=None, gateway=None):
+    """
+    Ask the gateway about pending payments, at most ``workers`` requests at a
+    time. Returns (checked, changed, failed).
+    """
+    gateway = gateway or get_gateway()
+    payment_ids = list(pending(min_age, max_age).order_by('created_at').values_list('payment_id', 'status'))
+    checked = changed = failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(payment_ids), batch_size):
+            batch = dict(payment_ids[start:start + batch_size])
+            # Gateway calls run in the pool; database writes stay on this thread.
+            for payment_id, status, error in executor.map(lambda payment_id: _find(gateway, payment_id), batch):
+                checked += 1
+                if error is not None:
+                    failed += 1
+                    logger.warning('Could not check payment %s: %s', payment_id, error)
+                elif status != batch[payment_id]:
+                    apply_status(payment_id, status)
+                    changed += 1
+    return checked, changed, failed
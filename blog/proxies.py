@@ -0,0 +1,34 @@
+"""
+The client address of a request behind our reverse proxies.
+
+X-Forwarded-For is client-supplied, so only the hops appended by proxies we
+run can be believed: the address is read from the right, skipping
+TRUSTED_PROXIES, and the first address that isn't one of them is the client.
+With no trusted proxies configured this is simply REMOTE_ADDR.
+"""
+import ipaddress
+
+from django.conf import settings
+
+
+def trusted_networks():
+    return [ipaddress.ip_network(value, strict=False) for value in getattr(settings, 'TRUSTED_PROXIES', ())]
+
+
+def _is_trusted(address, networks):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in networks)
+
+
+def client_ip(request):
+    address = request.META.get('REMOTE_ADDR', '')
+    networks = trusted_networks()
+    if not networks:
+        return address
+    forwarded = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+    while forwarded and _is_trusted(address, networks):
+        address = forwarded.pop()
+    return address
@@ -0,0 +1,162 @@
+"""
+Publish/subscribe fan-out for real-time events.
+
+publish() is synchronous and safe to call from any thread (views, signals).
+subscribe() is used by async consumers and returns a Subscription whose
+get() waits for the next message. The backend is chosen with the
+PUBSUB_BACKEND setting:
+
+* InProcessBroker (default) delivers within one process. It is enough for
+  development, tests and a single ASGI worker.
+* RedisBroker delivers across workers through Redis PUBLISH. Each process
+  keeps one pattern subscription and hands messages to its local
+  subscribers, so idle connections never hold a Redis connection each.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+QUEUE_SIZE = 100
+
+
+class Subscription:
+    def __init__(self, broker, channel):
+        self.broker = broker
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    def offer(self, message):
+        # Called on the subscriber's loop. A client that stops reading loses
+        # its oldest messages rather than growing the queue without bound.
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(message)
+
+    async def get(self, timeout=None):
+        """Next message, or None if nothing arrived within ``timeout`` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class InProcessBroker:
+    def __init__(self, **options):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    async def subscribe(self, channel):
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.channel)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.channel]
+
+    def deliver(self, channel, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(channel, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.offer, message)
+            except RuntimeError:
+                # The subscriber's loop is closed; it is going away anyway.
+                self.unsubscribe(subscription)
+
+    def publish(self, channel, message):
+        self.deliver(channel, message)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Cross-worker fan-out over Redis. ``client`` and ``async_client`` can be
+    passed in (e.g. a local stand-in in tests); otherwise they are created
+    from ``url`` with the optional ``redis`` package.
+    """
+    def __init__(self, url='redis://localhost:6379/0', prefix='events:', client=None, async_client=None, **options):
+        super().__init__(**options)
+        self.url = url
+        self.prefix = prefix
+        self._client = client
+        self._async_client = async_client
+        self._listener = None
+
+    def _redis(self):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured("RedisBroker requires the 'redis' package.")
+        return redis, redis.asyncio
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self._redis()[0].Redis.from_url(self.url)
+        return self._client
+
+    @property
+    def async_client(self):
+        if self._async_client is None:
+            self._async_client = self._redis()[1].Redis.from_url(self.url)
+        return self._async_client
+
+    def publish(self, channel, message):
+        self.client.publish(self.prefix + channel, json.dumps(message))
+
+    async def subscribe(self, channel):
+        loop = asyncio.get_running_loop()
+        if self._listener is None or self._listener.done() or self._listener.get_loop() is not loop:
+            pubsub = self.async_client.pubsub()
+            await pubsub.psubscribe(self.prefix + '*')
+            self._listener = loop.create_task(self._listen(pubsub))
+        return await super().subscribe(channel)
+
+    async def _listen(self, pubsub):
+        try:
+            while True:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if message is None:
+                    continue
+                channel = message['channel']
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                self.deliver(channel[len(self.prefix):], json.loads(message['data']))
+        finally:
+            await pubsub.aclose()
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            backend = import_string(getattr(settings, 'PUBSUB_BACKEND', 'blog.pubsub.InProcessBroker'))
+            _broker = backend(**getattr(settings, 'PUBSUB_OPTIONS', {}))
+        return _broker
+
+
+def user_channel(user_id):
+    return f'user:{user_id}'
@@ -0,0 +1,84 @@
+"""
+Denormalized comment aggregates.
+
+Announcement.rating_sum / rating_count / comments_count and the same columns
+on the seller's UserProfile follow comment inserts and deletes through F()
+updates sent from the Comment signals, inside the transaction that writes
+the comment. An edited comment has its announcement and seller recounted.
+repair() recounts everything, favorites_count included, one batch of rows
+per UPDATE.
+"""
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from users.models import User, UserProfile
+from .models import Announcement, Comment, Favorite
+
+
+def _deltas(rating, sign):
+    return {
+        'rating_sum': F('rating_sum') + sign * rating,
+        'rating_count': F('rating_count') + sign,
+        'comments_count': F('comments_count') + sign,
+    }
+
+
+def comment_added(comment):
+    seller_id = comment.announcement.user_id
+    Announcement.objects.filter(pk=comment.announcement_id).update(**_deltas(comment.rating, 1))
+    UserProfile.objects.get_or_create(user_id=seller_id)
+    UserProfile.objects.filter(user_id=seller_id).update(**_deltas(comment.rating, 1))
+
+
+def comment_removed(comment):
+    Announcement.objects.filter(pk=comment.announcement_id).update(**_deltas(comment.rating, -1))
+    UserProfile.objects.filter(user__announcements=comment.announcement_id).update(**_deltas(comment.rating, -1))
+
+
+def _total(queryset, aggregate):
+    return Coalesce(Subquery(queryset.annotate(value=aggregate).values('value')), 0)
+
+
+def _recounted(key, outer):
+    comments = Comment.objects.filter(**{key: OuterRef(outer)}).order_by().values(key)
+    return {
+        'rating_sum': _total(comments, Sum('rating')),
+        'rating_count': _total(comments, Count('id')),
+        'comments_count': _total(comments, Count('id')),
+    }
+
+
+def recount_announcements(ids):
+    favorites = Favorite.objects.filter(announcement=OuterRef('pk')).order_by().values('announcement')
+    return Announcement.objects.filter(pk__in=ids).update(
+        favorites_count=_total(favorites, Count('id')), **_recounted('announcement', 'pk'),
+    )
+
+
+def recount_sellers(user_ids):
+    sellers = Announcement.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True).distinct()
+    UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in sellers], ignore_conflicts=True)
+    return UserProfile.objects.filter(user_id__in=user_ids).update(**_recounted('announcement__user', 'user_id'))
+
+
+def _batches(queryset, batch_size):
+    last = 0
+    while True:
+        ids = list(queryset.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return
+        yield ids
+        last = ids[-1]
+
+
+def repair(batch_size=1000):
+    """Recount every announcement and seller. Returns (announcements, profiles)."""
+    announcements = profiles = 0
+    for ids in _batches(Announcement.objects.all(), batch_size):
+        with transaction.atomic():
+            announcements += recount_announcements(ids)
+    for ids in _batches(User.objects.all(), batch_size):
+        with transaction.atomic():
+            profiles += recount_sellers(ids)
+    return announcements, profiles
@@ -0,0 +1,173 @@
+"""
+Offline "similar listings" index.
+
+Announcements are embedded as sparse TF-IDF vectors over title and description.
+Similarity is computed with an inverted index (a sparse matrix product), so only
+documents that share at least one term are ever compared. A term found in more
+than MAX_POSTINGS documents ("продам", "состояние") would still make that every
+pair, so it is left out of the index: it keeps its (low) weight in the vector
+norms but doesn't make documents candidates for each other. Candidates are
+restricted to the listing's category subtree and price band, and the top K per
+listing are stored in AnnouncementRecommendation.
+"""
+import heapq
+import math
+import re
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from .models import Announcement, AnnouncementRecommendation, Category
+
+TOP_K = 10
+NEIGHBOUR_FACTOR = 5
+PRICE_BAND = 3
+MAX_POSTINGS = 2000
+TITLE_WEIGHT = 2
+# Crude stemming: Russian inflection lives in the word ending, so comparing
+# the first few letters groups "велосипед", "велосипеда", "велосипеды".
+STEM_LENGTH = 6
+MIN_TOKEN_LENGTH = 3
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    text = (text or '').lower().replace('ё', 'е')
+    return [
+        token[:STEM_LENGTH] for token in TOKEN_RE.findall(text)
+        if len(token) >= MIN_TOKEN_LENGTH and not token.isdigit()
+    ]
+
+
+def term_counts(title, description):
+    counts = Counter(tokenize(description))
+    for token in tokenize(title):
+        counts[token] += TITLE_WEIGHT
+    return counts
+
+
+def in_price_band(a, b):
+    if not a or not b:
+        return True
+    return max(a, b) <= min(a, b) * PRICE_BAND
+
+
+class Corpus:
+    def __init__(self, rows, categories):
+        self.rows = {row['id']: row for row in rows}
+        self.categories = categories
+        counts = {pk: term_counts(row['title'], row['description']) for pk, row in self.rows.items()}
+        df = Counter(term for terms in counts.values() for term in terms)
+        total = len(counts)
+        idf = {term: math.log((1 + total) / (1 + freq)) + 1 for term, freq in df.items()}
+
+        self.vectors = {}
+        self.postings = defaultdict(list)
+        for pk, terms in counts.items():
+            vector = {term: (1 + math.log(count)) * idf[term] for term, count in terms.items()}
+            norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+            vector = {term: weight / norm for term, weight in vector.items()}
+            self.vectors[pk] = vector
+            for term, weight in vector.items():
+                if df[term] <= MAX_POSTINGS:
+                    self.postings[term].append((pk, weight))
+
+    def scope(self, pk):
+        """Category range a recommendation for ``pk`` must fall into: the parent's subtree."""
+        category = self.categories.get(self.rows[pk]['category_id'])
+        if category is None:
+            return None
+        parent = self.categories.get(category['parent_id'], category)
+        return parent['tree_id'], parent['lft'], parent['rght']
+
+    def in_scope(self, scope, pk):
+        category = self.categories.get(self.rows[pk]['category_id'])
+        if scope is None or category is None:
+            return scope is None and category is None
+        tree_id, lft, rght = scope
+        return category['tree_id'] == tree_id and lft <= category['lft'] and category['rght'] <= rght
+
+    def similar(self, pk, k=TOP_K):
+        scores = defaultdict(float)
+        for term, weight in self.vectors[pk].items():
+            for other, other_weight in self.postings.get(term, ()):
+                scores[other] += weight * other_weight
+        scores.pop(pk, None)
+        scope = self.scope(pk)
+        price = self.rows[pk]['price']
+        candidates = (
+            (score, other) for other, score in scores.items()
+            if self.in_scope(scope, other) and in_price_band(price, self.rows[other]['price'])
+        )
+        return [(other, score) for score, other in heapq.nlargest(k, candidates)]
+
+
+def load_corpus(tree_id):
+    """Published listings of one category tree (None: uncategorized ones)."""
+    if tree_id is None:
+        categories = {}
+        announcements = Announcement.objects.filter(category__isnull=True)
+    else:
+        categories = {
+            row['id']: row
+            for row in Category.objects.filter(tree_id=tree_id).values('id', 'parent_id', 'tree_id', 'lft', 'rght')
+        }
+        announcements = Announcement.objects.filter(category__tree_id=tree_id)
+    rows = announcements.filter(status='published').values(
+        'id', 'title', 'description', 'price', 'category_id'
+    ).iterator(chunk_size=2000)
+    return Corpus(rows, categories)
+
+
+def _store(recommendations):
+    """Replace the stored lists for the given announcements."""
+    AnnouncementRecommendation.objects.filter(announcement_id__in=list(recommendations)).delete()
+    AnnouncementRecommendation.objects.bulk_create([
+        AnnouncementRecommendation(announcement_id=pk, recommended_id=other, score=score)
+        for pk, similar in recommendations.items()
+        for other, score in similar
+    ], batch_size=1000)
+
+
+def _tree_ids(queryset):
+    return set(queryset.values_list('category__tree_id', flat=True).distinct())
+
+
+def rebuild():
+    count = 0
+    with transaction.atomic():
+        AnnouncementRecommendation.objects.all().delete()
+        for tree_id in _tree_ids(Announcement.objects.filter(status='published')):
+            corpus = load_corpus(tree_id)
+            _store({pk: corpus.similar(pk) for pk in corpus.rows})
+            count += len(corpus.rows)
+    return count
+
+
+def update(announcement_ids):
+    """
+    Refresh the lists of new, edited or withdrawn listings and of the listings
+    whose lists they may enter or leave, leaving everything else untouched.
+    """
+    announcement_ids = set(announcement_ids)
+    pointing = set(
+        AnnouncementRecommendation.objects.filter(recommended_id__in=announcement_ids)
+        .values_list('announcement_id', flat=True)
+    )
+    targets = announcement_ids | pointing
+    # Listings that are gone or no longer published end up with an empty list.
+    recommendations = {pk: [] for pk in targets}
+    for tree_id in _tree_ids(Announcement.objects.filter(pk__in=targets)):
+        corpus = load_corpus(tree_id)
+        refresh = pointing & corpus.rows.keys()
+        for pk in announcement_ids & corpus.rows.keys():
+            refresh.add(pk)
+            # Similarity is symmetric, so the listing's nearest documents are
+            # the ones whose top K it may now enter.
+            refresh.update(other for other, _ in corpus.similar(pk, k=TOP_K * NEIGHBOUR_FACTOR))
+        for pk in refresh:
+            recommendations[pk] = corpus.similar(pk)
+    with transaction.atomic():
+        _store(recommendations)
+    return len(recommendations)
@@ -0,0 +1,116 @@
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce, Replace
+
+from .models import Announcement, OtherAnnouncement
+
+SEARCH_CONFIG = 'russian'
+
+# Model -> (title field, body field). Title matches weigh more than body ones.
+SEARCH_FIELDS = {
+    Announcement: ('title', 'description'),
+    OtherAnnouncement: ('title', 'description'),
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    return (text or '').replace('ё', 'е').replace('Ё', 'Е')
+
+
+def normalized(field):
+    return Replace(Replace(Coalesce(F(field), Value('')), Value('ё'), Value('е')), Value('Ё'), Value('Е'))
+
+
+class PostgresSearchBackend:
+    """tsvector column on each model, GIN-indexed, ranked with ts_rank."""
+
+    def vector(self, model):
+        title, body = SEARCH_FIELDS[model]
+        return (
+            SearchVector(normalized(title), weight='A', config=SEARCH_CONFIG)
+            + SearchVector(normalized(body), weight='B', config=SEARCH_CONFIG)
+        )
+
+    def index(self, instance):
+        model = type(instance)
+        model.objects.filter(pk=instance.pk).update(search_vector=self.vector(model))
+
+    def remove(self, instance):
+        # The vector lives on the row itself and goes away with it.
+        pass
+
+    def rebuild(self, model):
+        return model.objects.update(search_vector=self.vector(model))
+
+    def search(self, queryset, query, offset, limit):
+        search_query = SearchQuery(normalize(query), config=SEARCH_CONFIG, search_type='websearch')
+        return list(
+            queryset.filter(search_vector=search_query)
+            .annotate(rank=SearchRank(F('search_vector'), search_query))
+            .order_by('-rank', '-id')[offset:offset + limit]
+        )
+
+
+class SqliteSearchBackend:
+    """
+    FTS5 fallback for local development. One virtual table per model keyed by
+    rowid = pk, ranked with bm25(). FTS5 has no Russian stemmer, so every query
+    term is matched as a prefix instead.
+    """
+    title_weight = 10.0
+    body_weight = 1.0
+
+    def table(self, model):
+        return f'{model._meta.db_table}_fts'
+
+    def index(self, instance):
+        model = type(instance)
+        title, body = SEARCH_FIELDS[model]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {self.table(model)} (rowid, title, body) VALUES (%s, %s, %s)',
+                [instance.pk, normalize(getattr(instance, title)), normalize(getattr(instance, body))],
+            )
+
+    def remove(self, instance):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table(type(instance))} WHERE rowid = %s', [instance.pk])
+
+    def rebuild(self, model):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table(model)}')
+        count = 0
+        for instance in model.objects.only('pk', *SEARCH_FIELDS[model]).iterator(chunk_size=1000):
+            self.index(instance)
+            count += 1
+        return count
+
+    def match_expression(self, query):
+        tokens = TOKEN_RE.findall(normalize(query))
+        return ' '.join(f'"{token}"*' for token in tokens)
+
+    def search(self, queryset, query, offset, limit):
+        expression = self.match_expression(query)
+        if not expression:
+            return []
+        table = self.table(queryset.model)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+                f'ORDER BY bm25({table}, %s, %s), rowid DESC LIMIT %s OFFSET %s',
+                [expression, self.title_weight, self.body_weight, limit, offset],
+            )
+            page_ids = [row[0] for row in cursor.fetchall()]
+        objects = queryset.in_bulk(page_ids)
+        return [objects[pk] for pk in page_ids if pk in objects]
+
+
+def get_backend():
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return SqliteSearchBackend()
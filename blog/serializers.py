@@ -1,10 +1,32 @@
+from django.core.files.storage import default_storage
 from rest_framework import serializers
-from .models import Category, Announcement, AnnouncementImage, Payment, Favorite, Comment, News, Message, Chat, Banner,Plan,GalleryImage,OtherAnnouncement
+from .favorites import favorite_ids
+from .models import Category, Announcement, AnnouncementImage, Payment, Favorite, Comment, News, Message, Chat, ChatParticipant, Banner,Plan,GalleryImage,OtherAnnouncement
+
+def image_variant_urls(variants, request=None):
+    """{"webp": {"320": url, ...}, "jpeg": {...}} for the stored derivative names."""
+    urls = {}
+    for key, names in (variants or {}).items():
+        if key == 'source':
+            continue
+        urls[key] = {}
+        for width, name in names.items():
+            url = default_storage.url(name)
+            urls[key][width] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+class ImageVariantsField(serializers.ReadOnlyField):
+    def to_representation(self, value):
+        return image_variant_urls(value, self.context.get('request'))
+
 
 class BannerSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Banner
-        fields = ['id', 'image', 'alt_text']
+        fields = ['id', 'image', 'image_variants', 'alt_text']
 
 class PlanSerializer(serializers.ModelSerializer):
     class Meta:
@@ -12,43 +34,54 @@ class PlanSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'amount', 'priority']
 
 class CategorySerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Category
-        fields = ['id', 'name', 'image']
+        fields = ['id', 'name', 'image', 'image_variants']
 
 class CategoryTreeSerializer(serializers.ModelSerializer):
     children = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
-        fields = ['id', 'name', 'parent', 'children']
+        fields = ['id', 'name', 'image', 'parent', 'children']
 
     def get_children(self, obj):
-        return CategoryTreeSerializer(obj.children.all(), many=True).data
+        # get_children() reuses the nodes attached by get_cached_trees(), so a
+        # tree loaded in one query is serialized without further queries.
+        return CategoryTreeSerializer(obj.get_children(), many=True, context=self.context).data
 
 class GalleryImageSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = GalleryImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_variants']
 
 class AnnouncementImageSerializer(serializers.ModelSerializer):
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = AnnouncementImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'image_variants']
 
 class AnnouncementSerializer(serializers.ModelSerializer):
     images = AnnouncementImageSerializer(many=True, read_only=True)
     user = serializers.ReadOnlyField(source='user.username')
     category = serializers.SerializerMethodField()
+    is_favorited = serializers.SerializerMethodField()
+    rating = serializers.ReadOnlyField()
 
     class Meta:
         model = Announcement
         fields = [
             'id', 'title', 'description', 'category',
-            'condition', 'location', 'status',
-            'plan', 'price', 'priority',
+            'condition', 'location', 'latitude', 'longitude', 'status',
+            'plan', 'price', 'priority', 'views_count', 'favorites_count',
+            'rating', 'comments_count',
             'created_at', 'updated_at',
-            'images', 'user'
+            'images', 'user', 'is_favorited'
         ]
 
     def get_category(self, obj):
@@ -56,10 +89,14 @@ class AnnouncementSerializer(serializers.ModelSerializer):
             return {
                 "id": obj.category.id,
                 "name": obj.category.name,
-                "image": obj.category.image.url if obj.category.image else None
+                "image": obj.category.image.url if obj.category.image else None,
+                "image_variants": image_variant_urls(obj.category.image_variants)
             }
         return None
 
+    def get_is_favorited(self, obj):
+        return obj.pk in favorite_ids(self.context.get('request'))
+
 class AnnouncementCreateSerializer(serializers.ModelSerializer):
     images = serializers.ListField(
         child=serializers.ImageField(),
@@ -76,11 +113,18 @@ class AnnouncementCreateSerializer(serializers.ModelSerializer):
         model = Announcement
         fields = [
             'title', 'description', 'category',
-            'condition', 'location', 'status',
+            'condition', 'location', 'city', 'latitude', 'longitude', 'status',
             'plan', 'price',
             'images'
         ]
 
+    def validate(self, attrs):
+        latitude = attrs.get('latitude', getattr(self.instance, 'latitude', None))
+        longitude = attrs.get('longitude', getattr(self.instance, 'longitude', None))
+        if (latitude is None) != (longitude is None):
+            raise serializers.ValidationError("Укажите широту и долготу вместе.")
+        return attrs
+
     def create(self, validated_data):
         images_data = validated_data.pop('images', [])
         request = self.context.get('request')
@@ -98,11 +142,9 @@ class AnnouncementCreateSerializer(serializers.ModelSerializer):
         return AnnouncementSerializer(instance, context=self.context).data
 
 class CategoryDetailSerializer(serializers.ModelSerializer):
-    announcements = AnnouncementSerializer(many=True, read_only=True)
-
     class Meta:
         model = Category
-        fields = ['id', 'name', 'image', 'announcements']
+        fields = ['id', 'name', 'image', 'parent']
 
 
 
@@ -169,6 +211,30 @@ class ChatSerializer(serializers.ModelSerializer):
         model = Chat
         fields = ['id', 'announcement', 'participants', 'messages', 'created_at']
 
+class InboxSerializer(serializers.ModelSerializer):
+    """One row of a user's chat list; expects the queryset from UserChatsAPIView."""
+    id = serializers.ReadOnlyField(source='chat_id')
+    announcement = serializers.ReadOnlyField(source='chat.announcement_id')
+    participants = serializers.SerializerMethodField()
+    last_message = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatParticipant
+        fields = ['id', 'announcement', 'participants', 'last_message', 'unread_count', 'last_activity_at']
+
+    def get_participants(self, obj):
+        return [user.username for user in obj.chat.participants.all()]
+
+    def get_last_message(self, obj):
+        if obj.last_message_id is None:
+            return None
+        return {
+            "id": obj.last_message_id,
+            "sender": obj.last_message_sender,
+            "text": obj.last_message_text,
+            "created_at": serializers.DateTimeField().to_representation(obj.last_message_created_at),
+        }
+
 class OtherAnnouncementSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -0,0 +1,124 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from mptt.signals import node_moved
+
+from users.models import User
+from .cache import CATEGORY_TREE_NAMESPACE, bump_version, model_namespace
+from . import images, ratings
+from .pubsub import get_broker, user_channel
+from .models import (
+    Announcement, AnnouncementImage, Banner, Category, ChatParticipant, Comment, GalleryImage, Message, News,
+    OtherAnnouncement, Plan,
+)
+from .search import get_backend
+
+
+@receiver(post_save, sender=Announcement)
+@receiver(post_save, sender=OtherAnnouncement)
+def update_search_index(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Announcement)
+@receiver(post_delete, sender=OtherAnnouncement)
+def remove_from_search_index(sender, instance, **kwargs):
+    get_backend().remove(instance)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    bump_version(CATEGORY_TREE_NAMESPACE)
+
+
+@receiver(post_save, sender=Banner)
+@receiver(post_delete, sender=Banner)
+@receiver(post_save, sender=GalleryImage)
+@receiver(post_delete, sender=GalleryImage)
+@receiver(post_save, sender=Plan)
+@receiver(post_delete, sender=Plan)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(node_moved, sender=Category)
+@receiver(post_save, sender=News)
+@receiver(post_delete, sender=News)
+@receiver(post_save, sender=OtherAnnouncement)
+@receiver(post_delete, sender=OtherAnnouncement)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_responses(sender, **kwargs):
+    bump_version(model_namespace(sender))
+
+
+@receiver(post_save, sender=AnnouncementImage)
+@receiver(post_save, sender=Banner)
+@receiver(post_save, sender=GalleryImage)
+@receiver(post_save, sender=Category)
+def render_image_variants(sender, instance, raw=False, **kwargs):
+    if raw or not images.needs_variants(instance):
+        return
+    transaction.on_commit(lambda: images.schedule(instance))
+
+
+@receiver(post_save, sender=AnnouncementImage)
+@receiver(post_delete, sender=AnnouncementImage)
+def touch_announcement(sender, instance, raw=False, **kwargs):
+    # Announcement ETags and Last-Modified are derived from updated_at.
+    if raw:
+        return
+    Announcement.objects.filter(pk=instance.announcement_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        ratings.comment_added(instance)
+    else:
+        # The rating may have been edited, or the comment moved to another
+        # announcement; recount both sides rather than track the old values.
+        ids = {instance.announcement_id, getattr(instance, '_loaded_announcement_id', instance.announcement_id)}
+        ratings.recount_announcements(ids)
+        ratings.recount_sellers(set(Announcement.objects.filter(pk__in=ids).values_list('user_id', flat=True)))
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    ratings.comment_removed(instance)
+
+
+@receiver(post_save, sender=Message)
+def update_chat_inbox(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    # One UPDATE moves the chat to the top of every participant's inbox and
+    # counts the message as unread for everyone but the sender.
+    ChatParticipant.objects.filter(chat_id=instance.chat_id).update(
+        last_activity_at=instance.created_at,
+        unread_count=Case(
+            When(user_id=instance.sender_id, then=F('unread_count')),
+            default=F('unread_count') + 1,
+        ),
+    )
+
+
+@receiver(post_save, sender=Message)
+def publish_chat_message(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+
+    def publish():
+        from .serializers import MessageSerializer
+        event = {"type": "message", "chat": instance.chat_id, "message": MessageSerializer(instance).data}
+        broker = get_broker()
+        for user_id in ChatParticipant.objects.filter(chat_id=instance.chat_id).values_list('user_id', flat=True):
+            broker.publish(user_channel(user_id), event)
+
+    transaction.on_commit(publish)
@@ -1,3 +1,1752 @@
-from django.test import TestCase
+import asyncio
+import fnmatch
+import json
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from mptt.signals import node_moved
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+
+from users.models import Token, User
+from . import analytics, events, facets, geo, images, payments, pubsub, recommendations, view_counter
+from .models import (
+    Category, Announcement, AnnouncementImage, AnnouncementRecommendation, Chat, ChatParticipant, Comment, DailyStats,
+    Favorite, GalleryImage, Message, News, OtherAnnouncement, Payment, Plan,
+)
+from .cache import cache_response, response_cache_stats
+from .search import get_backend
+from .serializers import GalleryImageSerializer
+
+
+def make_user(username='seller'):
+    return User.objects.create(username=username, email=f'{username}@example.com', password='secret')
+
+
+def make_announcements(user, category, count, title='Велосипед'):
+    announcements = []
+    for i in range(count):
+        announcement = Announcement.objects.create(
+            user=user,
+            category=category,
+            title=f'{title} {i}',
+            slug=f'announcement-{Announcement.objects.count()}',
+            description='Горный велосипед в хорошем состоянии',
+            status='published',
+        )
+        AnnouncementImage.objects.create(announcement=announcement, image=f'announcements/{announcement.slug}.png')
+        announcements.append(announcement)
+    return announcements
+
+
+class AnnouncementQueryBudgetTests(TestCase):
+    """The read endpoints must not issue queries per serialized announcement."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.category = Category.objects.create(name='Транспорт')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(ctx.captured_queries)
+
+    def assertConstantQueries(self, url_factory, budget):
+        announcements = make_announcements(self.user, self.category, 2)
+        small = self.count_queries(url_factory(announcements[0]))
+        make_announcements(self.user, self.category, 20, title='Самокат')
+        large = self.count_queries(url_factory(announcements[0]))
+        self.assertEqual(small, large)
+        self.assertLessEqual(large, budget)
+
+    def test_announcement_list(self):
+        self.assertConstantQueries(lambda a: reverse('announcement-list'), 3)
+
+    def test_global_search(self):
+        self.assertConstantQueries(lambda a: reverse('global-search') + '?q=велосипед', 6)
+
+    def test_recommendations(self):
+        def url(announcement):
+            recommendations.rebuild()
+            return reverse('recommendations', args=[announcement.pk])
+        self.assertConstantQueries(url, 2)
+
+    def test_category_detail(self):
+        self.assertConstantQueries(lambda a: reverse('category-detail', args=[self.category.pk]), 4)
+
+    def test_search_vector_is_never_loaded(self):
+        announcement = make_announcements(self.user, self.category, 1)[0]
+        OtherAnnouncement.objects.create(title='Велосипед', description='', image='other_announcements/a.png', phone='+7')
+        urls = [
+            reverse('announcement-list'), reverse('announcement-detail', args=[announcement.pk]),
+            reverse('global-search') + '?q=велосипед', reverse('other_announcements_list_create'),
+        ]
+        for url in urls:
+            with CaptureQueriesContext(connection) as ctx:
+                self.assertEqual(self.client.get(url).status_code, 200)
+            selected = [q['sql'].split(' FROM ')[0] for q in ctx.captured_queries if q['sql'].startswith('SELECT')]
+            self.assertFalse([sql for sql in selected if 'search_vector' in sql], url)
+
+
+class AnnouncementPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.category = Category.objects.create(name='Транспорт')
+        self.announcements = make_announcements(self.user, self.category, 7)
+        for i, announcement in enumerate(self.announcements):
+            Announcement.objects.filter(pk=announcement.pk).update(priority=i % 3 + 1, price=i * 10)
+
+    def collect(self, url):
+        ids, pages = [], []
+        while url:
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            pages.append(len(ctx.captured_queries))
+            url = response.data['next']
+        return ids, pages
+
+    def test_walks_board_order_without_gaps(self):
+        ids, pages = self.collect(reverse('announcement-list') + '?page_size=2')
+        expected = list(Announcement.objects.order_by('-priority', '-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+        self.assertEqual(len(set(pages)), 1)
+
+    def test_ordering_and_filters_apply(self):
+        Announcement.objects.filter(pk=self.announcements[0].pk).update(status='draft')
+        ids, _ = self.collect(reverse('announcement-list') + '?page_size=3&ordering=price&status=published')
+        expected = list(
+            Announcement.objects.filter(status='published').order_by('price', 'id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('announcement-list') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+
+class GlobalSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+
+    def create(self, title, description='', slug=None):
+        return Announcement.objects.create(
+            user=self.user, title=title, slug=slug or title, description=description, status='published',
+        )
+
+    def search(self, query, **params):
+        params['q'] = query
+        response = self.client.get(reverse('global-search'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_title_matches_rank_first(self):
+        in_body = self.create('Шкаф', 'К шкафу прилагается ёлка', slug='in-body')
+        in_title = self.create('Ёлка искусственная', slug='in-title')
+        ids = [item['id'] for item in self.search('елка')['announcements']]
+        self.assertEqual(ids, [in_title.pk, in_body.pk])
+
+    def test_index_follows_save_and_delete(self):
+        announcement = self.create('Диван', slug='sofa')
+        announcement.title = 'Кресло'
+        announcement.save()
+        self.assertEqual(self.search('диван')['announcements'], [])
+        self.assertEqual(len(self.search('кресло')['announcements']), 1)
+        announcement.delete()
+        self.assertEqual(self.search('кресло')['announcements'], [])
+
+    def test_other_announcements_and_pages(self):
+        OtherAnnouncement.objects.create(title='Услуги грузчиков', description='Переезд', image='x.png', phone='1')
+        for i in range(3):
+            self.create(f'Переезд {i}', slug=f'move-{i}')
+        first = self.search('переезд', page_size=2)
+        self.assertTrue(first['has_next'])
+        self.assertEqual(len(first['announcements']), 2)
+        self.assertEqual(len(first['other_announcements']), 1)
+        second = self.search('переезд', page_size=2, page=2)
+        self.assertFalse(second['has_next'])
+        self.assertEqual(len(second['announcements']), 1)
+
+
+class CategorySubtreeTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.transport = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.transport)
+        self.other = Category.objects.create(name='Мебель')
+        self.in_parent = make_announcements(self.user, self.transport, 1)
+        self.in_child = make_announcements(self.user, self.bikes, 2)
+        make_announcements(self.user, self.other, 1)
+
+    def test_list_filter_includes_descendants(self):
+        response = self.client.get(reverse('announcement-list'), {'category': self.transport.pk})
+        ids = {item['id'] for item in response.data['results']}
+        self.assertEqual(ids, {a.pk for a in self.in_parent + self.in_child})
+
+        response = self.client.get(reverse('announcement-list'), {'category': self.bikes.pk})
+        ids = {item['id'] for item in response.data['results']}
+        self.assertEqual(ids, {a.pk for a in self.in_child})
+
+    def test_category_detail_is_paginated(self):
+        url = reverse('category-detail', args=[self.transport.pk])
+        response = self.client.get(url, {'page_size': 2})
+        self.assertEqual(response.data['name'], 'Транспорт')
+        self.assertEqual(len(response.data['announcements']['results']), 2)
+        response = self.client.get(response.data['announcements']['next'])
+        self.assertEqual(len(response.data['announcements']['results']), 1)
+        self.assertIsNone(response.data['announcements']['next'])
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.transport = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.transport)
+        self.cars = Category.objects.create(name='Автомобили', parent=self.transport)
+        self.furniture = Category.objects.create(name='Мебель')
+
+    def get_tree(self):
+        response = self.client.get(reverse('category-tree'))
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_tree_is_built_in_one_query_and_cached(self):
+        with self.assertNumQueries(1):
+            tree = self.get_tree()
+        self.assertEqual([node['name'] for node in tree], ['Мебель', 'Транспорт'])
+        self.assertEqual([node['name'] for node in tree[1]['children']], ['Автомобили', 'Велосипеды'])
+        with self.assertNumQueries(0):
+            self.get_tree()
+
+    def test_cache_is_bumped_on_save_move_and_delete(self):
+        self.get_tree()
+        Category.objects.create(name='Шкафы', parent=self.furniture)
+        self.assertEqual(self.get_tree()[0]['children'][0]['name'], 'Шкафы')
+
+        self.bikes.refresh_from_db()
+        self.furniture.refresh_from_db()
+        Category.objects.move_node(self.bikes, self.furniture)
+        self.assertEqual(len(self.get_tree()[0]['children']), 2)
+
+        self.furniture.delete()
+        self.assertEqual([node['name'] for node in self.get_tree()], ['Транспорт'])
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.transport = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.transport)
+        self.scooters = Category.objects.create(name='Самокаты', parent=self.transport)
+        self.furniture = Category.objects.create(name='Мебель')
+
+    def create(self, title, category, price=1000):
+        return Announcement.objects.create(
+            user=self.user, category=category, title=title, slug=f'slug-{Announcement.objects.count()}',
+            description=title, price=price, status='published',
+        )
+
+    def recommended(self, announcement):
+        response = self.client.get(reverse('recommendations', args=[announcement.pk]))
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data]
+
+    def test_similar_listings_in_scope_and_price_band(self):
+        bike = self.create('Горный велосипед Stels', self.bikes)
+        similar = self.create('Велосипед горный детский', self.bikes)
+        sibling = self.create('Электросамокат и велосипед', self.scooters)
+        self.create('Велосипедная полка', self.furniture)
+        self.create('Горный велосипед карбон', self.bikes, price=100000)
+        self.create('Диван', self.bikes)
+        recommendations.rebuild()
+        self.assertEqual(self.recommended(bike), [similar.pk, sibling.pk])
+
+    def test_incremental_update(self):
+        bike = self.create('Горный велосипед Stels', self.bikes)
+        recommendations.rebuild()
+        self.assertEqual(self.recommended(bike), [])
+
+        new = self.create('Горный велосипед Forward', self.bikes)
+        recommendations.update([new.pk])
+        self.assertEqual(self.recommended(bike), [new.pk])
+        self.assertEqual(self.recommended(new), [bike.pk])
+
+        new.status = 'archived'
+        new.save()
+        recommendations.update([new.pk])
+        self.assertEqual(self.recommended(bike), [])
+
+    def test_common_terms_are_not_indexed(self):
+        bikes = [self.create(f'Продам велосипед {name}', self.bikes) for name in ('Stels', 'Forward', 'Merida')]
+        sofa = self.create('Продам диван', self.bikes)
+        self.bikes.refresh_from_db()
+        with patch.object(recommendations, 'MAX_POSTINGS', 3):
+            corpus = recommendations.load_corpus(self.bikes.tree_id)
+        self.assertNotIn('продам', corpus.postings)
+        self.assertEqual(len(corpus.postings['велоси']), 3)
+        self.assertEqual(corpus.similar(sofa.pk), [])
+        self.assertEqual({pk for pk, _ in corpus.similar(bikes[0].pk)}, {bikes[1].pk, bikes[2].pk})
+
+    def test_unknown_announcement(self):
+        response = self.client.get(reverse('recommendations', args=[999]))
+        self.assertEqual(response.status_code, 404)
+
+
+class ViewCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.announcement = make_announcements(make_user(), Category.objects.create(name='Транспорт'), 1)[0]
+
+    def view(self, address):
+        response = self.client.get(reverse('announcement-detail', args=[self.announcement.pk]), REMOTE_ADDR=address)
+        self.assertEqual(response.status_code, 200)
+
+    def test_views_are_buffered_deduplicated_and_flushed(self):
+        self.view('10.0.0.1')
+        self.view('10.0.0.1')
+        self.view('10.0.0.2')
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 0)
+        self.assertEqual(view_counter.pending(), 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(view_counter.flush(), 2)
+        updates = [query['sql'] for query in ctx.captured_queries if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 2)
+        self.assertEqual(view_counter.flush(), 0)
+
+        response = self.client.get(reverse('announcement-list'))
+        self.assertEqual(response.data['results'][0]['views_count'], 2)
+
+    @override_settings(VIEW_COUNTER_FLUSH_THRESHOLD=2)
+    def test_full_buffer_is_flushed_off_the_request(self):
+        with patch.object(view_counter, '_executor') as executor:
+            self.view('10.0.0.1')
+            self.view('10.0.0.2')
+            self.view('10.0.0.3')
+        # Nothing was written inside the request, and only one flush is queued.
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 0)
+        self.assertEqual(executor.submit.call_count, 1)
+
+        with patch.object(view_counter.connection, 'close'):
+            executor.submit.call_args[0][0]()
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 3)
+        self.assertTrue(view_counter._scheduled.acquire(blocking=False))
+        view_counter._scheduled.release()
+
+    def test_failed_flush_keeps_the_buffer(self):
+        self.view('10.0.0.1')
+        self.view('10.0.0.2')
+        with patch.object(view_counter.Announcement.objects, 'filter', side_effect=RuntimeError('db down')):
+            with self.assertRaises(RuntimeError):
+                view_counter.flush()
+        self.assertEqual(view_counter.pending(), 2)
+        self.assertEqual(view_counter.flush(), 2)
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 2)
+
+
+    def test_flush_waits_for_a_slot_still_being_written(self):
+        self.view('10.0.0.1')
+        # A writer that has taken its sequence number but not filled its slot yet.
+        seq = view_counter._incr(view_counter.SEQ_KEY)
+        self.view('10.0.0.2')
+        self.assertEqual(view_counter.flush(), 1)
+
+        cache.set(f'views:slot:{seq}', self.announcement.pk)
+        self.assertEqual(view_counter.flush(), 2)
+        self.announcement.refresh_from_db()
+        self.assertEqual(self.announcement.views_count, 3)
+        self.assertEqual(view_counter.pending(), 0)
+
+    def test_flush_gives_up_on_an_evicted_slot(self):
+        self.view('10.0.0.1')
+        view_counter._incr(view_counter.SEQ_KEY)
+        self.view('10.0.0.2')
+        with patch.object(view_counter, 'GAP_GRACE', -1):
+            self.assertEqual(view_counter.flush(), 2)
+        self.assertEqual(view_counter.pending(), 0)
+
+    @override_settings(TRUSTED_PROXIES=['127.0.0.1'])
+    def test_viewer_address_comes_from_trusted_proxy_only(self):
+        url = reverse('announcement-detail', args=[self.announcement.pk])
+        for forwarded in ('1.1.1.1, 10.0.0.1', '2.2.2.2, 10.0.0.1'):
+            self.client.get(url, REMOTE_ADDR='127.0.0.1', HTTP_X_FORWARDED_FOR=forwarded)
+        self.assertEqual(view_counter.pending(), 1)
+        with override_settings(TRUSTED_PROXIES=[]):
+            self.client.get(url, REMOTE_ADDR='10.0.0.2', HTTP_X_FORWARDED_FOR='10.0.0.1')
+        self.assertEqual(view_counter.pending(), 2)
+
+
+class DailyStatsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.category = Category.objects.create(name='Транспорт')
+        self.announcements = make_announcements(self.user, self.category, 3)
+        self.today = timezone.localdate()
+        Announcement.objects.filter(pk=self.announcements[0].pk).update(
+            created_at=timezone.now() - timedelta(days=10)
+        )
+        plan = Plan.objects.create(name='top', amount=100, priority=3)
+        Payment.objects.create(user=self.user, announcement=self.announcements[1], plan=plan, amount=100, paid=True)
+        Payment.objects.create(user=self.user, announcement=self.announcements[2], plan=plan, amount=50)
+
+    def test_rollup_and_period_stats(self):
+        analytics.rollup()
+        with self.assertNumQueries(1):
+            stats = analytics.period_stats()
+        self.assertEqual(stats['daily_ann'], 2)
+        self.assertEqual(stats['monthly_ann'], 3)
+        self.assertEqual(stats['daily_pay'], 100)
+        self.assertEqual(stats['total_announcements'], 3)
+        self.assertEqual(stats['total_payments'], 150)
+
+    def test_incremental_rollup_picks_up_changes(self):
+        analytics.rollup()
+        Payment.objects.filter(paid=False).update(paid=True)
+        make_announcements(self.user, self.category, 1, title='Самокат')
+        self.assertLessEqual(analytics.rollup(), analytics.get_lookback() + 1)
+        stats = analytics.period_stats()
+        self.assertEqual(stats['daily_ann'], 3)
+        self.assertEqual(stats['daily_pay'], 150)
+
+    def test_rollup_covers_payments_reconciled_late(self):
+        # reconcile_payments may still mark a payment paid days after it was created.
+        late = Payment.objects.get(paid=False)
+        Payment.objects.filter(pk=late.pk).update(created_at=timezone.now() - timedelta(days=6))
+        analytics.rollup()
+        Payment.objects.filter(pk=late.pk).update(paid=True)
+        analytics.rollup()
+        day = timezone.localdate(timezone.now() - timedelta(days=6))
+        self.assertEqual(DailyStats.objects.get(date=day).paid_amount, 50)
+
+    def test_time_series(self):
+        analytics.rollup()
+        series = analytics.time_series(days=30)
+        self.assertEqual(len(series), 30)
+        self.assertEqual(series[-1]['date'], self.today)
+        self.assertEqual(series[-1]['new_announcements'], 2)
+        self.assertEqual(series[-11]['new_announcements'], 1)
+
+
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, size=(1600, 900)):
+        image = Image.new('RGB', size, 'red')
+        exif = Image.Exif()
+        exif[0x0112] = 6  # rotated 90° clockwise
+        exif[0x010F] = 'PhoneMaker'
+        buffer = BytesIO()
+        image.save(buffer, format='JPEG', exif=exif)
+        return default_storage.save('gallery/photo.jpg', ContentFile(buffer.getvalue()))
+
+    def test_render_variants(self):
+        name = self.upload()
+        variants = images.render_variants(name)
+        self.assertEqual(variants['source'], name)
+        self.assertEqual(set(variants['webp']), {'320', '640'})
+        self.assertEqual(set(variants['jpeg']), {'320', '640'})
+        with default_storage.open(variants['jpeg']['320']) as derivative:
+            rendered = Image.open(derivative)
+            self.assertEqual(rendered.size[0], 320)
+            self.assertGreater(rendered.size[1], rendered.size[0])
+            self.assertEqual(len(rendered.getexif()), 0)
+
+    def test_variants_are_stored_and_serialized(self):
+        # 200x100 stored sideways: 100px wide once the EXIF rotation is applied.
+        gallery_image = GalleryImage.objects.create(image=self.upload(size=(200, 100)))
+        self.assertTrue(images.needs_variants(gallery_image))
+        images.store_variants('blog.GalleryImage', gallery_image.pk, images.render_variants(gallery_image.image.name))
+        gallery_image.refresh_from_db()
+        self.assertFalse(images.needs_variants(gallery_image))
+
+        data = GalleryImageSerializer(gallery_image).data
+        self.assertEqual(data['image_variants']['webp'], {'100': '/media/gallery/derivatives/photo_100.webp'})
+
+
+class ChatInboxTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = make_user()
+        self.buyer = make_user('buyer')
+        self.client.force_authenticate(self.buyer)
+
+    def make_chat(self, messages):
+        announcement = make_announcements(self.seller, None, 1)[0]
+        chat = Chat.objects.create(announcement=announcement)
+        chat.participants.add(self.seller, self.buyer)
+        for i in range(messages):
+            Message.objects.create(chat=chat, sender=self.seller if i % 2 else self.buyer, text=f'Сообщение {i}')
+        return chat
+
+    def inbox(self):
+        response = self.client.get(reverse('user-chats'))
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_last_message_and_unread_counts(self):
+        quiet = self.make_chat(0)
+        busy = self.make_chat(4)
+        inbox = self.inbox()
+        self.assertEqual([row['id'] for row in inbox], [busy.pk, quiet.pk])
+        self.assertEqual(inbox[0]['last_message']['text'], 'Сообщение 3')
+        self.assertEqual(inbox[0]['last_message']['sender'], 'seller')
+        self.assertEqual(inbox[0]['unread_count'], 2)
+        self.assertEqual(sorted(inbox[0]['participants']), ['buyer', 'seller'])
+        self.assertIsNone(inbox[1]['last_message'])
+
+        Message.objects.create(chat=quiet, sender=self.seller, text='Ещё продаёте?')
+        inbox = self.inbox()
+        self.assertEqual([row['id'] for row in inbox], [quiet.pk, busy.pk])
+
+        response = self.client.post(reverse('chat-read', args=[busy.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.inbox()[1]['unread_count'], 0)
+
+    def test_constant_queries(self):
+        self.make_chat(2)
+        with CaptureQueriesContext(connection) as small:
+            self.inbox()
+        for _ in range(5):
+            self.make_chat(10)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(len(self.inbox()), 6)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+        self.assertLessEqual(len(large.captured_queries), 2)
+
+
+class MessageHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = make_user()
+        self.buyer = make_user('buyer')
+        self.client.force_authenticate(self.buyer)
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.seller, self.buyer)
+        self.messages = [
+            Message.objects.create(chat=self.chat, sender=self.seller, text=f'Сообщение {i}') for i in range(7)
+        ]
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def texts(self, data):
+        return [item['text'] for item in data['results']]
+
+    def test_scroll_back_and_fetch_deltas(self):
+        page = self.get(reverse('message-create', args=[self.chat.pk]) + '?page_size=3')
+        self.assertEqual(self.texts(page), ['Сообщение 4', 'Сообщение 5', 'Сообщение 6'])
+        newer = page['newer']
+
+        page = self.get(page['older'])
+        self.assertEqual(self.texts(page), ['Сообщение 1', 'Сообщение 2', 'Сообщение 3'])
+        page = self.get(page['older'])
+        self.assertEqual(self.texts(page), ['Сообщение 0'])
+        self.assertIsNone(page['older'])
+
+        self.assertEqual(self.get(newer)['results'], [])
+        Message.objects.create(chat=self.chat, sender=self.seller, text='Новое')
+        delta = self.get(newer)
+        self.assertEqual(self.texts(delta), ['Новое'])
+        self.assertFalse(delta['has_newer'])
+
+    def test_same_timestamp_is_ordered_by_id(self):
+        Message.objects.filter(chat=self.chat).update(created_at=self.messages[0].created_at)
+        seen = []
+        url = reverse('message-create', args=[self.chat.pk]) + '?page_size=2'
+        while url:
+            page = self.get(url)
+            seen = self.texts(page) + seen
+            url = page['older']
+        self.assertEqual(seen, [f'Сообщение {i}' for i in range(7)])
+
+    def test_other_users_chats_are_hidden(self):
+        self.client.force_authenticate(make_user('stranger'))
+        response = self.client.get(reverse('message-create', args=[self.chat.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class FakeRedis:
+    """Local stand-in for the parts of redis-py RedisBroker uses."""
+
+    def __init__(self):
+        self.pubsubs = []
+
+    def publish(self, channel, data):
+        for pubsub in self.pubsubs:
+            pubsub.push(channel, data)
+
+    def pubsub(self):
+        pubsub = FakePubSub()
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+
+class FakePubSub:
+    async def psubscribe(self, pattern):
+        self.pattern = pattern
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue()
+
+    def push(self, channel, data):
+        if fnmatch.fnmatch(channel, self.pattern):
+            message = {'type': 'pmessage', 'channel': channel.encode(), 'data': data}
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def aclose(self):
+        pass
+
+
+class ChatEventTests(TestCase):
+    def setUp(self):
+        self.seller = make_user()
+        self.buyer = make_user('buyer')
+        self.key = Token.issue(self.buyer)
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.seller, self.buyer)
+
+    def send_message(self, text):
+        with self.captureOnCommitCallbacks(execute=True):
+            Message.objects.create(chat=self.chat, sender=self.seller, text=text)
+
+    async def test_stream_pushes_new_messages(self):
+        response = await self.async_client.get(reverse('chat-events'), {'token': self.key})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        stream = aiter(response.streaming_content)
+        self.assertTrue((await anext(stream)).startswith(b'retry:'))
+
+        await sync_to_async(self.send_message)('Здравствуйте')
+        chunk = (await asyncio.wait_for(anext(stream), 5)).decode()
+        self.assertTrue(chunk.startswith('event: message\n'))
+        event = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(event['chat'], self.chat.pk)
+        self.assertEqual(event['message']['text'], 'Здравствуйте')
+
+        await stream.aclose()
+
+    async def test_stream_unsubscribes_on_disconnect(self):
+        broker = pubsub.get_broker()
+        stream = events.event_stream(self.buyer.pk)
+        await anext(stream)
+        self.assertEqual(broker.subscriber_count(), 1)
+        await stream.aclose()
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    async def test_long_poll_returns_pending_events(self):
+        broker = pubsub.get_broker()
+        poll = asyncio.ensure_future(self.async_client.get(
+            reverse('chat-events-poll'), headers={'Authorization': f'Token {self.key}'},
+        ))
+        for _ in range(100):
+            if broker.subscriber_count():
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(broker.subscriber_count(), 1)
+
+        await sync_to_async(self.send_message)('Здравствуйте')
+        response = await asyncio.wait_for(poll, 5)
+        self.assertEqual(response.status_code, 200)
+        received = response.json()['events']
+        self.assertEqual([(e['chat'], e['message']['text']) for e in received], [(self.chat.pk, 'Здравствуйте')])
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_idle_long_poll_returns_no_events(self):
+        with patch.object(events, 'POLL_TIMEOUT', 0.5):
+            response = self.client.get(reverse('chat-events-poll'), HTTP_AUTHORIZATION=f'Token {self.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'events': []})
+
+    async def test_requires_token(self):
+        response = await self.async_client.get(reverse('chat-events'), {'token': 'wrong'})
+        self.assertEqual(response.status_code, 401)
+
+    async def test_redis_broker_fans_out_across_workers(self):
+        server = FakeRedis()
+        worker_a = pubsub.RedisBroker(client=server, async_client=server)
+        worker_b = pubsub.RedisBroker(client=server, async_client=server)
+        subscription = await worker_b.subscribe(pubsub.user_channel(1))
+        worker_a.publish(pubsub.user_channel(1), {'type': 'message', 'text': 'hi'})
+        worker_a.publish(pubsub.user_channel(2), {'type': 'message', 'text': 'not for you'})
+        self.assertEqual(await subscription.get(timeout=5), {'type': 'message', 'text': 'hi'})
+        self.assertIsNone(await subscription.get(timeout=0.1))
+        subscription.close()
+        worker_b._listener.cancel()
+
+
+class FakeGateway:
+    """Local YooKassa stand-in: answers from ``statuses`` and records concurrency."""
+    statuses = {}
+    created = []
+    delay = 0
+    error = None
+    active = peak = 0
+    lock = threading.Lock()
+
+    def __init__(self, **options):
+        pass
+
+    def create(self, payload, idempotence_key):
+        type(self).created.append(idempotence_key)
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {
+            'id': f'gw-{idempotence_key[:12]}',
+            'status': 'pending',
+            'confirmation_url': f'https://gateway.test/confirm/{idempotence_key[:12]}',
+        }
+
+    def find(self, payment_id):
+        cls = type(self)
+        with cls.lock:
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        try:
+            time.sleep(cls.delay)
+            status = cls.statuses[payment_id]
+            if isinstance(status, Exception):
+                raise status
+            return status
+        finally:
+            with cls.lock:
+                cls.active -= 1
+
+
+@override_settings(PAYMENT_GATEWAY='blog.tests.FakeGateway')
+class PaymentTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.key = Token.issue(self.user)
+        self.announcement = make_announcements(self.user, Category.objects.create(name='Транспорт'), 1)[0]
+        self.plan = Plan.objects.create(name='top', amount=500, priority=3)
+        FakeGateway.statuses, FakeGateway.created, FakeGateway.delay, FakeGateway.error = {}, [], 0, None
+        FakeGateway.peak = 0
+        payments.breaker.reset()
+
+    def make_payment(self, payment_id, age=timedelta(hours=1)):
+        payment = Payment.objects.create(
+            user=self.user, announcement=self.announcement, plan=self.plan, amount=500, payment_id=payment_id,
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - age)
+        return payment
+
+    def notify(self, payment_id, status, ip='185.71.76.10'):
+        body = {'type': 'notification', 'event': f'payment.{status}', 'object': {'id': payment_id, 'status': status}}
+        return self.client.post(reverse('payment-webhook'), body, format='json', REMOTE_ADDR=ip)
+
+    def test_webhook_applies_plan_once(self):
+        payment = self.make_payment('pay-1')
+        self.assertEqual(self.notify('pay-1', 'succeeded').status_code, 200)
+        payment.refresh_from_db()
+        self.announcement.refresh_from_db()
+        self.assertTrue(payment.paid)
+        self.assertEqual((self.announcement.plan, self.announcement.priority), (self.plan, 3))
+
+        # A replayed or late notification changes nothing.
+        Announcement.objects.filter(pk=self.announcement.pk).update(priority=1)
+        self.assertEqual(self.notify('pay-1', 'succeeded').status_code, 200)
+        self.assertEqual(self.notify('pay-1', 'canceled').status_code, 200)
+        payment.refresh_from_db()
+        self.announcement.refresh_from_db()
+        self.assertEqual((payment.status, payment.paid, self.announcement.priority), ('succeeded', True, 1))
+
+    def test_webhook_rejects_untrusted_and_malformed_requests(self):
+        self.make_payment('pay-1')
+        self.assertEqual(self.notify('pay-1', 'succeeded', ip='10.0.0.1').status_code, 403)
+        response = self.client.post(reverse('payment-webhook'), {'object': {}}, format='json', REMOTE_ADDR='185.71.76.10')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.notify('unknown', 'succeeded').status_code, 200)
+        self.assertFalse(Payment.objects.get(payment_id='pay-1').paid)
+
+    def test_paid_webhook_changes_etags(self):
+        self.make_payment('pay-1')
+        urls = [reverse('announcement-detail', args=[self.announcement.pk]), reverse('announcement-list')]
+        etags = [self.client.get(url)['ETag'] for url in urls]
+        self.notify('pay-1', 'succeeded')
+        for url, etag in zip(urls, etags):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_canceled_payment_is_not_applied_by_late_success(self):
+        self.make_payment('pay-1')
+        self.notify('pay-1', 'canceled')
+        self.notify('pay-1', 'succeeded')
+        payment = Payment.objects.get(payment_id='pay-1')
+        self.announcement.refresh_from_db()
+        self.assertEqual((payment.status, payment.paid), ('canceled', False))
+        self.assertIsNone(self.announcement.plan)
+
+    @override_settings(TRUSTED_PROXIES=['10.0.0.0/8'])
+    def test_webhook_behind_trusted_proxy(self):
+        self.make_payment('pay-1')
+        body = {'object': {'id': 'pay-1', 'status': 'succeeded'}}
+        url = reverse('payment-webhook')
+        # A spoofed first hop doesn't help: only the hop our proxy appended counts.
+        response = self.client.post(
+            url, body, format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='185.71.76.10, 203.0.113.5',
+        )
+        self.assertEqual(response.status_code, 403)
+        response = self.client.post(url, body, format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='185.71.76.10')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Payment.objects.get(payment_id='pay-1').paid)
+
+        # Without a trusted proxy the header is ignored.
+        with override_settings(TRUSTED_PROXIES=[]):
+            response = self.client.post(url, body, format='json', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='185.71.76.10')
+        self.assertEqual(response.status_code, 403)
+
+    def test_status_is_read_from_database(self):
+        self.make_payment('pay-1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        url = reverse('payment-status', args=['pay-1'])
+        with patch('yookassa.Payment.find_one', side_effect=AssertionError('gateway called')):
+            self.assertEqual(self.client.get(url).json()['status'], 'pending')
+            self.notify('pay-1', 'succeeded')
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['status'], response.json()['paid']), ('succeeded', True))
+
+    def test_reconcile_resolves_pending_payments_with_bounded_concurrency(self):
+        for i in range(12):
+            self.make_payment(f'pay-{i}')
+            FakeGateway.statuses[f'pay-{i}'] = ('succeeded', 'canceled', 'pending')[i % 3]
+        FakeGateway.statuses['pay-11'] = ConnectionError('gateway down')
+        self.make_payment('fresh', age=timedelta(seconds=10))
+        FakeGateway.delay = 0.05
+
+        with self.assertLogs('blog.payments', 'WARNING'):
+            checked, changed, failed = payments.reconcile(workers=3, batch_size=5)
+        self.assertEqual((checked, changed, failed), (12, 8, 1))
+        self.assertLessEqual(FakeGateway.peak, 3)
+        self.assertEqual(Payment.objects.filter(paid=True).count(), 4)
+        self.assertEqual(Payment.objects.filter(status='canceled').count(), 4)
+        self.assertEqual(Payment.objects.get(payment_id='fresh').status, 'pending')
+
+        # Resolved payments are not asked about again.
+        with self.assertLogs('blog.payments', 'WARNING'):
+            self.assertEqual(payments.reconcile(workers=3)[0], 4)
+
+    def create_payment(self, key=None):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.key}')
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        body = {'announcement': self.announcement.pk, 'plan': self.plan.pk}
+        return self.client.post(reverse('payment-create'), body, format='json', **headers)
+
+    def test_retry_with_idempotency_key_reuses_payment(self):
+        first = self.create_payment(key='attempt-1')
+        second = self.create_payment(key='attempt-1')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(len(FakeGateway.created), 1)
+        self.assertEqual(Payment.objects.count(), 1)
+
+        other_plan = Plan.objects.create(name='basic', amount=100, priority=1)
+        body = {'announcement': self.announcement.pk, 'plan': other_plan.pk}
+        response = self.client.post(reverse('payment-create'), body, format='json', HTTP_IDEMPOTENCY_KEY='attempt-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_retry_without_key_reuses_pending_payment(self):
+        self.assertEqual(self.create_payment().json(), self.create_payment().json())
+        self.assertEqual(len(FakeGateway.created), 1)
+
+    @override_settings(PAYMENT_GATEWAY_TIMEOUT=0.1)
+    def test_slow_gateway_times_out_and_retry_keeps_key(self):
+        FakeGateway.delay = 0.5
+        started = time.monotonic()
+        response = self.create_payment(key='attempt-1')
+        self.assertEqual(response.status_code, 503)
+        self.assertLess(time.monotonic() - started, 0.4)
+
+        FakeGateway.delay = 0
+        response = self.create_payment(key='attempt-1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Payment.objects.count(), 1)
+        # The gateway deduplicates on the key, so the retry can't double charge.
+        self.assertEqual(FakeGateway.created[0], FakeGateway.created[1])
+
+    @override_settings(PAYMENT_BREAKER_THRESHOLD=2, PAYMENT_BREAKER_RESET_TIMEOUT=60)
+    def test_breaker_fails_fast_after_repeated_errors(self):
+        FakeGateway.error = ConnectionError('gateway down')
+        for key in ('a', 'b', 'c', 'd'):
+            self.assertEqual(self.create_payment(key=key).status_code, 503)
+        self.assertEqual(len(FakeGateway.created), 2)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Транспорт')
+        self.user = make_user()
+        self.announcements = make_announcements(self.user, self.category, 3)
+
+    def assertNotModified(self, url, **headers):
+        with self.assertNumQueries(1):
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        return response
+
+    def test_detail(self):
+        announcement = self.announcements[0]
+        url = reverse('announcement-detail', args=[announcement.pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)['ETag'], etag)
+
+        AnnouncementImage.objects.create(announcement=announcement, image='announcements/extra.png')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        Announcement.objects.filter(pk=announcement.pk).update(views_count=10)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(url)['ETag']
+        self.category.name = 'Авто'
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['category']['name'], 'Авто')
+
+        # Without Last-Modified, If-Modified-Since alone never yields a stale 304.
+        Announcement.objects.filter(pk=announcement.pk).update(favorites_count=1)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual((response.status_code, response.json()['favorites_count']), (200, 1))
+
+    def test_filtered_list(self):
+        url = reverse('announcement-list') + '?status=published&page_size=2'
+        etag = self.client.get(url)['ETag']
+        self.assertNotModified(url, HTTP_IF_NONE_MATCH=etag)
+
+        # Other filters fingerprint other rows.
+        other = Category.objects.create(name='Мебель')
+        url = reverse('announcement-list') + f'?category={self.category.pk}&page_size=2'
+        etag = self.client.get(url)['ETag']
+        make_announcements(self.user, other, 1)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        make_announcements(self.user, self.category, 1)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 2)
+
+    def test_list_changes_with_embedded_data_and_deletes(self):
+        cache.clear()
+        url = reverse('announcement-list')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+        etag = response['ETag']
+        self.category.name = 'Авто'
+        self.category.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['category']['name'], 'Авто')
+
+        etag = response['ETag']
+        self.user.username = 'renamed'
+        self.user.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['user'], 'renamed')
+
+        etag = response['ETag']
+        self.announcements[1].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        Plan.objects.create(name='basic', amount=0, priority=1)
+
+    def get(self, url, queries):
+        with self.assertNumQueries(queries):
+            return self.client.get(url)
+
+    def test_hits_until_model_changes(self):
+        url = reverse('plans')
+        first = self.get(url, 1)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        second = self.get(url, 0)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+
+        # Another model's edits leave this entry alone.
+        News.objects.create(title='Новость', content='...')
+        self.assertEqual(self.get(url, 0)['X-Cache'], 'HIT')
+
+        Plan.objects.create(name='top', amount=500, priority=3)
+        response = self.get(url, 1)
+        self.assertEqual(len(response.json()), 2)
+        Plan.objects.filter(name='top').delete()
+        self.assertEqual(len(self.get(url, 1).json()), 1)
+
+        stats = response_cache_stats()['PlanView']
+        self.assertEqual(stats, {'hits': 2, 'misses': 3})
+
+    def test_host_is_part_of_the_key_but_unread_params_are_not(self):
+        url = reverse('other_announcements_list_create')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url + '?x=1')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(url, HTTP_HOST='cdn.example.com')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def test_whitelisted_params_are_normalised(self):
+        class View:
+            @cache_response(Plan, params=('a', 'b'))
+            def get(self, request):
+                return Response({'a': request.GET.get('a')})
+
+        factory = APIRequestFactory()
+        get = lambda query: View().get(Request(factory.get('/plans/' + query)))
+        self.assertEqual(get('?a=1&b=2')['X-Cache'], 'MISS')
+        self.assertEqual(get('?b=2&utm=x&a=1')['X-Cache'], 'HIT')
+        self.assertEqual(get('?a=2&b=2')['X-Cache'], 'MISS')
+
+    def test_moving_a_category_invalidates(self):
+        root = Category.objects.create(name='Транспорт')
+        child = Category.objects.create(name='Велосипеды')
+        url = reverse('categories')
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        # Moves rewrite the neighbours' tree fields with bulk UPDATEs.
+        node_moved.send(sender=Category, instance=child, target=root, position='last-child')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_new_rows_invalidate(self):
+        url = reverse('other_announcements_list_create')
+        self.client.get(url)
+        OtherAnnouncement.objects.create(title='Услуга', description='Ремонт', image='other_announcements/a.png', phone='+7')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()), 1)
+
+
+class FastSerializerTests(TestCase):
+    """The fast path must produce exactly the bytes of the DRF serializers."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = make_user()
+        self.other = make_user('buyer')
+        self.category = Category.objects.create(
+            name='Транспорт', image='blog/category/bikes.png',
+            image_variants={'source': 'blog/category/bikes.png', 'webp': {'320': 'blog/category/derivatives/bikes_320.webp'}},
+        )
+        self.announcements = make_announcements(self.user, self.category, 3, title='Велосипед "Stels" \x01')
+        Announcement.objects.filter(pk=self.announcements[0].pk).update(price='1234.5', condition='б/у', location=None)
+        Announcement.objects.create(user=self.user, title='Без категории', slug='no-category', description='', status='published')
+        AnnouncementImage.objects.filter(announcement=self.announcements[1]).update(
+            image_variants={'source': 'x', 'jpeg': {'320': 'announcements/derivatives/x_320.jpg'}},
+        )
+        AnnouncementImage.objects.create(announcement=self.announcements[2], image='announcements/фото (1) #2.png')
+        for announcement in self.announcements:
+            Comment.objects.create(user=self.other, announcement=announcement, text='Отлично 👍', rating=4)
+        self.chat = Chat.objects.create()
+        self.chat.participants.add(self.user, self.other)
+        for i in range(5):
+            Message.objects.create(chat=self.chat, sender=self.user if i % 2 else self.other, text=f'Сообщение {i}\n')
+
+    def assertSameBytes(self, url, **headers):
+        slow = self.client.get(url, **headers)
+        cache.clear()
+        with override_settings(FAST_READ_SERIALIZERS=True):
+            fast = self.client.get(url, **headers)
+        cache.clear()
+        self.assertEqual(slow.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_announcements(self):
+        response = self.assertSameBytes(reverse('announcement-list') + '?page_size=2&ordering=-price')
+        self.assertSameBytes(response.json()['next'])
+        self.assertSameBytes(reverse('announcement-list') + f'?category={self.category.pk}&search=Stels')
+
+    def test_categories_and_comments(self):
+        self.assertSameBytes(reverse('categories'))
+        self.assertSameBytes(reverse('comments-list-create'))
+        self.assertSameBytes(reverse('comments-list-create') + f'?announcement={self.announcements[0].pk}')
+
+    def test_messages(self):
+        key = Token.issue(self.user)
+        auth = {'HTTP_AUTHORIZATION': f'Token {key}'}
+        response = self.assertSameBytes(reverse('message-create', args=[self.chat.pk]) + '?page_size=2', **auth)
+        self.assertSameBytes(response.json()['older'], **auth)
+
+    def test_renderer_matches_json_renderer(self):
+        from decimal import Decimal
+        from rest_framework.renderers import JSONRenderer
+        from .renderers import ORJSONRenderer
+
+        data = {
+            'text': 'Строка "с" кавычками \\ /   \x00\x1f\t\x7f 😀',
+            'when': timezone.now(), 'day': timezone.localdate(),
+            'price': Decimal('10.50'), 'numbers': [1, 2.5, -0.0, 10 ** 20, None, True],
+            1: 'int key', 'nested': {'empty': {}, 'list': []},
+        }
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+
+class ExportTests(TestCase):
+    def setUp(self):
+        from django.contrib.auth.models import User as StaffUser
+        self.admin = StaffUser.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(self.admin)
+        self.user = make_user()
+        self.plan = Plan.objects.create(name='top', amount=100, priority=2)
+        self.announcements = make_announcements(self.user, None, 3, title='Велосипед, "горный"')
+        Announcement.objects.filter(pk=self.announcements[0].pk).update(plan=self.plan)
+        Payment.objects.create(user=self.user, announcement=self.announcements[0], plan=self.plan, amount=100, paid=True, status='succeeded')
+        Payment.objects.create(user=self.user, announcement=self.announcements[1], plan=self.plan, amount=100)
+
+    def export(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment;', response['Content-Disposition'])
+        return b''.join(response.streaming_content).decode()
+
+    def test_announcement_csv(self):
+        import csv
+        content = self.export(reverse('admin:blog_announcement_export', args=['csv']))
+        self.assertTrue(content.startswith('\ufeff'))
+        header, *rows = csv.reader(content[1:].splitlines())
+        self.assertEqual(header[:3], ['id', 'title', 'user__username'])
+        self.assertEqual(len(rows), 3)
+        titles = {row[1] for row in rows}
+        self.assertIn('Велосипед, "горный" 0', titles)
+
+    def test_csv_escapes_formulas(self):
+        from .exports import csv_lines
+        rows = [('=HYPERLINK("http://evil")', '+7 900', '-1', '@SUM(A1)', 'ok', -5)]
+        content = ''.join(csv_lines(rows, ('a', 'b', 'c', 'd', 'e', 'f')))
+        self.assertEqual(content, '\ufeffa,b,c,d,e,f\r\n"\'=HYPERLINK(""http://evil"")",\'+7 900,\'-1,\'@SUM(A1),ok,-5\r\n')
+
+    def test_filters_match_changelist(self):
+        url = reverse('admin:blog_payment_export', args=['jsonl'])
+        rows = [json.loads(line) for line in self.export(url + '?paid__exact=1').splitlines()]
+        self.assertEqual([row['status'] for row in rows], ['succeeded'])
+        self.assertEqual(rows[0]['announcement__title'], 'Велосипед, "горный" 0')
+        content = self.export(reverse('admin:blog_announcement_export', args=['csv']) + f'?plan__id__exact={self.plan.pk}')
+        self.assertEqual(len(content[1:].splitlines()), 2)
+        self.assertEqual(self.client.get(url + '?nonexistent=1').status_code, 400)
+        self.assertEqual(self.client.get(reverse('admin:blog_payment_export', args=['xml'])).status_code, 404)
+
+    def test_streams_in_chunks(self):
+        url = reverse('admin:blog_announcement_export', args=['jsonl'])
+        with override_settings(EXPORT_CHUNK_SIZE=1), CaptureQueriesContext(connection) as queries:
+            lines = self.export(url).splitlines()
+        self.assertEqual(len(lines), 3)
+        # No COUNT(*) for the changelist paginator, just the rows.
+        self.assertFalse([q for q in queries if 'COUNT(' in q['sql']])
+
+    def test_action_and_permissions(self):
+        ids = [self.announcements[0].pk, self.announcements[2].pk]
+        response = self.client.post(
+            reverse('admin:blog_announcement_changelist'), {'action': 'export_csv', '_selected_action': ids},
+        )
+        lines = b''.join(response.streaming_content).decode()[1:].splitlines()[1:]
+        self.assertEqual(sorted(int(line.split(',')[0]) for line in lines), sorted(ids))
+        changelist = self.client.get(reverse('admin:blog_payment_changelist') + '?paid__exact=1')
+        self.assertContains(changelist, reverse('admin:blog_payment_export', args=['csv']) + '?paid__exact=1')
+
+        self.client.logout()
+        response = self.client.get(reverse('admin:blog_payment_export', args=['csv']))
+        self.assertEqual(response.status_code, 302)
+
+
+class ExpirationTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.announcements = make_announcements(self.user, None, 6)
+
+    def expire(self, announcements, delta):
+        Announcement.objects.filter(pk__in=[a.pk for a in announcements]).update(
+            expiration_date=timezone.now() + delta,
+        )
+
+    def test_archives_expired_in_chunks(self):
+        from . import expiration
+
+        old, fresh, draft = self.announcements[:4], self.announcements[4], self.announcements[5]
+        self.expire(old, -timedelta(days=1))
+        self.expire([fresh], timedelta(days=1))
+        Announcement.objects.filter(pk=draft.pk).update(status='draft', expiration_date=timezone.now() - timedelta(days=1))
+        before = Announcement.objects.get(pk=old[0].pk).updated_at
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(expiration.archive_expired(batch_size=3), 4)
+        # One UPDATE per chunk: 3 + 1 rows.
+        self.assertEqual(len(queries), 2)
+        self.assertTrue(all(q['sql'].startswith('UPDATE') for q in queries))
+
+        statuses = dict(Announcement.objects.values_list('pk', 'status'))
+        self.assertEqual({statuses[a.pk] for a in old}, {'archived'})
+        self.assertEqual(statuses[fresh.pk], 'published')
+        self.assertEqual(statuses[draft.pk], 'draft')
+        self.assertGreater(Announcement.objects.get(pk=old[0].pk).updated_at, before)
+        self.assertEqual(expiration.archive_expired(batch_size=3), 0)
+
+    def test_command(self):
+        from django.core.management import call_command
+
+        self.expire(self.announcements[:2], -timedelta(minutes=1))
+        out = StringIO()
+        call_command('archive_expired', stdout=out)
+        self.assertIn('2 announcements archived', out.getvalue())
+        self.assertEqual(Announcement.objects.filter(status='published').count(), 4)
+
+
+def plan_problems(sql):
+    """Full table scans and sorts EXPLAIN reports for ``sql``, e.g. ['scan blog_comment', 'sort']."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN ' + sql)
+            plan = [row[0] for row in cursor.fetchall()]
+            scan, sort = r'\s*(?:->\s*)?Seq Scan on (\w+)', r'\s*(?:->\s*)?Sort\b'
+        else:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[-1] for row in cursor.fetchall()]
+            scan, sort = r'SCAN (\w+)$', r'USE TEMP B-TREE FOR ORDER BY'
+    problems = []
+    for line in plan:
+        if match := re.match(scan, line):
+            problems.append(f'scan {match.group(1)}')
+        elif re.match(sort, line):
+            problems.append('sort')
+    return problems
+
+
+class QueryPlanTests(TestCase):
+    """
+    The main query of each hot endpoint must be served from an index on a
+    large table: no full table scan and no sort of the matching rows.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        users = [make_user(f'user{i}') for i in range(20)]
+        root = Category.objects.create(name='Транспорт')
+        categories = [root] + [Category.objects.create(name=f'Раздел {i}', parent=root) for i in range(10)]
+        cls.category = categories[3]
+        cls.plan = Plan.objects.create(name='top', amount=100, priority=3)
+        cls.user = users[0]
+        announcements = Announcement.objects.bulk_create(
+            Announcement(
+                user=users[i % 20], category=categories[i % 11], plan=cls.plan if i % 50 == 0 else None,
+                title=f'Велосипед {i}', slug=f'plan-{i}', description='', price=i % 997,
+                status=('published', 'draft', 'archived')[i % 10 % 3], condition=('новое', 'б/у')[i % 2],
+                priority=i % 3 + 1, latitude=40 + i % 300 / 10, longitude=30 + i // 300 * 5,
+                geohash=geo.encode(40 + i % 300 / 10, 30 + i // 300 * 5),
+            )
+            for i in range(3000)
+        )
+        cls.announcement = announcements[0]
+        Comment.objects.bulk_create(
+            Comment(user=users[i % 20], announcement=announcements[i % 3000], text='Отлично') for i in range(6000)
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=users[i % 20], announcement=announcements[i]) for i in range(3000)
+        )
+        AnnouncementRecommendation.objects.bulk_create(
+            AnnouncementRecommendation(announcement=announcements[i], recommended=announcements[(i + j) % 3000], score=j)
+            for i in range(0, 3000, 3) for j in range(1, 6)
+        )
+        chats = Chat.objects.bulk_create(Chat(announcement=announcements[i]) for i in range(300))
+        ChatParticipant.objects.bulk_create(
+            ChatParticipant(chat=chat, user=users[(i + j) % 20]) for i, chat in enumerate(chats) for j in (0, 1)
+        )
+        Message.objects.bulk_create(
+            Message(chat=chats[i % 300], sender=users[i % 20], text='Здравствуйте') for i in range(6000)
+        )
+        cls.chat = chats[0]
+        get_backend().rebuild(Announcement)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def main_query(self, url, table, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        self.assertEqual(response.status_code, 200)
+        return next(
+            q['sql'] for q in queries
+            if q['sql'].startswith('SELECT') and 'ORDER BY' in q['sql']
+            and (f'FROM "{table}"' in q['sql'] or f'FROM {table} ' in q['sql'])
+        )
+
+    def assertIndexed(self, url, table, allow_sort=False, **headers):
+        sql = self.main_query(url, table, **headers)
+        problems = [p for p in plan_problems(sql) if not (allow_sort and p == 'sort')]
+        self.assertEqual(problems, [], f'{url}: {sql}')
+
+    def test_announcement_board(self):
+        url = reverse('announcement-list')
+        for query in (
+            '', '?status=published', '?status=draft', f'?plan={self.plan.pk}', '?condition=б/у',
+            '?ordering=price', '?ordering=-price', '?ordering=-created_at',
+        ):
+            with self.subTest(query=query):
+                self.assertIndexed(url + query, 'blog_announcement')
+        # A category subtree spans several category ids and a location several
+        # geohash ranges, so no single index yields board order: the rows they
+        # select through an index are sorted, but never the whole table.
+        for query in (f'?category={self.category.pk}', '?lat=55.75&lon=37.61&radius=30', '?bbox=50,34,52,36'):
+            with self.subTest(query=query):
+                self.assertIndexed(url + query, 'blog_announcement', allow_sort=True)
+        page = self.client.get(url + '?status=published&ordering=-price').json()
+        self.assertIndexed(page['next'], 'blog_announcement')
+        # A deep page seeks to its position on the leading sort column.
+        page = self.client.get(url + '?status=published&page_size=100').json()
+        sql = self.main_query(page['next'], 'blog_announcement')
+        with connection.cursor() as cursor:
+            cursor.execute(('EXPLAIN ' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN ') + sql)
+            plan = ' '.join(row[-1] for row in cursor.fetchall())
+        self.assertRegex(plan, r'priority\s*<')
+
+    def test_comments_and_favorites(self):
+        self.assertIndexed(reverse('comments-list-create'), 'blog_comment')
+        self.assertIndexed(reverse('comments-list-create') + f'?announcement={self.announcement.pk}', 'blog_comment')
+        key = Token.issue(self.user)
+        self.assertIndexed(reverse('favorites-list-create'), 'blog_favorite', HTTP_AUTHORIZATION=f'Token {key}')
+
+    def test_search_and_recommendations(self):
+        # Results are ranked by relevance, so the matching rows are sorted.
+        table = 'blog_announcement' if connection.vendor == 'postgresql' else 'blog_announcement_fts'
+        self.assertIndexed(reverse('global-search') + '?q=велосипед', table, allow_sort=True)
+        self.assertIndexed(reverse('recommendations', args=[self.announcement.pk]), 'blog_announcement')
+
+    def test_category_detail(self):
+        # A category subtree, like the board's category filter (see above).
+        url = reverse('category-detail', args=[self.category.pk])
+        self.assertIndexed(url, 'blog_announcement', allow_sort=True)
+
+    def test_chats(self):
+        auth = {'HTTP_AUTHORIZATION': f'Token {Token.issue(self.user)}'}
+        self.assertIndexed(reverse('user-chats'), 'blog_chat_participants', **auth)
+        self.assertIndexed(reverse('message-create', args=[self.chat.pk]), 'blog_message', **auth)
+
+    def test_detects_scans_and_sorts(self):
+        self.assertEqual(plan_problems('SELECT * FROM "blog_comment" WHERE "text" = \'x\''), ['scan blog_comment'])
+        self.assertIn('sort', plan_problems('SELECT * FROM "blog_comment" WHERE "announcement_id" = 1 ORDER BY "rating"'))
+
+
+class FavoriteTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.buyer = make_user('buyer')
+        self.announcements = make_announcements(self.user, None, 4)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.buyer)}')
+
+    def favorite(self, announcement):
+        return self.client.post(reverse('favorites-list-create'), {'announcement': announcement.pk})
+
+    def counts(self):
+        return list(Announcement.objects.order_by('pk').values_list('favorites_count', flat=True))
+
+    def test_counts_follow_writes(self):
+        first, second = self.announcements[:2]
+        self.assertEqual(self.favorite(first).status_code, 201)
+        self.assertEqual(self.favorite(second).status_code, 201)
+        self.assertEqual(self.favorite(first).status_code, 400)
+        self.assertEqual(self.counts(), [1, 1, 0, 0])
+
+        other = APIClient()
+        other.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.user)}')
+        other.post(reverse('favorites-list-create'), {'announcement': first.pk})
+        self.assertEqual(self.counts(), [2, 1, 0, 0])
+
+        favorite = Favorite.objects.get(user=self.buyer, announcement=first)
+        self.assertEqual(other.delete(reverse('favorite-delete', args=[favorite.pk])).status_code, 404)
+        self.assertEqual(self.client.delete(reverse('favorite-delete', args=[favorite.pk])).status_code, 204)
+        self.assertEqual(self.counts(), [1, 1, 0, 0])
+
+    def test_list_has_no_n_plus_one(self):
+        for announcement in self.announcements[:2]:
+            self.favorite(announcement)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('favorites-list-create'))
+        few = len(queries)
+        for announcement in self.announcements[2:]:
+            self.favorite(announcement)
+            AnnouncementImage.objects.create(announcement=announcement, image='announcements/extra.png')
+        with self.assertNumQueries(few):
+            response = self.client.get(reverse('favorites-list-create'))
+        self.assertEqual(len(response.json()), 4)
+        self.assertEqual(len(response.json()[0]['announcement_images']), 2)
+
+    def test_is_favorited(self):
+        self.favorite(self.announcements[1])
+        url = reverse('announcement-list')
+        response = self.client.get(url)
+        flags = {row['id']: row['is_favorited'] for row in response.json()['results']}
+        self.assertEqual([pk for pk, flag in flags.items() if flag], [self.announcements[1].pk])
+        self.assertFalse(any(row['is_favorited'] for row in APIClient().get(url).json()['results']))
+
+        # One query for the favorite ids, shared by the validators and all rows.
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertEqual(len([q for q in queries if 'FROM "blog_favorite"' in q['sql']]), 1)
+
+        cache.clear()
+        with override_settings(FAST_READ_SERIALIZERS=True):
+            self.assertEqual(self.client.get(url).content, response.content)
+
+        # Every endpoint that embeds announcements sees the same flags.
+        category = Category.objects.create(name='Транспорт')
+        Announcement.objects.update(category=category, title='Велосипед')
+        for other in self.announcements[1:]:
+            AnnouncementRecommendation.objects.create(announcement=self.announcements[0], recommended=other, score=1)
+        flagged = lambda rows: [row['id'] for row in rows if row['is_favorited']]
+        search = self.client.get(reverse('global-search') + '?q=Велосипед').json()
+        self.assertEqual(flagged(search['announcements']), [self.announcements[1].pk])
+        recommended = self.client.get(reverse('recommendations', args=[self.announcements[0].pk])).json()
+        self.assertEqual(flagged(recommended), [self.announcements[1].pk])
+        detail = self.client.get(reverse('category-detail', args=[category.pk])).json()
+        self.assertEqual(flagged(detail['announcements']['results']), [self.announcements[1].pk])
+
+    def test_etag_follows_favorites(self):
+        url = reverse('announcement-detail', args=[self.announcements[0].pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.favorite(self.announcements[0])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['is_favorited'])
+        self.assertEqual(response.json()['favorites_count'], 1)
+        self.assertIn('Authorization', response['Vary'])
+
+        list_url = reverse('announcement-list')
+        etag = self.client.get(list_url)['ETag']
+        self.favorite(self.announcements[2])
+        self.assertEqual(self.client.get(list_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CommentAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.seller = make_user()
+        self.buyer = make_user('buyer')
+        self.announcements = make_announcements(self.seller, None, 2)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.buyer)}')
+
+    def comment(self, announcement, rating):
+        response = self.client.post(
+            reverse('comments-list-create'), {'announcement': announcement.pk, 'text': 'Отлично', 'rating': rating},
+        )
+        self.assertEqual(response.status_code, 201)
+        return Comment.objects.get(pk=response.json()['id'])
+
+    def aggregates(self):
+        from users.models import UserProfile
+
+        rows = [
+            (a.rating_sum, a.rating_count, a.comments_count, a.rating)
+            for a in Announcement.objects.filter(pk__in=[a.pk for a in self.announcements]).order_by('pk')
+        ]
+        profile = UserProfile.objects.get(user=self.seller)
+        return rows, (profile.rating_sum, profile.rating_count, profile.comments_count, profile.rating)
+
+    def test_follow_comment_writes(self):
+        first, second = self.announcements
+        self.comment(first, 4)
+        comment = self.comment(first, 2)
+        self.comment(second, 5)
+        self.assertEqual(self.aggregates(), ([(6, 2, 2, 3.0), (5, 1, 1, 5.0)], (11, 3, 3, 3.67)))
+
+        comment.rating = 5
+        comment.save()
+        self.assertEqual(self.aggregates(), ([(9, 2, 2, 4.5), (5, 1, 1, 5.0)], (14, 3, 3, 4.67)))
+
+        comment.delete()
+        second.delete()
+        self.assertEqual(self.aggregates(), ([(4, 1, 1, 4.0)], (4, 1, 1, 4.0)))
+
+        response = self.client.get(reverse('announcement-detail', args=[first.pk])).json()
+        self.assertEqual((response['rating'], response['comments_count']), (4.0, 1))
+        seller = APIClient()
+        seller.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.seller)}')
+        self.assertEqual(seller.get(reverse('user-profile')).json()['rating'], 4.0)
+
+    def test_moving_a_comment_recounts_both_announcements(self):
+        from users.models import UserProfile
+
+        first, second = self.announcements
+        other = make_announcements(make_user('other'), None, 1, title='Other')[0]
+        self.comment(first, 4)
+        comment = self.comment(second, 2)
+
+        comment = Comment.objects.get(pk=comment.pk)
+        comment.announcement = first
+        comment.save()
+        self.assertEqual(self.aggregates(), ([(6, 2, 2, 3.0), (0, 0, 0, None)], (6, 2, 2, 3.0)))
+
+        comment.announcement = other
+        comment.save()
+        self.assertEqual(self.aggregates(), ([(4, 1, 1, 4.0), (0, 0, 0, None)], (4, 1, 1, 4.0)))
+        profile = UserProfile.objects.get(user=other.user)
+        self.assertEqual((profile.rating_sum, profile.comments_count, profile.rating), (2, 1, 2.0))
+
+    def test_repair(self):
+        from django.core.management import call_command
+        from users.models import UserProfile
+
+        self.comment(self.announcements[0], 3)
+        self.comment(self.announcements[1], 4)
+        Favorite.objects.create(user=self.buyer, announcement=self.announcements[1])
+        expected = self.aggregates()
+        Announcement.objects.update(rating_sum=100, rating_count=7, comments_count=0, favorites_count=9)
+        UserProfile.objects.all().delete()
+
+        out = StringIO()
+        call_command('repair_counters', batch_size=1, stdout=out)
+        self.assertIn('2 announcements', out.getvalue())
+        self.assertEqual(self.aggregates(), expected)
+        self.assertEqual(
+            list(Announcement.objects.order_by('pk').values_list('favorites_count', flat=True)), [0, 1],
+        )
+
+    def test_comment_list_queries(self):
+        url = reverse('comments-list-create')
+        self.comment(self.announcements[0], 5)
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        for i in range(5):
+            self.comment(self.announcements[i % 2], 4)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()), 6)
+        self.assertEqual(response.json()[0]['user_name'], 'buyer')
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = make_user()
+        self.root = Category.objects.create(name='Транспорт')
+        self.bikes = Category.objects.create(name='Велосипеды', parent=self.root)
+        self.cars = Category.objects.create(name='Машины', parent=self.root)
+        self.other = Category.objects.create(name='Разное')
+        self.plan = Plan.objects.create(name='top', amount=100, priority=3)
+        rows = [
+            (self.bikes, 'новое', 'Москва', self.plan, 500),
+            (self.bikes, 'б/у', 'Москва', None, 4000),
+            (self.cars, 'б/у', 'Казань', None, 700000),
+            (self.other, 'б/у', None, None, 1000),
+            (None, None, 'Казань', self.plan, 0),
+        ]
+        for i, (category, condition, city, plan, price) in enumerate(rows):
+            Announcement.objects.create(
+                user=self.user, category=category, condition=condition, city=city, plan=plan, price=price,
+                title=f'Объявление {i}', slug=f'facet-{i}', description='', status='published',
+            )
+
+    def facets(self, query=''):
+        response = self.client.get(reverse('announcement-facets') + query)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_counts_in_one_query(self):
+        with self.assertNumQueries(2):  # counts + category parents (cached afterwards)
+            data = self.facets()
+        self.assertEqual(data['count'], 5)
+        self.assertEqual(data['category'], [
+            {'id': self.root.pk, 'count': 3}, {'id': self.bikes.pk, 'count': 2},
+            {'id': self.cars.pk, 'count': 1}, {'id': self.other.pk, 'count': 1},
+        ])
+        self.assertEqual(data['condition'], [{'value': 'б/у', 'count': 3}, {'value': 'новое', 'count': 1}])
+        self.assertEqual(data['city'], [{'value': 'Казань', 'count': 2}, {'value': 'Москва', 'count': 2}])
+        self.assertEqual(data['plan'], [{'id': self.plan.pk, 'count': 2}])
+        self.assertEqual([bucket['count'] for bucket in data['price']], [2, 2, 0, 0, 0, 1])
+        self.assertEqual(data['price'][-1], {'min': 100000, 'max': None, 'count': 1})
+
+        key = facets.cache_key(QueryDict(''))
+        cache.delete(key)
+        with self.assertNumQueries(1):
+            self.facets()
+        self.assertIsNotNone(cache.get(key))
+        with self.assertNumQueries(0):
+            self.facets()
+
+    def test_filters_match_board(self):
+        query = f'?category={self.root.pk}&condition=б/у'
+        data = self.facets(query)
+        board = self.client.get(reverse('announcement-list') + query).json()['results']
+        self.assertEqual(data['count'], len(board))
+        self.assertEqual(data['city'], [{'value': 'Казань', 'count': 1}, {'value': 'Москва', 'count': 1}])
+        self.assertEqual(self.facets('?search=Объявление 4')['count'], 1)
+        self.assertEqual(self.client.get(reverse('announcement-facets') + '?category=999').status_code, 400)
+
+    def test_cache_key_is_normalized(self):
+        key = facets.cache_key(QueryDict('condition=б/у&category=1&cursor=abc&page_size=5'))
+        self.assertEqual(key, facets.cache_key(QueryDict('category=1&ordering=-price&condition=б/у&city=')))
+        self.assertNotEqual(key, facets.cache_key(QueryDict('category=2&condition=б/у')))
+
+        self.facets('?condition=б/у')
+        Announcement.objects.filter(condition='б/у').update(condition='новое')
+        self.assertEqual(self.facets('?condition=б/у')['count'], 3)  # cached for FACETS_CACHE_TIMEOUT
+        cache.clear()
+        self.assertEqual(self.facets('?condition=б/у')['count'], 0)
+
+
+class GeoTests(TestCase):
+    MOSCOW = (55.7558, 37.6173)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = make_user()
+        self.places = {}
+        for name, city, point in (
+            ('center', 'г. Москва', None),
+            ('khimki', None, (55.8887, 37.4300)),  # ~18 km
+            ('podolsk', None, (55.4312, 37.5446)),  # ~36 km
+            ('tver', None, (56.8587, 35.9176)),  # ~160 km
+            ('kazan', 'Kazan', None),
+            ('nowhere', 'Деревня', None),
+        ):
+            latitude, longitude = point or (None, None)
+            self.places[name] = Announcement.objects.create(
+                user=self.user, title=name, slug=name, description='', status='published',
+                city=city, latitude=latitude, longitude=longitude,
+            )
+
+    def found(self, query):
+        response = self.client.get(reverse('announcement-list') + query)
+        self.assertEqual(response.status_code, 200)
+        return {row['title'] for row in response.json()['results']}
+
+    def test_geohash(self):
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(geo.next_prefix('bz'), 'c')
+        self.assertIsNone(geo.next_prefix('zz'))
+        self.assertEqual(geo.prefix_ranges(['b0', 'b1', 'b3']), [['b0', 'b2'], ['b3', 'b4']])
+        cells = geo.covering_cells(*geo.radius_box(*self.MOSCOW, 50))
+        self.assertLessEqual(len(cells), 16)
+        for place in ('center', 'khimki', 'podolsk'):
+            self.assertTrue(any(self.places[place].geohash.startswith(cell) for cell in cells))
+
+    def test_city_table(self):
+        center = Announcement.objects.get(slug='center')
+        self.assertEqual((center.latitude, center.longitude), self.MOSCOW)
+        self.assertEqual(center.geohash, geo.encode(*self.MOSCOW))
+        self.assertEqual(geo.city_coordinates('  TOSHKENT '), (41.2995, 69.2401))
+        self.assertEqual(Announcement.objects.get(slug='nowhere').geohash, '')
+
+        Announcement.objects.filter(slug='kazan').update(latitude=None, longitude=None, geohash='')
+        Announcement.objects.filter(slug='tver').update(geohash='')
+        out = StringIO()
+        call_command('geocode_cities', stdout=out)
+        self.assertIn('1 announcements located by city, 1 geohashes filled', out.getvalue())
+        self.assertIn('Деревня', out.getvalue())
+        kazan = Announcement.objects.get(slug='kazan')
+        self.assertEqual((kazan.latitude, kazan.geohash), (55.7963, geo.encode(55.7963, 49.1088)))
+
+    def test_radius_and_bbox(self):
+        lat, lon = self.MOSCOW
+        self.assertEqual(self.found(f'?lat={lat}&lon={lon}&radius=25'), {'center', 'khimki'})
+        self.assertEqual(self.found(f'?lat={lat}&lon={lon}&radius=50'), {'center', 'khimki', 'podolsk'})
+        self.assertEqual(self.found(f'?lat={lat}&lon={lon}&radius=1000'), {'center', 'khimki', 'podolsk', 'tver', 'kazan'})
+        self.assertEqual(self.found('?bbox=55.3,37.0,56.0,38.0'), {'center', 'khimki', 'podolsk'})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.found(f'?lat={lat}&lon={lon}&radius=25')
+        self.assertTrue(any('"geohash" >=' in q['sql'] for q in queries))
+        url = reverse('announcement-list') + f'?lat={lat}&lon={lon}&radius=1000'
+        slow = self.client.get(url).content
+        with override_settings(FAST_READ_SERIALIZERS=True):
+            self.assertEqual(self.client.get(url).content, slow)
+
+        for query in (f'?lat={lat}&lon={lon}', '?bbox=1,2,3', '?bbox=56,37,55,38', '?lat=91&lon=0&radius=1'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(reverse('announcement-list') + query).status_code, 400)
+
+    def test_create_with_coordinates(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.user)}')
+        url = reverse('announcement-list')
+        data = {'title': 'Bike', 'description': 'Новый', 'status': 'published'}
+        self.assertEqual(self.client.post(url, {**data, 'latitude': 55.0}).status_code, 400)
+        response = self.client.post(url, {**data, 'latitude': 43.2220, 'longitude': 76.8512})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json()['latitude'], response.json()['longitude']), (43.2220, 76.8512))
+        response = self.client.post(url, {**data, 'title': 'Scooter', 'city': 'Алматы'})
+        self.assertEqual(response.json()['latitude'], 43.2220)
+
+    def test_city_change_moves_coordinates(self):
+        announcement = Announcement.objects.get(slug='center')
+        announcement.city = 'Казань'
+        announcement.save()
+        announcement = Announcement.objects.get(slug='center')
+        self.assertEqual((announcement.latitude, announcement.longitude), (55.7963, 49.1088))
+        self.assertEqual(announcement.geohash, geo.encode(55.7963, 49.1088))
+        lat, lon = self.MOSCOW
+        self.assertNotIn('center', self.found(f'?lat={lat}&lon={lon}&radius=25'))
+
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {Token.issue(self.user)}')
+        url = reverse('announcement-detail', args=[announcement.pk])
+        response = self.client.patch(url, {'city': 'Москва'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.json()['latitude'], response.json()['longitude']), self.MOSCOW)
+        # Explicit coordinates sent with the city win; an unknown city drops the stale ones.
+        response = self.client.patch(url, {'city': 'Химки', 'latitude': 55.8887, 'longitude': 37.43})
+        self.assertEqual((response.json()['latitude'], response.json()['longitude']), (55.8887, 37.43))
+        response = self.client.patch(url, {'city': 'Деревня'})
+        self.assertIsNone(response.json()['latitude'])
+        self.assertEqual(Announcement.objects.get(pk=announcement.pk).geohash, '')
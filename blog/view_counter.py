@@ -0,0 +1,141 @@
+"""
+Buffered Announcement.views_count.
+
+A view is first de-duplicated per viewer and window with cache.add(), then
+appended to a log kept in the cache (a sequence counter plus one slot per
+view), so any worker or the flush command can see it. flush() folds the log
+into one F() UPDATE per announcement. The cache must be shared between
+workers in production; a lost slot only loses a view.
+
+A writer takes its sequence number before it fills the slot, so a flush can
+find a slot still empty. flush() stops there and picks it up next time; only
+a slot that stays empty for GAP_GRACE seconds (evicted) is given up on.
+
+A request that fills the buffer only schedules a flush on a background
+thread; the flush_view_counts command flushes on a schedule as well.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import F
+
+from .models import Announcement
+from .proxies import client_ip
+
+SEQ_KEY = 'views:seq'
+FLUSHED_KEY = 'views:flushed'
+LOCK_KEY = 'views:flush-lock'
+SLOT_TIMEOUT = 60 * 60 * 24
+CHUNK_SIZE = 1000
+GAP_GRACE = 60
+
+logger = logging.getLogger(__name__)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='view-counter')
+# Held from scheduling until the background flush ends, so at most one is queued.
+_scheduled = threading.Lock()
+
+
+def get_window():
+    return getattr(settings, 'VIEW_COUNTER_WINDOW', 30 * 60)
+
+
+def get_flush_threshold():
+    return getattr(settings, 'VIEW_COUNTER_FLUSH_THRESHOLD', 500)
+
+
+def get_viewer(request):
+    user = getattr(request, 'user', None)
+    if user is not None and getattr(user, 'id', None):
+        return f'user:{user.id}'
+    return f'ip:{client_ip(request)}'
+
+
+def _incr(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key)
+
+
+def record_view(announcement_id, viewer):
+    """Buffer one view. Returns False when the viewer was already counted in this window."""
+    if not cache.add(f'views:seen:{announcement_id}:{viewer}', 1, get_window()):
+        return False
+    seq = _incr(SEQ_KEY)
+    cache.set(f'views:slot:{seq}', announcement_id, SLOT_TIMEOUT)
+    if seq - (cache.get(FLUSHED_KEY) or 0) >= get_flush_threshold():
+        schedule_flush()
+    return True
+
+
+def schedule_flush():
+    """Flush on the background thread unless a flush is already queued there."""
+    if _scheduled.acquire(blocking=False):
+        _executor.submit(_background_flush)
+
+
+def _background_flush():
+    try:
+        flush()
+    except Exception:
+        logger.exception('Could not flush buffered views')
+    finally:
+        _scheduled.release()
+        connection.close()
+
+
+def pending():
+    return (cache.get(SEQ_KEY) or 0) - (cache.get(FLUSHED_KEY) or 0)
+
+
+def _abandoned(seq):
+    """Whether the empty slot ``seq`` has been empty for longer than GAP_GRACE."""
+    key = f'views:gap:{seq}'
+    if time.time() - cache.get_or_set(key, time.time(), SLOT_TIMEOUT) <= GAP_GRACE:
+        return False
+    cache.delete(key)
+    return True
+
+
+def flush():
+    """Persist buffered views. Returns the number of views written."""
+    if not cache.add(LOCK_KEY, 1, 60):
+        return 0
+    try:
+        start = (cache.get(FLUSHED_KEY) or 0) + 1
+        end = cache.get(SEQ_KEY) or 0
+        if end < start - 1:
+            # The sequence was evicted and restarted.
+            start = 1
+        counts = Counter()
+        flushed = start - 1
+        consumed = []
+        for chunk_start in range(start, end + 1, CHUNK_SIZE):
+            keys = [f'views:slot:{seq}' for seq in range(chunk_start, min(chunk_start + CHUNK_SIZE, end + 1))]
+            found = cache.get_many(keys)
+            for seq, key in enumerate(keys, chunk_start):
+                if key in found:
+                    counts[found[key]] += 1
+                    consumed.append(key)
+                elif not _abandoned(seq):
+                    break
+                flushed = seq
+            if flushed < chunk_start + len(keys) - 1:
+                break
+        with transaction.atomic():
+            for announcement_id, count in counts.items():
+                Announcement.objects.filter(pk=announcement_id).update(views_count=F('views_count') + count)
+        # Only once the counts are committed: a failed UPDATE keeps the log for the next flush.
+        cache.set(FLUSHED_KEY, flushed, timeout=None)
+        cache.delete_many(consumed)
+        return sum(counts.values())
+    finally:
+        cache.delete(LOCK_KEY)
@@ -8,60 +8,102 @@ from rest_framework.filters import SearchFilter, OrderingFilter
 from .serializers import (
     CategorySerializer, AnnouncementSerializer, AnnouncementCreateSerializer,
     PaymentSerializer, FavoriteSerializer, CommentSerializer, NewsSerializer,
-    ChatSerializer, MessageSerializer, CategoryDetailSerializer, BannerSerializer,PlanSerializer,GalleryImageSerializer,
+    ChatSerializer, MessageSerializer, InboxSerializer, CategoryDetailSerializer, CategoryTreeSerializer, BannerSerializer,PlanSerializer,GalleryImageSerializer,
     OtherAnnouncementSerializer
 )
+from .cache import CATEGORY_TREE_NAMESPACE, cache_response, versioned_key
+from .conditional import AnnouncementDetailConditionalMixin, AnnouncementListConditionalMixin
+from .fast_serializers import FastReadMixin
+from . import facets, fast_serializers, payments, view_counter
+from .filters import AnnouncementFilter
+from .pagination import AnnouncementPagination, InboxPagination, MessageHistoryPagination
+from .search import get_backend
+from .proxies import client_ip
 from .models import (
     Category, Announcement, Payment, Favorite, Comment,
-    News, Chat, Message, Banner,Plan,GalleryImage,OtherAnnouncement
+    News, Chat, ChatParticipant, Message, Banner,Plan,GalleryImage,OtherAnnouncement
 )
-from django.db.models import Q
-import random
+from django.db import IntegrityError, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.conf import settings
-from yookassa import Configuration, Payment as YooPayment
-import uuid
+from django.core.cache import cache
+from mptt.utils import get_cached_trees
+from yookassa.domain.common import SecurityHelper
 from rest_framework.permissions import IsAdminUser, AllowAny
+from rest_framework.exceptions import ValidationError
 
-Configuration.account_id = settings.YOOKASSA_SHOP_ID
-Configuration.secret_key = settings.YOOKASSA_SECRET_KEY
 
 class BannerView(APIView):
+    @cache_response(Banner)
     def get(self, request):
         banner = Banner.objects.all()
         serializer = BannerSerializer(banner, many=True)
         return Response(serializer.data)
     
 class GalleryImageView(APIView):
+    @cache_response(GalleryImage)
     def get(self, request):
         gallery = GalleryImage.objects.all()
         serializer = GalleryImageSerializer(gallery, many=True)
         return Response(serializer.data)
     
 class PlanView(APIView):
+    @cache_response(Plan)
     def get(self, request):
         plan = Plan.objects.all()
         serializer = PlanSerializer(plan, many=True)
         return Response(serializer.data)
 
-class CategoryView(APIView):
+class CategoryView(FastReadMixin, APIView):
+    @cache_response(Category)
     def get(self, request):
+        if fast_serializers.enabled():
+            return Response(fast_serializers.serialize_categories(fast_serializers.category_rows(Category.objects.all())))
         categories = Category.objects.all()
         serializer = CategorySerializer(categories, many=True)
         return Response(serializer.data)
 
+class CategoryTreeView(APIView):
+    cache_timeout = 60 * 60
+
+    def get(self, request):
+        key = versioned_key(CATEGORY_TREE_NAMESPACE)
+        data = cache.get(key)
+        if data is None:
+            roots = get_cached_trees(Category.objects.order_by('tree_id', 'lft'))
+            data = CategoryTreeSerializer(roots, many=True).data
+            cache.set(key, data, self.cache_timeout)
+        return Response(data)
+
 class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Category.objects.all()
     serializer_class = CategoryDetailSerializer
 
-class AnnouncementListCreateView(generics.ListCreateAPIView):
+    def retrieve(self, request, *args, **kwargs):
+        category = self.get_object()
+        announcements = Announcement.objects.with_related().in_category(category).order_by('-priority', '-created_at')
+        paginator = AnnouncementPagination()
+        page = paginator.paginate_queryset(announcements, request, view=self)
+        data = self.get_serializer(category).data
+        data['announcements'] = paginator.get_paginated_response(AnnouncementSerializer(page, many=True, context={'request': request}).data).data
+        return Response(data)
+
+class AnnouncementListCreateView(AnnouncementListConditionalMixin, FastReadMixin, generics.ListCreateAPIView):
     queryset = Announcement.objects.all().order_by('-priority', '-created_at')
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
-    filterset_fields = ['category', 'condition', 'status', 'plan']
+    filterset_class = AnnouncementFilter
     search_fields = ['title', 'description']
     ordering_fields = ['priority', 'created_at', 'price']
+    pagination_class = AnnouncementPagination
 
     def get_queryset(self):
-        return Announcement.objects.all().order_by('-priority', '-created_at')
+        return Announcement.objects.with_related().order_by('-priority', '-created_at')
+
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers.enabled():
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(fast_serializers.announcement_rows(self.filter_queryset(self.get_queryset())))
+        return self.get_paginated_response(fast_serializers.serialize_announcements(page, request))
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -73,8 +115,18 @@ class AnnouncementListCreateView(generics.ListCreateAPIView):
             raise PermissionDenied("Войдите, чтобы разместить объявление.")
         serializer.save(user=self.request.user)
 
-class AnnouncementDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Announcement.objects.all().order_by('-priority', '-created_at')
+class AnnouncementFacetsView(generics.GenericAPIView):
+    # Same filters as AnnouncementListCreateView, so the sidebar counts match the board.
+    queryset = Announcement.objects.all()
+    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filterset_class = AnnouncementFilter
+    search_fields = ['title', 'description']
+
+    def get(self, request):
+        return Response(facets.cached_facet_counts(self.filter_queryset(self.get_queryset()), request.query_params))
+
+class AnnouncementDetailView(AnnouncementDetailConditionalMixin, generics.RetrieveUpdateDestroyAPIView):
+    queryset = Announcement.objects.with_related().order_by('-priority', '-created_at')
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_fields = ['category', 'condition', 'status', 'plan']
     search_fields = ['title', 'description']
@@ -85,6 +137,12 @@ class AnnouncementDetailView(generics.RetrieveUpdateDestroyAPIView):
             return AnnouncementCreateSerializer
         return AnnouncementSerializer
 
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            view_counter.record_view(self.kwargs['pk'], view_counter.get_viewer(request))
+        return response
+
     def perform_update(self, serializer):
         announcement = self.get_object()
         if announcement.user != self.request.user:
@@ -109,7 +167,8 @@ class CreatePaymentAPIView(APIView):
                 user=request.user,
                 amount=0,
                 payment_id='',
-                paid=True    
+                paid=True,
+                status='succeeded'
             )
             announcement.plan = plan
             announcement.priority = plan.priority
@@ -119,142 +178,161 @@ class CreatePaymentAPIView(APIView):
                 "detail": "это бесплатное объявление",
             }, status=status.HTTP_200_OK)
 
-        yoo_payment = YooPayment.create({
-            "amount": {
-                "value": str(plan.amount),
-                "currency": "RUB"
-            },
-            "confirmation": {
-                "type": "redirect",
-                "return_url": "https://your-site.com/payment/success/"
-            },
-            "capture": True,
-            "description": f"Оплата за объявление '{announcement.title}' по тарифу {plan.name}",
-            "receipt": {
-                "customer": {
-                    "email": request.user.email
-                },
-                "items": [
-                    {
-                        "description": f"Оплата за тариф {plan.name}",
-                        "quantity": "1",
-                        "amount": {
-                            "value": str(plan.amount),
-                            "currency": "RUB"
-                        },
-                        "vat_code": 1,
-                        "payment_mode": "full_payment",
-                        "payment_subject": "service"
-                    }
-                ]
-            }
-        }, uuid.uuid4())
-
-        payment_obj = serializer.save(
-            user=request.user,
-            amount=plan.amount,
-            payment_id=yoo_payment.id
-        )
+        try:
+            payment_obj = payments.start_payment(
+                request.user, announcement, plan, key=request.headers.get('Idempotency-Key'),
+            )
+        except payments.IdempotencyKeyReused:
+            return Response({
+                "detail": "Этот ключ идемпотентности уже использован для другого платежа."
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except payments.GatewayUnavailable:
+            return Response({
+                "detail": "Платёжный сервис временно недоступен, повторите попытку."
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={"Retry-After": "5"})
 
         return Response({
-            "confirmation_url": yoo_payment.confirmation.confirmation_url,
-            "payment_id": yoo_payment.id
+            "confirmation_url": payment_obj.confirmation_url,
+            "payment_id": payment_obj.payment_id
         })
 
 
 
 class CheckPaymentStatusAPIView(APIView):
+    """Answers from the database; the webhook and reconcile_payments keep it current."""
     def get(self, request, payment_id):
         payment = get_object_or_404(Payment, payment_id=payment_id, user=request.user)
-        try:
-            yoo_payment = YooPayment.find_one(payment_id)
-        except Exception as e:
-            return Response({"error": "YooKassa error", "details": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        if yoo_payment.status == 'succeeded':
-            if not payment.paid:
-                payment.paid = True
-                payment.save()
-                announcement = payment.announcement
-                announcement.plan = payment.plan
-                announcement.priority = payment.plan.priority
-                announcement.save()
-            return Response({
-                "payment_id": yoo_payment.id,
-                "status": yoo_payment.status,
-                "paid": payment.paid,
-                "message": "оплата прошла успешно"
-            }, status=status.HTTP_200_OK)
-        elif yoo_payment.status == 'pending':
-            return Response({
-                "payment_id": yoo_payment.id,
-                "status": yoo_payment.status,
-                "paid": payment.paid,
-                "message": "оплата в процессе"
-            }, status=status.HTTP_200_OK)
+        if payment.status == 'succeeded':
+            message, code = "оплата прошла успешно", status.HTTP_200_OK
+        elif payment.status == 'canceled':
+            message, code = "оплата не прошла", status.HTTP_400_BAD_REQUEST
+        else:
+            message, code = "оплата в процессе", status.HTTP_200_OK
         return Response({
-            "payment_id": yoo_payment.id,
-            "status": yoo_payment.status,
+            "payment_id": payment.payment_id,
+            "status": payment.status,
             "paid": payment.paid,
-            "message": "оплата не прошла"
-        }, status=status.HTTP_400_BAD_REQUEST)
+            "message": message
+        }, status=code)
+
+class PaymentWebhookAPIView(APIView):
+    """YooKassa HTTP notifications (payment.succeeded, payment.canceled, ...)."""
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        if getattr(settings, 'YOOKASSA_WEBHOOK_CHECK_IP', True):
+            if not SecurityHelper().is_ip_trusted(client_ip(request)):
+                return Response({"detail": "Недоверенный источник."}, status=status.HTTP_403_FORBIDDEN)
+        payment = request.data.get('object') if isinstance(request.data, dict) else None
+        if not isinstance(payment, dict) or not payment.get('id') or not payment.get('status'):
+            return Response({"detail": "Неверное уведомление."}, status=status.HTTP_400_BAD_REQUEST)
+        # Unknown payments are acknowledged too, otherwise YooKassa keeps retrying.
+        payments.apply_status(payment['id'], payment['status'])
+        return Response(status=status.HTTP_200_OK)
 
 class FavoriteListCreateView(generics.ListCreateAPIView):
     serializer_class = FavoriteSerializer
     def get_queryset(self):
-        return Favorite.objects.filter(user=self.request.user)
+        return (
+            Favorite.objects.filter(user=self.request.user)
+            .select_related('announcement').prefetch_related('announcement__images')
+            .order_by('-created_at')
+        )
     def perform_create(self, serializer):
         if not self.request.user.is_authenticated:
             raise PermissionDenied("Войдите, чтобы добавить объявление в избранное.")
-        serializer.save(user=self.request.user)
+        try:
+            with transaction.atomic():
+                favorite = serializer.save(user=self.request.user)
+                Announcement.objects.filter(pk=favorite.announcement_id).update(
+                    favorites_count=F('favorites_count') + 1
+                )
+        except IntegrityError:
+            raise ValidationError({"detail": "Объявление уже в избранном."})
 
 class FavoriteDeleteView(generics.DestroyAPIView):
     serializer_class = FavoriteSerializer
     def get_queryset(self):
         return Favorite.objects.filter(user=self.request.user)
-    def delete(self, request, *args, **kwargs):
-        return super().delete(request, *args, **kwargs)
-
-class CommentListCreateView(generics.ListCreateAPIView):
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # A concurrent delete of the same favorite removes nothing here.
+            if instance.delete()[0]:
+                Announcement.objects.filter(pk=instance.announcement_id).update(
+                    favorites_count=F('favorites_count') - 1
+                )
+
+class CommentListCreateView(FastReadMixin, generics.ListCreateAPIView):
     serializer_class = CommentSerializer
     def get_queryset(self):
-        queryset = Comment.objects.all().order_by('-created_at')
+        queryset = Comment.objects.select_related('user', 'announcement').order_by('-created_at')
         announcement_id = self.request.query_params.get('announcement')
         if announcement_id:
             queryset = queryset.filter(announcement_id=announcement_id)
         return queryset
+    def list(self, request, *args, **kwargs):
+        if not fast_serializers.enabled():
+            return super().list(request, *args, **kwargs)
+        rows = fast_serializers.comment_rows(self.filter_queryset(self.get_queryset()))
+        return Response(fast_serializers.serialize_comments(rows))
     def perform_create(self, serializer):
         if not self.request.user.is_authenticated:
             raise PermissionDenied("Войдите, чтобы оставить комментарий.")
-        serializer.save()
+        # The Comment signal updates the announcement and seller aggregates in the same transaction.
+        with transaction.atomic():
+            serializer.save()
 
 class AnnouncementRecommendationView(APIView):
+    limit = 5
+
     def get(self, request, pk):
-        try:
-            current_announcement = Announcement.objects.get(pk=pk)
-        except Announcement.DoesNotExist:
-            return Response({"detail": "Объявление не найдено"}, status=404)
-        cat = current_announcement.category
-        queryset = Announcement.objects.filter(category=cat, status='published').exclude(id=pk)
-        all_ids = list(queryset.values_list('id', flat=True))
-        random_ids = random.sample(all_ids, min(len(all_ids), 5)) if all_ids else []
-        recommended = Announcement.objects.filter(pk__in=random_ids)
-        serializer = AnnouncementSerializer(recommended, many=True)
+        # Precomputed by the build_recommendations command.
+        recommended = list(
+            Announcement.objects.with_related()
+            .filter(recommended_for__announcement_id=pk, status='published')
+            .order_by('-recommended_for__score')[:self.limit]
+        )
+        if not recommended and not Announcement.objects.filter(pk=pk).exists():
+            return Response({"detail": "Объявление не найдено"}, status=404)
+        serializer = AnnouncementSerializer(recommended, many=True, context={'request': request})
         return Response(serializer.data, status=200)
 
 class GlobalSearchView(APIView):
+    page_size = 20
+    max_page_size = 100
+    category_limit = 10
+
     def get(self, request):
         query = request.GET.get('q', '').strip()
-        announcements = Announcement.objects.none()
-        if query:
-            announcements = Announcement.objects.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        try:
+            page = max(int(request.GET.get('page', 1)), 1)
+            page_size = min(max(int(request.GET.get('page_size', self.page_size)), 1), self.max_page_size)
+        except ValueError:
+            return Response({"detail": "Неверный номер страницы."}, status=status.HTTP_400_BAD_REQUEST)
+        announcements, other_announcements = [], []
         categories = Category.objects.none()
+        has_next = False
         if query:
-            categories = Category.objects.filter(name__icontains=query)
-        ann_serializer = AnnouncementSerializer(announcements, many=True)
-        cat_serializer = CategorySerializer(categories, many=True)
+            backend = get_backend()
+            offset = (page - 1) * page_size
+            # Fetch one extra row per section to know whether another page exists.
+            announcements = backend.search(Announcement.objects.with_related(), query, offset, page_size + 1)
+            other_announcements = backend.search(OtherAnnouncement.objects.all(), query, offset, page_size + 1)
+            has_next = len(announcements) > page_size or len(other_announcements) > page_size
+            announcements, other_announcements = announcements[:page_size], other_announcements[:page_size]
+            if page == 1:
+                categories = Category.objects.filter(name__icontains=query)[:self.category_limit]
+        context = {'request': request}
+        ann_serializer = AnnouncementSerializer(announcements, many=True, context=context)
+        other_serializer = OtherAnnouncementSerializer(other_announcements, many=True, context=context)
+        cat_serializer = CategorySerializer(categories, many=True, context=context)
         data = {
             "query": query,
+            "page": page,
+            "has_next": has_next,
             "announcements": ann_serializer.data,
+            "other_announcements": other_serializer.data,
             "categories": cat_serializer.data
         }
         return Response(data, status=status.HTTP_200_OK)
@@ -263,6 +341,10 @@ class NewsListView(generics.ListAPIView):
     queryset = News.objects.all().order_by('-created_at')
     serializer_class = NewsSerializer
 
+    @cache_response(News)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 class ChatCreateOrGetAPIView(APIView):
     def post(self, request):
         announcement_id = request.data.get('announcement_id')
@@ -277,7 +359,17 @@ class ChatCreateOrGetAPIView(APIView):
         serializer = ChatSerializer(chat)
         return Response(serializer.data, status=200)
 
-class MessageCreateAPIView(APIView):
+class ChatMessagesAPIView(FastReadMixin, APIView):
+    def get(self, request, chat_id):
+        chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
+        paginator = MessageHistoryPagination()
+        if fast_serializers.enabled():
+            page = paginator.paginate_queryset(fast_serializers.message_rows(chat.messages.all()), request, view=self)
+            return paginator.get_paginated_response(fast_serializers.serialize_messages(page))
+        page = paginator.paginate_queryset(chat.messages.select_related('sender'), request, view=self)
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     def post(self, request, chat_id):
         chat = get_object_or_404(Chat, id=chat_id, participants=request.user)
         serializer = MessageSerializer(data=request.data)
@@ -285,16 +377,41 @@ class MessageCreateAPIView(APIView):
         serializer.save(sender=request.user, chat=chat)
         return Response(serializer.data, status=201)
 
+class ChatReadAPIView(APIView):
+    def post(self, request, chat_id):
+        updated = ChatParticipant.objects.filter(chat_id=chat_id, user=request.user).update(unread_count=0)
+        if not updated:
+            return Response({"detail": "Чат не найден."}, status=404)
+        return Response(status=204)
+
 class UserChatsAPIView(generics.ListAPIView):
-    serializer_class = ChatSerializer
+    serializer_class = InboxSerializer
+    pagination_class = InboxPagination
+
     def get_queryset(self):
-        return self.request.user.chats.all()
+        last_message = Message.objects.filter(chat_id=OuterRef('chat_id')).order_by('-created_at', '-id')
+        return (
+            ChatParticipant.objects.filter(user=self.request.user)
+            .select_related('chat')
+            .prefetch_related('chat__participants')
+            .annotate(
+                last_message_id=Subquery(last_message.values('id')[:1]),
+                last_message_text=Subquery(last_message.values('text')[:1]),
+                last_message_sender=Subquery(last_message.values('sender__username')[:1]),
+                last_message_created_at=Subquery(last_message.values('created_at')[:1]),
+            )
+            .order_by('-last_activity_at', '-id')
+        )
     
 
 class OtherAnnouncementListCreateView(generics.ListCreateAPIView):
     queryset = OtherAnnouncement.objects.all()
     serializer_class = OtherAnnouncementSerializer
 
+    @cache_response(OtherAnnouncement)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
 
 class OtherAnnouncementRetrieveUpdateDestroyView(generics.RetrieveUpdateDestroyAPIView):
     queryset = OtherAnnouncement.objects.all()
@@ -83,6 +83,80 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cache versions, view counts and cached responses must be visible to every
+# worker, so production points CACHE_BACKEND/CACHE_LOCATION at a shared cache
+# (e.g. django.core.cache.backends.redis.RedisCache). locmem is per process.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    }
+}
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+# Serve the announcement, category, comment and message lists from .values()
+# rows rendered with orjson (blog.fast_serializers). The output is the same.
+FAST_READ_SERIALIZERS = False
+
+# Rows fetched per round trip by the admin CSV / JSONL exports (blog.exports).
+EXPORT_CHUNK_SIZE = 2000
+
+# Announcements archived per UPDATE by the archive_expired command.
+EXPIRATION_BATCH_SIZE = 1000
+
+# /blog/announcements/facets/: price bucket upper bounds and how long the
+# counts for one filter state are cached.
+FACETS_PRICE_BUCKETS = (1000, 5000, 10000, 50000, 100000)
+FACETS_CACHE_TIMEOUT = 60
+
+# Announcement.geohash length (9 ~ 5 m cells) and how many cells a near-me or
+# bbox search may be split into; more cells mean finer pruning, more ranges.
+GEOHASH_PRECISION = 9
+GEOHASH_MAX_CELLS = 16
+
+# Authenticated tokens are cached in each worker (short TTL, LRU) and in the
+# shared cache. A token deleted elsewhere stays valid in other workers for at
+# most TOKEN_LOCAL_CACHE_TTL seconds.
+TOKEN_CACHE_TTL = 300
+TOKEN_LOCAL_CACHE_TTL = 30
+TOKEN_LOCAL_CACHE_SIZE = 1024
+
+# Announcement views are de-duplicated per viewer for this many seconds and
+# buffered in the cache until flush_view_counts runs or the buffer fills up.
+VIEW_COUNTER_WINDOW = 30 * 60
+VIEW_COUNTER_FLUSH_THRESHOLD = 500
+
+# Worker processes that render resized image variants in the background.
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# Fan-out for real-time chat events (blog.events). The in-process broker
+# only reaches subscribers of the same worker; with several ASGI workers use
+# 'blog.pubsub.RedisBroker' with PUBSUB_OPTIONS = {'url': 'redis://...'}.
+PUBSUB_BACKEND = 'blog.pubsub.InProcessBroker'
+PUBSUB_OPTIONS = {}
+
+# Addresses (or networks) of our reverse proxies. Only X-Forwarded-For hops
+# they appended are believed when working out the client address
+# (blog.proxies.client_ip); empty means REMOTE_ADDR is the client.
+TRUSTED_PROXIES = []
+
+# Payment status comes from YooKassa notifications (blog/payments/webhook/).
+# reconcile_payments polls the gateway for pending payments older than
+# PAYMENT_RECONCILE_MIN_AGE seconds that the webhook has not resolved.
+PAYMENT_GATEWAY = 'blog.payments.YooKassaGateway'
+YOOKASSA_WEBHOOK_CHECK_IP = True
+PAYMENT_RECONCILE_MIN_AGE = 300
+PAYMENT_RECONCILE_MAX_AGE_DAYS = 7
+
+# Gateway calls made while serving a request run on a small per-process pool
+# and are abandoned after PAYMENT_GATEWAY_TIMEOUT seconds. After
+# PAYMENT_BREAKER_THRESHOLD consecutive failures payment creation fails fast
+# for PAYMENT_BREAKER_RESET_TIMEOUT seconds.
+PAYMENT_GATEWAY_WORKERS = 8
+PAYMENT_GATEWAY_TIMEOUT = 5
+PAYMENT_BREAKER_THRESHOLD = 5
+PAYMENT_BREAKER_RESET_TIMEOUT = 30
+
 CORS_ORIGIN_ALLOW_ALL = True
 
 CORS_ORIGIN_WHITELIST = ("http://localhost:3000")
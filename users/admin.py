@@ -12,8 +12,8 @@ class UserAdmin(admin.ModelAdmin):
 
 @admin.register(Token)
 class TokenAdmin(admin.ModelAdmin):
-    list_display = ('id', 'user', 'token')
-    search_fields = ('user__username', 'token')
+    list_display = ('id', 'user', 'digest')
+    search_fields = ('user__username', 'digest')
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
@@ -1,5 +1,38 @@
 from rest_framework import authentication, exceptions
-from .models import Token
+from .models import Token, User
+from .tokens import make_digest, token_cache
+
+# Never copied into the shared cache; loaded on access if anything needs it.
+PRIVATE_USER_FIELDS = ('password',)
+
+
+def _fields(instance, exclude=()):
+    return {
+        field.attname: getattr(instance, field.attname)
+        for field in instance._meta.concrete_fields if field.name not in exclude
+    }
+
+
+def _from_fields(model, fields):
+    return model.from_db('default', list(fields), list(fields.values()))
+
+
+def get_token(key):
+    """Token (with its user loaded) for a raw key, or None."""
+    digest = make_digest(key)
+    cached = token_cache.get(digest)
+    if cached is None:
+        try:
+            token_obj = Token.objects.select_related('user').get(digest=digest)
+        except Token.DoesNotExist:
+            return None
+        # Plain field values rather than the instances: no password hash in the
+        # shared cache, and no model instance shared between requests.
+        token_cache.set(digest, (_fields(token_obj), _fields(token_obj.user, PRIVATE_USER_FIELDS)))
+        return token_obj
+    token_obj = _from_fields(Token, cached[0])
+    token_obj.user = _from_fields(User, cached[1])
+    return token_obj
 
 class CustomTokenAuthentication(authentication.BaseAuthentication):
     keyword = 'Token' 
@@ -17,10 +50,8 @@ class CustomTokenAuthentication(authentication.BaseAuthentication):
         if len(parts) != 2 or parts[0] != self.keyword:
             return None
 
-        token_str = parts[1]
-        try:
-            token_obj = Token.objects.get(token=token_str)
-        except Token.DoesNotExist:
+        token_obj = get_token(parts[1])
+        if token_obj is None:
             raise exceptions.AuthenticationFailed("Token is invalid")
 
         user = token_obj.user
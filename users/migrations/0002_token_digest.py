@@ -0,0 +1,37 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:05
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_existing_tokens(apps, schema_editor):
+    Token = apps.get_model('users', 'Token')
+    for token in Token.objects.all().iterator():
+        token.digest = hashlib.sha256(token.token.encode()).hexdigest()
+        token.save(update_fields=['digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='token',
+            name='digest',
+            field=models.CharField(max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_existing_tokens, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='token',
+            name='token',
+        ),
+        migrations.AlterField(
+            model_name='token',
+            name='digest',
+            field=models.CharField(max_length=64, unique=True),
+        ),
+    ]
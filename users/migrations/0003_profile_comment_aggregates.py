@@ -0,0 +1,47 @@
+# Generated by Django 5.1.6 on 2026-10-18 20:33
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_comments(apps, schema_editor):
+    UserProfile = apps.get_model('users', 'UserProfile')
+    Announcement = apps.get_model('blog', 'Announcement')
+    Comment = apps.get_model('blog', 'Comment')
+    sellers = Announcement.objects.filter(comments__isnull=False).values_list('user_id', flat=True).distinct()
+    UserProfile.objects.bulk_create([UserProfile(user_id=pk) for pk in sellers], ignore_conflicts=True)
+    comments = Comment.objects.filter(announcement__user=OuterRef('user_id')).order_by().values('announcement__user')
+    count = Coalesce(Subquery(comments.annotate(value=Count('id')).values('value')), 0)
+    UserProfile.objects.update(
+        rating_sum=Coalesce(Subquery(comments.annotate(value=Sum('rating')).values('value')), 0),
+        rating_count=count,
+        comments_count=count,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_token_digest'),
+        ('blog', '0018_comment_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_comments, migrations.RunPython.noop),
+    ]
@@ -3,6 +3,7 @@ from django.contrib.auth.hashers import make_password, check_password
 from django.utils import timezone
 import secrets
 from datetime import timedelta
+from .tokens import generate_key, make_digest
 # Create your models here.
 
 class User(models.Model):
@@ -38,22 +39,40 @@ class User(models.Model):
 
 class Token(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    token = models.CharField(max_length=255)
+    digest = models.CharField(max_length=64, unique=True)
 
     def __str__(self):
-        return self.token
+        return self.digest
+
+    @classmethod
+    def issue(cls, user):
+        """Create a token for ``user`` and return the raw key, which is never stored."""
+        key = generate_key()
+        cls.objects.create(user=user, digest=make_digest(key))
+        return key
     
     class Meta:
         db_table = "tokens"
         verbose_name = "Токен"
         verbose_name_plural = "Токены"
 
+def rating_average(rating_sum, rating_count):
+    return round(rating_sum / rating_count, 2) if rating_count else None
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
     bio = models.TextField(blank=True, null=True)
     telegram_link = models.URLField(blank=True, null=True)
     instagram_link = models.URLField(blank=True, null=True)
+    # Comments left on the user's announcements, kept in step by blog's Comment signals.
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    comments_count = models.PositiveIntegerField(default=0, editable=False)
+
+    @property
+    def rating(self):
+        return rating_average(self.rating_sum, self.rating_count)
 
     def __str__(self):
         return self.user.username
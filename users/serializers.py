@@ -1,5 +1,4 @@
 from rest_framework import serializers
-import secrets
 from .models import User, Token ,UserProfile
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -17,8 +16,7 @@ class RegisterSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         validated_data.pop('password2')
         user = User.objects.create(**validated_data)
-        token_str = secrets.token_hex(32)
-        Token.objects.create(user=user, token=token_str)
+        Token.issue(user)
         return user
 
 
@@ -42,10 +40,11 @@ class LoginSerializer(serializers.Serializer):
     
 class UserProfileSerializer(serializers.ModelSerializer):
     user_id = serializers.ReadOnlyField(source='user.id')
+    rating = serializers.ReadOnlyField()
     class Meta:
         model = UserProfile
-        fields = ['user_id', 'avatar', 'bio', 'telegram_link', 'instagram_link']
-        read_only_fields = ['user_id']
+        fields = ['user_id', 'avatar', 'bio', 'telegram_link', 'instagram_link', 'rating', 'rating_count', 'comments_count']
+        read_only_fields = ['user_id', 'rating_count', 'comments_count']
     
 # class PasswordResetRequestSerializer(serializers.Serializer):
 #     email = serializers.EmailField()
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Token, User
+from .tokens import token_cache
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    # Covers logins, the admin and tokens cascade-deleted with their user.
+    token_cache.invalidate([instance.digest])
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, raw=False, **kwargs):
+    # Cached tokens carry a copy of the user's fields.
+    if raw:
+        return
+    token_cache.invalidate(Token.objects.filter(user=instance).values_list('digest', flat=True))
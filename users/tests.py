@@ -1,3 +1,84 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .models import Token, User
+from .tokens import make_digest, token_cache
+
+
+class TokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create(username='seller', email='seller@example.com', password='secret')
+
+    def login(self):
+        self.client.credentials()
+        response = self.client.post(reverse('login'), {'email': 'seller@example.com', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def get_profile(self, key):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {key}')
+        return self.client.get(reverse('user-profile'))
+
+    def test_only_digest_is_stored(self):
+        key = self.login()
+        self.assertFalse(Token.objects.filter(digest=key).exists())
+        self.assertTrue(Token.objects.filter(digest=make_digest(key), user=self.user).exists())
+
+    def test_token_and_user_load_once_then_come_from_cache(self):
+        key = self.login()
+        self.get_profile(key)
+        # Only the view's own profile queries are left.
+        with self.assertNumQueries(2):
+            response = self.get_profile(key)
+        self.assertEqual(response.data['user_id'], self.user.pk)
+
+        # Without the local LRU it comes from the shared cache.
+        token_cache.clear()
+        with self.assertNumQueries(2):
+            self.get_profile(key)
+
+        # A cold cache costs one select_related query for token and user.
+        cache.clear()
+        token_cache.clear()
+        with self.assertNumQueries(3):
+            self.get_profile(key)
+
+    def test_login_invalidates_previous_token(self):
+        old_key = self.login()
+        self.assertEqual(self.get_profile(old_key).status_code, 200)
+        new_key = self.login()
+        self.assertEqual(self.get_profile(old_key).status_code, 403)
+        self.assertEqual(self.get_profile(new_key).status_code, 200)
+
+    def test_deleted_tokens_and_users_are_dropped_from_cache(self):
+        key = self.login()
+        self.assertEqual(self.get_profile(key).status_code, 200)
+        Token.objects.all().delete()
+        self.assertEqual(self.get_profile(key).status_code, 403)
+
+        key = self.login()
+        self.assertEqual(self.get_profile(key).status_code, 200)
+        self.user.delete()
+        self.assertEqual(self.get_profile(key).status_code, 403)
+
+    def test_shared_cache_holds_no_password_and_follows_user_edits(self):
+        key = self.login()
+        self.get_profile(key)
+        cached = cache.get(token_cache.key_prefix + make_digest(key))
+        self.assertNotIn('password', cached[1])
+        self.assertEqual(cached[1]['username'], 'seller')
+
+        self.user.username = 'renamed'
+        self.user.save()
+        token_cache.clear()
+        self.assertIsNone(cache.get(token_cache.key_prefix + make_digest(key)))
+        self.get_profile(key)
+        self.assertEqual(cache.get(token_cache.key_prefix + make_digest(key))[1]['username'], 'renamed')
+
+    def test_unknown_token(self):
+        self.assertEqual(self.get_profile('missing').status_code, 403)
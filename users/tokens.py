@@ -0,0 +1,82 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def generate_key():
+    return secrets.token_hex(32)
+
+
+def make_digest(key):
+    """Only the SHA-256 of a token is stored, so a leaked table can't be replayed."""
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+class TokenCache:
+    """
+    Two-level cache of authenticated tokens keyed by digest: a small in-process
+    LRU in front of Django's shared cache. The local TTL is kept short because
+    another worker's LRU can only be invalidated by expiry.
+    """
+    key_prefix = 'auth-token:'
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'TOKEN_LOCAL_CACHE_SIZE', 1024)
+
+    @property
+    def local_ttl(self):
+        return getattr(settings, 'TOKEN_LOCAL_CACHE_TTL', 30)
+
+    @property
+    def shared_ttl(self):
+        return getattr(settings, 'TOKEN_CACHE_TTL', 300)
+
+    def get(self, digest):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                expires_at, token = entry
+                if expires_at > now:
+                    self._entries.move_to_end(digest)
+                    return token
+                del self._entries[digest]
+        token = cache.get(self.key_prefix + digest)
+        if token is not None:
+            self._remember(digest, token)
+        return token
+
+    def set(self, digest, token):
+        cache.set(self.key_prefix + digest, token, self.shared_ttl)
+        self._remember(digest, token)
+
+    def invalidate(self, digests):
+        digests = list(digests)
+        cache.delete_many([self.key_prefix + digest for digest in digests])
+        with self._lock:
+            for digest in digests:
+                self._entries.pop(digest, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, digest, token):
+        with self._lock:
+            self._entries[digest] = (time.monotonic() + self.local_ttl, token)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+token_cache = TokenCache()
@@ -6,7 +6,6 @@ from rest_framework import status
 
 from .serializers import RegisterSerializer, LoginSerializer, UserProfileSerializer
 from .models import Token, UserProfile
-import secrets
 
 class RegisterView(APIView):
     def post(self, request):
@@ -25,14 +24,14 @@ class LoginView(APIView):
         if serializer.is_valid():
             user = serializer.validated_data['user']
 
+            # users.signals drops the deleted tokens from token_cache.
             Token.objects.filter(user=user).delete()
 
-            new_token_value = secrets.token_hex(32)
-            token_obj = Token.objects.create(user=user, token=new_token_value)
+            key = Token.issue(user)
 
             return Response({
                 "message": "Вы успешно вошли в систему!",
-                "token": token_obj.token
+                "token": key
             }, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     